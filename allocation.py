@@ -0,0 +1,127 @@
+import bisect
+import math
+import time as _time
+from collections import namedtuple
+
+# =========================
+# АВТОПОДБОР СТОЛА
+# =========================
+# Гость указывает число гостей, время и длительность, а стол подбирается сам.
+# DayIndex — занятость всех столов за день в памяти: маска минут на стол (как в
+# AvailabilityEngine, бит i = минута i окна занята) и столы, сгруппированные по
+# вместимости. Строится из одного запроса (столы LEFT JOIN брони дня) и живёт в
+# кэше занятости, пока брони этого дня не изменятся.
+#
+# Лучший стол — наименьшей подходящей вместимости (большие столы остаются для
+# больших компаний); среди столов одной вместимости — тот, где после брони
+# останется меньше всего свободных минут вокруг неё (свободное время не дробится
+# на окна, в которые никто не поместится).
+
+TableInfo = namedtuple("TableInfo", ("table_id", "capacity", "zone"))
+
+
+class DayIndex:
+    """Занятость всех столов за один день: маски минут и столы по вместимости."""
+
+    __slots__ = ("grid", "tables", "masks", "capacities", "groups")
+
+    def __init__(self, grid, tables, masks):
+        self.grid = grid
+        self.tables = tables  # table_id -> TableInfo
+        self.masks = masks    # table_id -> маска занятых минут
+        groups = {}
+        for info in tables.values():
+            groups.setdefault(info.capacity, []).append(info)
+        self.capacities = sorted(groups)
+        self.groups = [sorted(groups[c], key=lambda t: t.table_id) for c in self.capacities]
+
+    def leftover(self, table_id, offset, minutes):
+        """Сколько свободных минут останется вокруг [offset, offset + minutes); None — интервал занят."""
+        mask = self.masks[table_id]
+        end = offset + minutes
+        if (mask >> offset) & ((1 << minutes) - 1):
+            return None
+        before = offset - (mask & ((1 << offset) - 1)).bit_length()
+        after = mask >> end
+        after = ((after & -after).bit_length() - 1) if after else self.grid.minutes - end
+        return before + after
+
+    def best_fit(self, offset, minutes, guests, zone=None):
+        """(TableInfo, leftover) лучшего свободного стола или None."""
+        for group in self.groups[bisect.bisect_left(self.capacities, guests):]:
+            best = None
+            for info in group:
+                if zone is not None and info.zone != zone:
+                    continue
+                left = self.leftover(info.table_id, offset, minutes)
+                if left is not None and (best is None or left < best[1]):
+                    best = (info, left)
+                    if left == 0:
+                        break
+            if best is not None:
+                return best
+        return None
+
+
+class TableAllocator:
+    """Подбор стола и ближайших свободных вариантов поверх сетки AvailabilityEngine."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def build(self, day, rows) -> DayIndex:
+        """DayIndex из строк (table_id, capacity, zone, booking_for, duration_hours), по строке на бронь;
+        у стола без броней — одна строка с booking_for = NULL."""
+        grid = self.engine.day_grid(day)
+        tables, bookings = {}, {}
+        for row in rows:
+            table_id = row['table_id']
+            if table_id not in tables:
+                tables[table_id] = TableInfo(table_id, row['capacity'], row['zone'])
+                bookings[table_id] = []
+            if row['booking_for'] is not None:
+                bookings[table_id].append(row)
+        masks = {table_id: self.engine.busy_mask(grid, own) for table_id, own in bookings.items()}
+        return DayIndex(grid, tables, masks)
+
+    def offset(self, index, booking_start):
+        """Смещение начала брони в минутах от открытия (может быть вне окна)."""
+        return math.floor((booking_start.timestamp() - index.grid.start_ts) / 60)
+
+    def allocate(self, index, booking_start, duration_hours, guests, zone=None):
+        """Лучший свободный стол на точное время или None (время вне рабочего окна — тоже None)."""
+        minutes = duration_hours * 60
+        offset = self.offset(index, booking_start)
+        if offset < 0 or offset + minutes > index.grid.minutes:
+            return None
+        found = index.best_fit(offset, minutes, guests, zone)
+        return found[0] if found else None
+
+    def suggest(self, index, booking_start, duration_hours, guests, zone=None, limit=5, max_shift_minutes=180,
+                now_ts=None):
+        """Ближайшие к запрошенному времени свободные варианты (по одному лучшему столу на время).
+
+        Возвращает список словарей time / table_id / capacity / zone / shift_minutes,
+        от меньшего сдвига к большему (при равном сдвиге — более раннее время).
+        """
+        if now_ts is None:
+            now_ts = _time.time()
+        grid = index.grid
+        minutes = duration_hours * 60
+        requested = self.offset(index, booking_start)
+        first_start = math.ceil((now_ts + self.engine.lead_minutes * 60 - grid.start_ts) / 60)
+        candidates = sorted(
+            ((abs(offset - requested), offset, label) for offset, label in grid.slots
+             if max(first_start, 0) <= offset <= grid.minutes - minutes and abs(offset - requested) <= max_shift_minutes),
+        )
+        result = []
+        for shift, offset, label in candidates:
+            found = index.best_fit(offset, minutes, guests, zone)
+            if found is None:
+                continue
+            info = found[0]
+            result.append({"time": label, "table_id": info.table_id, "capacity": info.capacity, "zone": info.zone,
+                           "shift_minutes": offset - requested})
+            if len(result) >= limit:
+                break
+        return result
@@ -0,0 +1,311 @@
+"""Асинхронный (ASGI) режим HTTP API: /book, /get_booked_times и /webhook.
+
+Альтернатива 'lis:create_app()' под gunicorn: один процесс uvicorn держит сотни
+одновременных запросов, потому что ожидание Postgres (asyncpg) и Telegram
+(httpx) не занимает поток.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    # или несколько процессов:
+    gunicorn -k uvicorn.workers.UvicornWorker -w 2 -b 0.0.0.0:5000 asgi:app
+
+Проверка запроса и тексты уведомлений (booking.py), SQL (queries.py, outbox.py, pg_listener.py),
+кэш занятости и сетка слотов — те же, что у Flask-приложения в lis.py.
+Обработчики бота написаны для telebot и psycopg2, поэтому /webhook сразу
+отвечает Telegram и передаёт Update в фоновую обработку lis.submit_update();
+уведомления о бронях из outbox отправляет асинхронный клиент Bot API.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from telebot import types
+
+import lis
+from booking import BookingError, booking_messages, parse_booking_request, parse_duration_hours
+from cache import MISSING
+from clock import local_day, now_local
+from dispatch import QueueFull
+from metrics import HTTP_REQUEST_SECONDS, PROMETHEUS_CONTENT_TYPE, REGISTRY
+from outbox import ENQUEUE_SQL
+from pg_listener import BOOKINGS_CHANNEL, NOTIFY_SQL, booking_change_payload
+from queries import PREPARED_STATEMENTS, TABLE_DAY_BOOKINGS_SQL, BookingConflict, day_bounds, has_overlap, pg_params
+from telegram_async import AsyncTelegramClient
+
+log = logging.getLogger("lis.asgi")
+
+# Пул asyncpg на процесс: соединение занято только на время запроса к БД
+ASGI_DB_POOL_MIN = int(os.environ.get("ASGI_DB_POOL_MIN", "2"))
+ASGI_DB_POOL_MAX = int(os.environ.get("ASGI_DB_POOL_MAX", "20"))
+ASGI_DB_COMMAND_TIMEOUT = float(os.environ.get("ASGI_DB_COMMAND_TIMEOUT", "10"))
+# Одновременных HTTP-соединений с Bot API
+ASGI_TELEGRAM_CONNECTIONS = int(os.environ.get("ASGI_TELEGRAM_CONNECTIONS", "100"))
+
+
+# Те же запросы, что готовит пул psycopg2; asyncpg сам готовит каждый один раз на соединение
+INSERT_SQL = PREPARED_STATEMENTS["booking_insert"]
+TABLE_DAY_FOR_UPDATE_SQL = PREPARED_STATEMENTS["booking_lock_table_day"]
+TABLE_DAY_SQL = pg_params(TABLE_DAY_BOOKINGS_SQL)
+OUTBOX_SQL = pg_params(ENQUEUE_SQL)
+BOOKING_NOTIFY_SQL = pg_params(NOTIFY_SQL)
+
+
+class AsyncState:
+    """Ресурсы процесса, создаваемые в lifespan: пул asyncpg и клиент Bot API."""
+
+    pool = None
+    replica_pools = {}  # имя реплики (lis.get_replica_router) -> пул asyncpg
+    telegram = None
+    loop = None
+
+
+state = AsyncState()
+
+
+# =========================
+# БРОНИРОВАНИЕ
+# =========================
+async def insert_booking_async(conn, conflict_mode, req, booked_at):
+    """Асинхронный аналог queries.insert_booking (внутри транзакции); BookingConflict — при пересечении."""
+    params = (req.user_id, req.user_name, req.phone, req.table_id, req.time_slot, req.guests, booked_at,
+              req.booking_start, req.duration_hours)
+    if conflict_mode == "exclusion":
+        try:
+            return await conn.fetchval(INSERT_SQL, *params)
+        except asyncpg.exceptions.ExclusionViolationError as e:
+            raise BookingConflict(f"Стол {req.table_id} уже занят на {req.booking_start}.") from e
+    start, end = day_bounds(local_day(req.booking_start))
+    existing = await conn.fetch(TABLE_DAY_FOR_UPDATE_SQL, req.table_id, start, end)
+    if has_overlap(existing, req.booking_start, req.booking_start + timedelta(hours=req.duration_hours)):
+        raise BookingConflict(f"Стол {req.table_id} уже занят на {req.booking_start}.")
+    return await conn.fetchval(INSERT_SQL, *params)
+
+
+async def book(request):
+    """POST /book — то же, что lis.book_api."""
+    try:
+        try:
+            req = parse_booking_request(await request.json())
+        except BookingError as e:
+            return JSONResponse({"status": "error", "message": e.message}, e.status)
+        if req.table_id is None:
+            # Автоподбор стола читает занятость дня из кэша и пула lis (синхронный путь, в отдельном потоке)
+            try:
+                await asyncio.to_thread(lis.book_auto, req)
+            except BookingConflict as e:
+                alternatives = await asyncio.to_thread(lis.suggest_tables, req)
+                return JSONResponse({"status": "error", "message": str(e), "alternatives": alternatives}, 409)
+            return JSONResponse({"status": "ok", "message": "Бронь успешно создана"})
+
+        async with state.pool.acquire() as conn:
+            async with conn.transaction():
+                try:
+                    booking_id = await insert_booking_async(conn, lis.BOOKING_CONFLICT_MODE, req, now_local())
+                except BookingConflict:
+                    return JSONResponse({"status": "error", "message": "Стол уже занят на выбранное время."}, 409)
+                if lis.BOOKINGS_NOTIFY:
+                    await conn.execute(BOOKING_NOTIFY_SQL, BOOKINGS_CHANNEL, booking_change_payload(
+                        "insert", req.table_id, req.booking_start, booking_id, req.user_id))
+                for chat_id, kind, text, parse_mode in booking_messages(req, lis.ADMIN_ID):
+                    await conn.execute(OUTBOX_SQL, chat_id, kind, text, parse_mode)
+        lis.invalidate_availability(req.table_id, req.booking_start)
+        lis.invalidate_user_booking(req.user_id)
+        lis.schedule_reminder(booking_id, req.booking_start)
+        lis.outbox_committed()
+
+        return JSONResponse({"status": "ok", "message": "Бронь успешно создана"})
+
+    except Exception as e:
+        log.exception("Ошибка /book: %s", e)
+        return JSONResponse({"status": "error", "message": str(e)}, 500)
+
+
+# Ошибки соединения с репликой, после которых чтение повторяется в основной БД
+REPLICA_CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+                             asyncpg.ConnectionDoesNotExistError)
+
+
+async def fetch_read(keys, sql, *args):
+    """Чтение, как lis.read_connection: с реплики, если она не отстаёт и ключи keys недавно не записывались."""
+    router = lis.get_replica_router()
+    replica = router.choose(*keys) if router is not None else None
+    if replica is not None:
+        try:
+            async with state.replica_pools[replica.name].acquire() as conn:
+                return await conn.fetch(sql, *args)
+        except REPLICA_CONNECTION_ERRORS as e:
+            router.mark_down(replica, e)
+    async with state.pool.acquire() as conn:
+        return await conn.fetch(sql, *args)
+
+
+async def get_booked_times(request):
+    """GET /get_booked_times — то же, что lis.get_booked_times (общий кэш занятости процесса)."""
+    try:
+        table_id = request.query_params.get('table')
+        date_str = request.query_params.get('date')
+        try:
+            duration_hours = parse_duration_hours(request.query_params.get('duration_hours', 1))
+        except BookingError as e:
+            return JSONResponse({"status": "error", "message": e.message}, e.status)
+
+        if not all([table_id, date_str]):
+            return JSONResponse({"status": "error", "message": "Не хватает данных (стол или дата)"}, 400)
+
+        query_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        table_id = int(table_id)
+
+        cache = lis.get_availability_cache()
+        key = (table_id, query_date)
+        bookings = cache.get(key)
+        if bookings is MISSING:
+            token = cache.token()
+            bookings = await fetch_read((lis.table_day_read_key(table_id, query_date),),
+                                        TABLE_DAY_SQL, table_id, *day_bounds(query_date))
+            cache.set(key, bookings, token=token)
+
+        return JSONResponse({"status": "ok", "free_times": lis.availability.free_times(query_date, bookings, duration_hours)})
+
+    except Exception as e:
+        log.exception("Ошибка /get_booked_times: %s", e)
+        return JSONResponse({"status": "error", "message": str(e)}, 500)
+
+
+# =========================
+# WEBHOOK
+# =========================
+async def webhook(request):
+    """Отвечает 200, как только диспетчер lis принял Update; обработка — в его пуле потоков (по WEBHOOK_DISPATCH_MODE — пачками)."""
+    if request.headers.get("content-type") != "application/json":
+        log.warning("Webhook: получены не-JSON данные, игнорирую.")
+        return PlainTextResponse("Non-JSON data received", 403)
+    try:
+        update = types.Update.de_json((await request.body()).decode("utf-8"))
+        # В режиме batch submit ждёт ответа диспетчера — не в цикле событий
+        await asyncio.to_thread(lis.submit_update, update)
+    except QueueFull as e:
+        # Очередь переполнена: не-200 заставит Telegram повторить доставку позже
+        log.warning("Webhook: очередь переполнена, обновление отклонено: %s", e)
+        return PlainTextResponse("Busy", 503)
+    except Exception as e:
+        log.exception("Webhook: ошибка обработки обновления: %s", e)
+    return PlainTextResponse("!")
+
+
+async def index(request):
+    return PlainTextResponse("Bot is running (asgi)")
+
+
+async def metrics(request):
+    return Response(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+# =========================
+# ЖИЗНЕННЫЙ ЦИКЛ
+# =========================
+def deliver_outbox(row):
+    """Доставка строки outbox из потока ретранслятора: корутина уходит в цикл событий, возвращается Future."""
+    return asyncio.run_coroutine_threadsafe(
+        state.telegram.send_message(row['chat_id'], row['text'], parse_mode=row['parse_mode']), state.loop)
+
+
+def _pool_stats():
+    if state.pool is None:
+        return {}
+    return {"size": state.pool.get_size(), "idle": state.pool.get_idle_size(), "max": state.pool.get_max_size()}
+
+
+REGISTRY.gauges("asgi_db_pool", "Пул asyncpg", _pool_stats)
+REGISTRY.gauges("asgi_telegram", "Асинхронный клиент Bot API", lambda: state.telegram.stats() if state.telegram else {})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Логирование, проверка окружения и миграции — как у gunicorn-приложения
+    lis.create_app()
+    state.loop = asyncio.get_running_loop()
+    state.pool = await asyncpg.create_pool(
+        lis.DATABASE_URL, min_size=ASGI_DB_POOL_MIN, max_size=ASGI_DB_POOL_MAX, command_timeout=ASGI_DB_COMMAND_TIMEOUT)
+    router = lis.get_replica_router()
+    if router is not None:
+        # Отставание реплик проверяет поток lis; здесь — только пулы asyncpg для чтения (соединения по требованию)
+        for replica, url in zip(router.replicas, lis.DATABASE_REPLICA_URLS):
+            state.replica_pools[replica.name] = await asyncpg.create_pool(
+                url, min_size=0, max_size=ASGI_DB_POOL_MAX, command_timeout=ASGI_DB_COMMAND_TIMEOUT)
+    state.telegram = await AsyncTelegramClient(
+        lis.BOT_TOKEN,
+        api_url=lis.TELEGRAM_API_URL or "https://api.telegram.org",
+        global_rate=lis.OUTBOUND_GLOBAL_RATE,
+        chat_rate=lis.OUTBOUND_CHAT_RATE,
+        chat_burst=lis.OUTBOUND_CHAT_BURST,
+        max_retries=lis.OUTBOUND_MAX_RETRIES,
+        max_connections=ASGI_TELEGRAM_CONNECTIONS,
+    ).start()
+    lis.set_outbox_deliver(deliver_outbox)
+    lis.get_outbox_relay()
+    if lis.REMINDER_LEAD_MIN > 0:
+        lis.get_reminder_scheduler()
+    log.info("ASGI-приложение запущено", extra={"db_pool_max": ASGI_DB_POOL_MAX})
+    try:
+        yield
+    finally:
+        # Напоминания — до ретранслятора: последняя пачка ещё будит его
+        await asyncio.to_thread(lis._stop_reminders)
+        # Ретранслятор останавливаем, пока цикл событий и клиент ещё живы: он ждёт отправленное
+        await asyncio.to_thread(lis.get_outbox_relay().shutdown, lis.OUTBOX_LEASE_SEC / 2)
+        await state.telegram.close()
+        for pool in state.replica_pools.values():
+            await pool.close()
+        await state.pool.close()
+
+
+class MetricsMiddleware:
+    """Гистограмма http_request_duration_seconds, как у instrument_flask (метка route — путь маршрута)."""
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = frozenset(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = ["500"]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope["path"] if scope["path"] in self.routes else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route, scope["method"], status[0])
+
+
+routes = [
+    Route("/", index),
+    Route("/book", book, methods=["POST"]),
+    Route("/get_booked_times", get_booked_times, methods=["GET"]),
+    Route("/webhook", webhook, methods=["POST"]),
+    Route("/metrics", metrics),
+]
+
+app = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    middleware=[
+        Middleware(MetricsMiddleware, routes=[route.path for route in routes]),
+        Middleware(CORSMiddleware, allow_origins=["https://gitrepo-drab.vercel.app"], allow_credentials=True,
+                   allow_methods=["*"], allow_headers=["*"]),
+    ],
+)
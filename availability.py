@@ -0,0 +1,102 @@
+import math
+import time as _time
+from datetime import datetime, time
+from functools import lru_cache
+
+from clock import localize
+
+# =========================
+# ДВИЖОК ДОСТУПНОСТИ СЛОТОВ
+# =========================
+# Рабочее окно дня представлено целочисленной сеткой минут от момента открытия.
+# Занятость стола — битовая маска (Python int, бит i = минута i занята).
+# Слот [s, s + N) свободен, если (mask >> s) & ((1 << N) - 1) == 0,
+# поэтому проверка одного слота не зависит от количества броней.
+
+
+class DayGrid:
+    """Сетка рабочего окна одного дня: начало (epoch), длина в минутах и подписи слотов."""
+
+    __slots__ = ("day", "start_ts", "minutes", "slots")
+
+    def __init__(self, day, start_ts, minutes, slots):
+        self.day = day
+        self.start_ts = start_ts
+        self.minutes = minutes
+        self.slots = slots  # [(смещение в минутах, "HH:MM"), ...]
+
+
+class AvailabilityEngine:
+    """Считает свободные времена начала для одного или многих столов.
+
+    open_time / close_time — рабочее окно (по местному времени), step_minutes — шаг
+    сетки слотов, lead_minutes — сколько минут от текущего момента слот ещё нельзя занять.
+    """
+
+    def __init__(self, tzinfo, open_time=time(12, 0), close_time=time(23, 0), step_minutes=30, lead_minutes=30):
+        self.tzinfo = tzinfo
+        self.open_time = open_time
+        self.close_time = close_time
+        self.step_minutes = step_minutes
+        self.lead_minutes = lead_minutes
+        self.day_grid = lru_cache(maxsize=128)(self._build_grid)
+
+    def _build_grid(self, day) -> DayGrid:
+        start = localize(day, self.open_time, self.tzinfo)
+        end = localize(day, self.close_time, self.tzinfo)
+        start_ts = start.timestamp()
+        # Реально прошедшие минуты: при переходе на летнее/зимнее время окно короче/длиннее
+        minutes = int((end.timestamp() - start_ts) // 60)
+        slots = []
+        for offset in range(0, minutes, self.step_minutes):
+            local = datetime.fromtimestamp(start_ts + offset * 60, self.tzinfo)
+            slots.append((offset, f"{local.hour:02d}:{local.minute:02d}"))
+        return DayGrid(day, start_ts, minutes, slots)
+
+    def busy_mask(self, grid, bookings) -> int:
+        """Маска занятых минут окна для списка броней (booking_for, duration_hours)."""
+        mask = 0
+        start_ts = grid.start_ts
+        limit = grid.minutes
+        for b in bookings:
+            booking_for = b['booking_for']
+            if booking_for.tzinfo is None:
+                booking_for = booking_for.replace(tzinfo=self.tzinfo)
+            rel = booking_for.timestamp() - start_ts
+            s = math.floor(rel / 60)
+            e = math.ceil((rel + (b.get('duration_hours') or 1) * 3600) / 60)
+            if e <= 0 or s >= limit:
+                continue
+            s = max(s, 0)
+            e = min(e, limit)
+            mask |= ((1 << (e - s)) - 1) << s
+        return mask
+
+    def free_starts(self, grid, mask, duration_minutes, now_ts=None) -> list:
+        """Свободные времена начала для длительности duration_minutes по маске занятости."""
+        window = (1 << duration_minutes) - 1
+        last_start = grid.minutes - duration_minutes
+        first_start = 0
+        if now_ts is not None:
+            first_start = math.ceil((now_ts + self.lead_minutes * 60 - grid.start_ts) / 60)
+        return [label for offset, label in grid.slots
+                if first_start <= offset <= last_start and not (mask >> offset) & window]
+
+    def free_times(self, day, bookings, duration_hours, now_ts=None) -> list:
+        """Свободные времена начала для одного стола на день."""
+        if now_ts is None:
+            now_ts = _time.time()
+        grid = self.day_grid(day)
+        return self.free_starts(grid, self.busy_mask(grid, bookings), duration_hours * 60, now_ts)
+
+    def free_times_many(self, day, bookings_by_table, duration_hours, now_ts=None) -> dict:
+        """Свободные времена начала для многих столов на день: {table_id: [...]}."""
+        if now_ts is None:
+            now_ts = _time.time()
+        grid = self.day_grid(day)
+        duration_minutes = duration_hours * 60
+        return {
+            table_id: self.free_starts(grid, self.busy_mask(grid, bookings), duration_minutes, now_ts)
+            for table_id, bookings in bookings_by_table.items()
+        }
+
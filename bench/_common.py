@@ -0,0 +1,69 @@
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+# =========================
+# ОБЩЕЕ ДЛЯ БЕНЧМАРКОВ
+# =========================
+# Результаты всех бенчмарков пишутся в одном формате (JSON), чтобы их можно
+# было сравнивать между релизами.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, p):
+    """Перцентиль p (0..100) по отсортированной выборке, линейная интерполяция."""
+    if not samples:
+        return 0.0
+    data = sorted(samples)
+    k = (len(data) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (k - lo)
+
+
+def summarize(samples_sec, elapsed_sec=None):
+    """Сводка по задержкам (в миллисекундах) и пропускной способности."""
+    ms = [s * 1000.0 for s in samples_sec]
+    result = {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 4) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 4),
+        "p90_ms": round(percentile(ms, 90), 4),
+        "p99_ms": round(percentile(ms, 99), 4),
+        "max_ms": round(max(ms), 4) if ms else 0.0,
+    }
+    if elapsed_sec:
+        result["rps"] = round(len(ms) / elapsed_sec, 2)
+    return result
+
+
+def timed(fn, repeat):
+    """Вызывает fn() repeat раз и возвращает список длительностей в секундах."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def write_results(name, results, path=None):
+    """Печатает результаты и, если задан путь (или BENCH_OUTPUT), сохраняет их в JSON."""
+    doc = {
+        "benchmark": name,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    text = json.dumps(doc, ensure_ascii=False, indent=2, default=str)
+    print(text)
+    path = path or os.environ.get("BENCH_OUTPUT")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return doc
@@ -0,0 +1,111 @@
+"""Микробенчмарк автоподбора стола на полностью загруженный вечер: перебор броней против DayIndex.
+
+Запросов к БД нет — строки "столы LEFT JOIN брони дня" (как у queries.fetch_tables_day)
+генерируются в памяти. Столы вместимостью 2/4/6/8, вечер (с 17:00 до закрытия)
+забит бронями по 1–3 часа вплотную, свободными остаются лишь редкие окна
+(--free-ratio). Замеряется:
+  build    — построение DayIndex из строк запроса;
+  allocate — лучший стол на 19:00 для компании, перебором (queries.has_overlap по
+             броням каждого подходящего стола, как проверка при вставке) и по DayIndex;
+  suggest  — ближайшие свободные варианты (TableAllocator.suggest).
+Перед замером проверяется, что оба способа находят свободный стол одной вместимости.
+
+    python bench/bench_allocation.py --tables 20,100,300 --repeat 2000
+"""
+import argparse
+import random
+from datetime import date, datetime, timedelta
+
+from _common import summarize, timed, write_results
+from allocation import TableAllocator
+from availability import AvailabilityEngine
+from clock import RESTAURANT_TZ, localize
+from queries import has_overlap
+
+CAPACITIES = (2, 2, 4, 4, 4, 6, 6, 8)
+
+
+def make_rows(rnd, day, tables, free_ratio):
+    """Строки (table_id, capacity, zone, booking_for, duration_hours) загруженного вечера."""
+    rows = []
+    close = localize(day, datetime.strptime("23:00", "%H:%M").time())
+    for table_id in range(1, tables + 1):
+        capacity = CAPACITIES[table_id % len(CAPACITIES)]
+        zone = "terrace" if table_id % 5 == 0 else "hall"
+        start = localize(day, datetime.strptime("17:00", "%H:%M").time())
+        own = []
+        while start < close:
+            duration = rnd.randint(1, 3)
+            if rnd.random() >= free_ratio:
+                own.append((start, duration))
+            start += timedelta(hours=duration)
+        if not own:
+            rows.append({"table_id": table_id, "capacity": capacity, "zone": zone, "booking_for": None,
+                         "duration_hours": None})
+        for booking_for, duration in own:
+            rows.append({"table_id": table_id, "capacity": capacity, "zone": zone, "booking_for": booking_for,
+                         "duration_hours": duration})
+    return rows
+
+
+def legacy_allocate(rows_by_table, capacities, booking_start, duration_hours, guests):
+    """Первый свободный стол наименьшей подходящей вместимости: проверка пересечений по броням каждого стола."""
+    booking_end = booking_start + timedelta(hours=duration_hours)
+    for table_id in sorted(rows_by_table, key=lambda t: (capacities[t], t)):
+        if capacities[table_id] >= guests and not has_overlap(rows_by_table[table_id], booking_start, booking_end):
+            return table_id
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", default="20,100,300", help="число столов через запятую")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--guests", type=int, default=6)
+    parser.add_argument("--duration", type=int, default=2, help="длительность брони, ч")
+    parser.add_argument("--free-ratio", type=float, default=0.1, help="доля броней, оставленных свободными")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    engine = AvailabilityEngine(RESTAURANT_TZ)
+    allocator = TableAllocator(engine)
+    day = date.today() + timedelta(days=3)
+    booking_start = localize(day, datetime.strptime("19:00", "%H:%M").time())
+    now_ts = datetime.now(RESTAURANT_TZ).timestamp()
+    results = {"guests": args.guests, "duration_hours": args.duration, "free_ratio": args.free_ratio}
+
+    for count in [int(c) for c in args.tables.split(",") if c.strip()]:
+        rnd = random.Random(args.seed)
+        rows = make_rows(rnd, day, count, args.free_ratio)
+        rows_by_table, capacities = {}, {}
+        for row in rows:
+            capacities[row['table_id']] = row['capacity']
+            own = rows_by_table.setdefault(row['table_id'], [])
+            if row['booking_for'] is not None:
+                own.append(row)
+        index = allocator.build(day, rows)
+
+        legacy = legacy_allocate(rows_by_table, capacities, booking_start, args.duration, args.guests)
+        found = allocator.allocate(index, booking_start, args.duration, args.guests)
+        assert (legacy is None) == (found is None), (legacy, found)
+        assert legacy is None or capacities[legacy] == found.capacity, (legacy, found)
+
+        results[f"{count}_tables"] = {
+            "bookings": sum(len(own) for own in rows_by_table.values()),
+            "found_table": found.table_id if found else None,
+            "build": summarize(timed(lambda: allocator.build(day, rows), max(1, args.repeat // 10))),
+            "allocate": {
+                "legacy": summarize(timed(lambda: legacy_allocate(
+                    rows_by_table, capacities, booking_start, args.duration, args.guests), args.repeat)),
+                "index": summarize(timed(lambda: allocator.allocate(
+                    index, booking_start, args.duration, args.guests), args.repeat)),
+            },
+            "suggest": summarize(timed(lambda: allocator.suggest(
+                index, booking_start, args.duration, args.guests, now_ts=now_ts), args.repeat)),
+        }
+    write_results("allocation", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
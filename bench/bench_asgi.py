@@ -0,0 +1,159 @@
+"""Сравнение gunicorn (Flask, lis:create_app()) и uvicorn (asgi:app) на одних и тех же сценариях.
+
+Поднимает заглушку Telegram с задержкой ответа, по очереди запускает оба
+сервера на одной базе и прогоняет /book, /get_booked_times и /webhook при
+растущем числе одновременных запросов. Для каждого сервера и уровня
+параллельности печатаются p50/p99, rps и распределение HTTP-статусов.
+
+    BENCH_DATABASE_URL=postgresql://... python bench/bench_asgi.py \\
+        --concurrency 50,200,500 --requests 2000 --gunicorn-workers 4 --gunicorn-threads 8 --asgi-workers 1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import requests
+
+from _common import write_results
+from bench_http import BENCH_FIRST_USER_ID, cleanup, make_session, run_load, wait_telegram_quiet
+from fake_telegram import FakeTelegram
+from updates import UpdateFactory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("book", "booked_times", "webhook")
+
+
+def server_commands(args, port):
+    return {
+        "gunicorn": [
+            "gunicorn", "-w", str(args.gunicorn_workers), "--threads", str(args.gunicorn_threads),
+            "-b", f"127.0.0.1:{port}", "--log-level", "warning", "lis:create_app()",
+        ],
+        "asgi": [
+            "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(args.asgi_workers), "--log-level", "warning", "--no-access-log",
+        ],
+    }
+
+
+def start_server(command, env, url, timeout=60.0):
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился с кодом {process.returncode}: {' '.join(command)}")
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Сервер не поднялся за {timeout} с: {' '.join(command)}")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_scenario(scenario, session, url, factory, count, concurrency, fake, offset):
+    if scenario == "book":
+        payloads = []
+        for i in range(count):
+            payload = factory.booking_payload()
+            payload.update(user_id=BENCH_FIRST_USER_ID + offset + i, user_name=f"bench-{offset + i}")
+            payloads.append(payload)
+        return run_load(session, lambda s, i: s.post(f"{url}/book", json=payloads[i], timeout=60), count, concurrency)
+    if scenario == "booked_times":
+        queries = [{"table": factory.rnd.randint(1, factory.tables),
+                    "date": (date.today() + timedelta(days=factory.rnd.randint(1, 14))).isoformat(),
+                    "duration_hours": factory.rnd.randint(1, 3)} for _ in range(count)]
+        return run_load(session, lambda s, i: s.get(f"{url}/get_booked_times", params=queries[i], timeout=60),
+                        count, concurrency)
+    fake.reset()
+    bodies = [json.dumps(u, ensure_ascii=False).encode("utf-8") for u in factory.mixed(count)]
+    report = run_load(session, lambda s, i: s.post(
+        f"{url}/webhook", data=bodies[i], headers={"Content-Type": "application/json"}, timeout=60), count, concurrency)
+    report["telegram"], report["telegram_drain_sec"] = wait_telegram_quiet(fake.url)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"))
+    parser.add_argument("--server", action="append", choices=("gunicorn", "asgi"), help="по умолчанию оба")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="по умолчанию все")
+    parser.add_argument("--concurrency", default="50,200,500", help="уровни параллельности через запятую")
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на каждый уровень")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--gunicorn-workers", type=int, default=4)
+    parser.add_argument("--gunicorn-threads", type=int, default=8)
+    parser.add_argument("--asgi-workers", type=int, default=1)
+    parser.add_argument("--telegram-latency-ms", type=float, default=40.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("Нужен --dsn или BENCH_DATABASE_URL")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    servers = args.server or ["gunicorn", "asgi"]
+    scenarios = args.scenario or list(SCENARIOS)
+
+    fake = FakeTelegram(latency_ms=args.telegram_latency_ms).start()
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        DATABASE_URL=args.dsn,
+        TELEGRAM_API_URL=fake.url,
+        BOT_TOKEN=os.environ.get("BOT_TOKEN") or "1:bench",
+        RENDER_EXTERNAL_URL=os.environ.get("RENDER_EXTERNAL_URL") or "https://bench.invalid",
+        WEBHOOK_DISPATCH_MODE="async",
+        LOG_LEVEL="WARNING",
+        PYTHONPATH=ROOT,
+    )
+    commands = server_commands(args, args.port)
+    results = {"levels": levels, "requests": args.requests, "telegram_latency_ms": args.telegram_latency_ms}
+
+    try:
+        for server in servers:
+            cleanup(args.dsn)
+            print(f"Запуск {server}: {' '.join(commands[server])}", file=sys.stderr)
+            process = start_server(commands[server], env, url)
+            factory = UpdateFactory(seed=args.seed, first_user_id=BENCH_FIRST_USER_ID)
+            per_server = results[server] = {}
+            try:
+                offset = 0
+                for concurrency in levels:
+                    session = make_session(concurrency)
+                    for scenario in scenarios:
+                        report = run_scenario(scenario, session, url, factory, args.requests, concurrency, fake, offset)
+                        per_server.setdefault(scenario, {})[str(concurrency)] = report
+                        offset += args.requests
+            finally:
+                stop_server(process)
+    finally:
+        cleanup(args.dsn)
+        fake.stop()
+
+    # Сводка: rps и p99 по уровням, gunicorn против asgi
+    summary = {}
+    for scenario in scenarios:
+        for concurrency in levels:
+            row = summary.setdefault(scenario, {}).setdefault(str(concurrency), {})
+            for server in servers:
+                latency = results[server][scenario][str(concurrency)]["latency"]
+                row[server] = {"rps": latency.get("rps"), "p99_ms": latency["p99_ms"]}
+    results["summary"] = summary
+    write_results("asgi_vs_gunicorn", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
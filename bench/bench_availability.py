@@ -0,0 +1,86 @@
+"""Микробенчмарк расчёта свободных слотов: прежний цикл по datetime против AvailabilityEngine.
+
+Запросов к БД нет — брони генерируются в памяти. Перед замером проверяется,
+что оба варианта дают одинаковый результат.
+
+    python bench/bench_availability.py --repeat 2000
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from _common import summarize, timed, write_results
+from availability import AvailabilityEngine
+from clock import RESTAURANT_TZ, localize
+
+
+def legacy_free_slots(query_date, bookings, duration_hours, now_ts):
+    """Копия прежней реализации из get_booked_times (для сравнения; pytz.localize заменён на clock.localize)."""
+    local_tz = RESTAURANT_TZ
+    start_time = localize(query_date, datetime.strptime("12:00", "%H:%M").time())
+    end_time = localize(query_date, datetime.strptime("23:00", "%H:%M").time())
+    now_ts = now_ts + 1800
+
+    busy_intervals = []
+    for b in bookings:
+        b_start = b['booking_for'].astimezone(local_tz).timestamp()
+        busy_intervals.append((b_start, b_start + (b.get('duration_hours') or 1) * 3600))
+
+    all_slots = []
+    slot_time = start_time
+    slot_duration_sec = duration_hours * 3600
+    while slot_time + timedelta(hours=duration_hours) <= end_time:
+        slot_start_ts = slot_time.timestamp()
+        slot_end_ts = slot_start_ts + slot_duration_sec
+        if slot_start_ts < now_ts:
+            slot_time += timedelta(minutes=30)
+            continue
+        if all(slot_end_ts <= b_start or slot_start_ts >= b_end for b_start, b_end in busy_intervals):
+            all_slots.append(slot_time.strftime("%H:%M"))
+        slot_time += timedelta(minutes=30)
+    return all_slots
+
+
+def make_bookings(rnd, day, count):
+    bookings = []
+    for _ in range(count):
+        hour, minute = rnd.randint(12, 21), rnd.choice((0, 30))
+        start = datetime(day.year, day.month, day.day, hour, minute, tzinfo=RESTAURANT_TZ)
+        bookings.append({"booking_for": start, "duration_hours": rnd.randint(1, 3)})
+    return bookings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    engine = AvailabilityEngine(RESTAURANT_TZ)
+    day = date.today() + timedelta(days=3)
+    now_ts = time.time()
+    results = {}
+
+    for per_table in (0, 4, 12, 40):
+        bookings = make_bookings(rnd, day, per_table)
+        for duration in (1, 3):
+            assert legacy_free_slots(day, bookings, duration, now_ts) == engine.free_times(day, bookings, duration, now_ts)
+        legacy = timed(lambda: legacy_free_slots(day, bookings, 2, now_ts), args.repeat)
+        new = timed(lambda: engine.free_times(day, bookings, 2, now_ts), args.repeat)
+        results[f"one_table_{per_table}_bookings"] = {"legacy": summarize(legacy), "engine": summarize(new)}
+
+    floor = {t: make_bookings(rnd, day, 6) for t in range(1, args.tables + 1)}
+    legacy = timed(lambda: {t: legacy_free_slots(day, b, 2, now_ts) for t, b in floor.items()}, args.repeat // 10)
+    new = timed(lambda: engine.free_times_many(day, floor, 2, now_ts), args.repeat // 10)
+    results[f"floor_{args.tables}_tables"] = {"legacy": summarize(legacy), "engine": summarize(new)}
+
+    for name, pair in results.items():
+        pair["speedup_p50"] = round(pair["legacy"]["p50_ms"] / max(pair["engine"]["p50_ms"], 1e-9), 1)
+    write_results("availability", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Форматирование дат броней: прежний tz.gettz + astimezone + strftime против clock.py.
+
+Перед замером проверяются переходы на летнее/зимнее время: сетка слотов
+AvailabilityEngine, clock.localize и day_bounds на днях перехода, и совпадение
+кэшированных строк clock.local_date_str/local_time_str с astimezone + strftime.
+Часовой пояс ресторана (Europe/Moscow) переводил часы до 2014 года, поэтому
+проверки идут на его реальных исторических переходах и на Europe/Berlin.
+
+    python bench/bench_clock.py --repeat 2000
+"""
+import argparse
+import random
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from dateutil import tz
+
+from _common import summarize, timed, write_results
+from availability import AvailabilityEngine
+from clock import RESTAURANT_TZ, local_date_str, local_date_time_str, local_time_str, localize
+from queries import day_bounds
+
+# Сессия psycopg2 отдаёт timestamptz с фиксированным смещением — как здесь
+DB_TZ = timezone(timedelta(hours=3))
+
+
+def legacy_format(rows):
+    """Копия прежнего цикла on_admin_panel / cmd_history."""
+    out = []
+    for r in rows:
+        local_tz = tz.gettz("Europe/Moscow")
+        booking_for_dt = r['booking_for'].astimezone(local_tz) if r['booking_for'].tzinfo else r['booking_for']
+        out.append((booking_for_dt.strftime("%d.%m.%Y"), booking_for_dt.strftime("%H:%M")))
+    return out
+
+
+def clock_format(rows):
+    return [local_date_time_str(r['booking_for']) for r in rows]
+
+
+def make_rows(rnd, count, days=30):
+    """Брони на сетке слотов по 30 минут, как в БД."""
+    first = date.today()
+    rows = []
+    for _ in range(count):
+        day = first + timedelta(days=rnd.randrange(days))
+        start = datetime(day.year, day.month, day.day, rnd.randint(12, 21), rnd.choice((0, 30)), tzinfo=RESTAURANT_TZ)
+        rows.append({"booking_for": start.astimezone(DB_TZ)})
+    return rows
+
+
+def slot_labels(engine, day):
+    return [label for _, label in engine.day_grid(day).slots]
+
+
+def check_dst():
+    # Сетка слотов через ночь перехода: 02:00-02:59 не существует весной и повторяется осенью
+    berlin = AvailabilityEngine(ZoneInfo("Europe/Berlin"), open_time=time(0, 0), close_time=time(6, 0))
+    spring = slot_labels(berlin, date(2026, 3, 29))
+    assert berlin.day_grid(date(2026, 3, 29)).minutes == 5 * 60
+    assert spring == ["00:00", "00:30", "01:00", "01:30", "03:00", "03:30", "04:00", "04:30", "05:00", "05:30"], spring
+    autumn = slot_labels(berlin, date(2026, 10, 25))
+    assert berlin.day_grid(date(2026, 10, 25)).minutes == 7 * 60
+    assert autumn.count("02:00") == 2 and autumn.count("02:30") == 2 and len(autumn) == 14, autumn
+    # Обычный день не затронут
+    assert len(slot_labels(berlin, date(2026, 3, 30))) == 12
+
+    # Europe/Moscow: весна 2010 (02:00 -> 03:00), осень 2010 (03:00 -> 02:00), переход на UTC+3 в 2014
+    assert localize(date(2010, 3, 28), time(2, 30)) == datetime(2010, 3, 27, 23, 30, tzinfo=timezone.utc)
+    assert localize(date(2010, 3, 28), time(2, 30)).strftime("%H:%M") == "03:30"
+    assert localize(date(2010, 10, 31), time(2, 30)).utcoffset() == timedelta(hours=4)
+    for day, hours in ((date(2010, 3, 28), 23), (date(2010, 10, 31), 25), (date(2014, 10, 26), 25), (date(2026, 3, 29), 24)):
+        start, end = day_bounds(day)
+        assert end.timestamp() - start.timestamp() == hours * 3600, day
+    moscow = AvailabilityEngine(RESTAURANT_TZ, open_time=time(0, 0), close_time=time(6, 0))
+    assert slot_labels(moscow, date(2010, 3, 28))[4] == "03:00"
+
+    # Кэшированные строки совпадают с astimezone + strftime, в т.ч. вокруг переходов и для наивных значений
+    rnd = random.Random(7)
+    instants = [datetime(2010, 3, 27, 20, tzinfo=timezone.utc) + timedelta(minutes=rnd.randrange(60 * 24 * 3)) for _ in range(2000)]
+    instants += [datetime(2014, 10, 25, 18, tzinfo=timezone.utc) + timedelta(minutes=m) for m in range(0, 600, 7)]
+    for value in instants:
+        local = value.astimezone(RESTAURANT_TZ)
+        assert local_date_str(value) == local.strftime("%d.%m.%Y"), value
+        assert local_time_str(value) == local.strftime("%H:%M"), value
+    naive = datetime(2026, 5, 1, 19, 30)
+    assert local_date_time_str(naive) == ("01.05.2026", "19:30")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    check_dst()
+
+    rnd = random.Random(1)
+    results = {}
+    # Страница админ-панели (ADMIN_PAGE_SIZE=10) и /history (последние 50)
+    for name, count in (("admin_page", 10), ("history", 50)):
+        rows = make_rows(rnd, count)
+        assert legacy_format(rows) == clock_format(rows)
+        legacy = timed(lambda: legacy_format(rows), args.repeat)
+        new = timed(lambda: clock_format(rows), args.repeat)
+        results[f"{name}_{count}_rows"] = {"legacy": summarize(legacy), "clock": summarize(new)}
+
+    for pair in results.values():
+        pair["speedup_p50"] = round(pair["legacy"]["p50_ms"] / max(pair["clock"]["p50_ms"], 1e-9), 1)
+    write_results("clock", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Бенчмарк поиска броней стола за день: booking_for::date = %s против полуинтервала.
+
+Создаёт отдельную таблицу bench_bookings (структура и индекс как у bookings),
+заполняет её историей (по умолчанию 1 000 000 броней), печатает планы запросов
+и сравнивает задержки.
+
+    BENCH_DATABASE_URL=postgresql://... python bench/bench_day_lookup.py --rows 1000000
+"""
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+import psycopg2
+
+from _common import summarize, timed, write_results
+from queries import day_bounds
+
+OLD_SQL = """
+    SELECT booking_id, booking_for, duration_hours
+    FROM bench_bookings
+    WHERE table_id = %s AND booking_for::date = %s
+"""
+NEW_SQL = """
+    SELECT booking_id, booking_for, duration_hours
+    FROM bench_bookings
+    WHERE table_id = %s AND booking_for >= %s AND booking_for < %s
+"""
+
+
+def seed(cur, rows, tables, days):
+    cur.execute("DROP TABLE IF EXISTS bench_bookings;")
+    cur.execute("""
+        CREATE TABLE bench_bookings (
+            booking_id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            table_id INT NOT NULL,
+            time_slot TEXT NOT NULL,
+            booking_for TIMESTAMP WITH TIME ZONE,
+            duration_hours INT DEFAULT 1
+        );
+    """)
+    # Брони равномерно раскиданы по последним `days` дням, в часы работы (12:00–22:00 МСК)
+    cur.execute("""
+        INSERT INTO bench_bookings (user_id, table_id, time_slot, booking_for, duration_hours)
+        SELECT g,
+               1 + (g %% %s),
+               '19:00',
+               (CURRENT_DATE - ((g / %s) %% %s)) + TIME '09:00' + ((g / (%s * %s)) %% 20) * INTERVAL '30 minutes',
+               1 + (g %% 3)
+        FROM generate_series(1, %s) AS g;
+    """, (tables, tables, days, tables, days, rows))
+    cur.execute("CREATE INDEX idx_bench_bookings_conflict ON bench_bookings (table_id, booking_for);")
+    cur.execute("ANALYZE bench_bookings;")
+
+
+def explain(cur, sql, params):
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+    return [row[0] for row in cur.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"))
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--days", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--keep", action="store_true", help="не удалять bench_bookings после прогона")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("Нужен --dsn или BENCH_DATABASE_URL")
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    print(f"Заполнение bench_bookings: {args.rows} строк...")
+    seed(cur, args.rows, args.tables, args.days)
+
+    rnd = random.Random(42)
+    probes = [(rnd.randint(1, args.tables), date.today() - timedelta(days=rnd.randint(0, args.days - 1)))
+              for _ in range(args.repeat)]
+    probe_iter = iter(probes * 2)
+
+    def run_old():
+        table_id, day = next(probe_iter)
+        cur.execute(OLD_SQL, (table_id, day))
+        cur.fetchall()
+
+    def run_new():
+        table_id, day = next(probe_iter)
+        cur.execute(NEW_SQL, (table_id, *day_bounds(day)))
+        cur.fetchall()
+
+    table_id, day = probes[0]
+    plans = {
+        "cast_date": explain(cur, OLD_SQL, (table_id, day)),
+        "half_open_range": explain(cur, NEW_SQL, (table_id, *day_bounds(day))),
+    }
+    old = timed(run_old, args.repeat)
+    new = timed(run_new, args.repeat)
+
+    results = {
+        "rows": args.rows,
+        "plans": plans,
+        "cast_date": summarize(old),
+        "half_open_range": summarize(new),
+    }
+    results["speedup_p50"] = round(results["cast_date"]["p50_ms"] / max(results["half_open_range"]["p50_ms"], 1e-9), 1)
+
+    if not args.keep:
+        cur.execute("DROP TABLE bench_bookings;")
+    conn.close()
+    write_results("day_lookup", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""HTTP-сценарии под нагрузкой: /webhook, /book, /get_booked_times, /get_free_times_bulk.
+
+Приложение запускается отдельно, с заглушкой Telegram вместо api.telegram.org:
+
+    python bench/fake_telegram.py --port 8081 --latency-ms 40 &
+    TELEGRAM_API_URL=http://127.0.0.1:8081 WEBHOOK_DISPATCH_MODE=async \\
+        gunicorn -w 4 --threads 8 -b 127.0.0.1:5000 'lis:create_app()' &
+    python bench/bench_http.py --url http://127.0.0.1:5000 --telegram http://127.0.0.1:8081 \\
+        --dsn postgresql://... --scenario all --requests 2000 --concurrency 50
+
+Для каждого сценария печатаются p50/p99 и rps (формат как у остальных бенчмарков).
+Для /webhook дополнительно ждём, пока бот допишет ответы в заглушку, и сообщаем,
+сколько вызовов Bot API он сделал и сколько 429 получил.
+"""
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import psycopg2
+import requests
+
+from _common import summarize, write_results
+from updates import UpdateFactory
+
+SCENARIOS = ("webhook", "book", "booked_times", "bulk")
+BENCH_FIRST_USER_ID = 700000
+
+
+def make_session(concurrency):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def run_load(session, make_request, count, concurrency):
+    """Выполняет count запросов make_request(session, i) в concurrency потоков."""
+    def fire(i):
+        started = time.perf_counter()
+        try:
+            status = make_request(session, i).status_code
+        except requests.RequestException:
+            status = "error"
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(fire, range(count)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": count,
+        "concurrency": concurrency,
+        "statuses": dict(Counter(str(status) for status, _ in results)),
+        "latency": summarize([lat for _, lat in results], elapsed),
+    }
+
+
+def telegram_stats(url):
+    return requests.get(f"{url}/_stats", timeout=5).json()
+
+
+def wait_telegram_quiet(url, quiet_sec=2.0, timeout=120.0):
+    """Ждёт, пока число вызовов заглушки перестанет расти; возвращает (статистика, сколько ждали)."""
+    started = time.perf_counter()
+    last, last_change = None, time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        stats = telegram_stats(url)
+        if stats["calls"] != last:
+            last, last_change = stats["calls"], time.perf_counter()
+        elif time.perf_counter() - last_change >= quiet_sec:
+            return stats, round(last_change - started, 3)
+        time.sleep(0.2)
+    return telegram_stats(url), round(time.perf_counter() - started, 3)
+
+
+def cleanup(dsn):
+    """Удаляет брони и уведомления, созданные прогоном (по диапазону user_id бенчмарка)."""
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM bookings WHERE user_id >= %s;", (BENCH_FIRST_USER_ID,))
+        cur.execute("SELECT to_regclass('outbox') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            cur.execute("DELETE FROM outbox WHERE chat_id >= %s;", (BENCH_FIRST_USER_ID,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=os.environ.get("BENCH_APP_URL", "http://127.0.0.1:5000"))
+    parser.add_argument("--telegram", default=os.environ.get("TELEGRAM_API_URL"), help="адрес заглушки fake_telegram.py")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"),
+                        help="если задан — брони бенчмарка удаляются до и после прогона")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS + ("all",), help="можно указать несколько раз")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    scenarios = args.scenario or ["all"]
+    if "all" in scenarios:
+        scenarios = list(SCENARIOS)
+    if args.dsn:
+        cleanup(args.dsn)
+
+    session = make_session(args.concurrency)
+    factory = UpdateFactory(seed=args.seed, first_user_id=BENCH_FIRST_USER_ID)
+    results = {}
+
+    for scenario in scenarios:
+        if scenario == "webhook":
+            if args.telegram:
+                requests.post(f"{args.telegram}/_reset", timeout=5)
+            bodies = [json.dumps(u, ensure_ascii=False).encode("utf-8") for u in factory.mixed(args.requests)]
+            report = run_load(session, lambda s, i: s.post(
+                f"{args.url}/webhook", data=bodies[i], headers={"Content-Type": "application/json"}, timeout=60),
+                args.requests, args.concurrency)
+            if args.telegram:
+                report["telegram"], report["telegram_drain_sec"] = wait_telegram_quiet(args.telegram)
+        elif scenario == "book":
+            payloads = []
+            for i in range(args.requests):
+                payload = factory.booking_payload()
+                payload.update(user_id=BENCH_FIRST_USER_ID + i, user_name=f"bench-{i}")
+                payloads.append(payload)
+            report = run_load(session, lambda s, i: s.post(f"{args.url}/book", json=payloads[i], timeout=60),
+                              args.requests, args.concurrency)
+        elif scenario == "booked_times":
+            queries = [{"table": factory.rnd.randint(1, factory.tables),
+                        "date": (date.today() + timedelta(days=factory.rnd.randint(1, 14))).isoformat(),
+                        "duration_hours": factory.rnd.randint(1, 3)} for _ in range(args.requests)]
+            report = run_load(session, lambda s, i: s.get(f"{args.url}/get_booked_times", params=queries[i], timeout=60),
+                              args.requests, args.concurrency)
+        else:
+            first = date.today() + timedelta(days=1)
+            queries = [{"date_from": (first + timedelta(days=factory.rnd.randint(0, 6))).isoformat(),
+                        "duration_hours": factory.rnd.randint(1, 3)} for _ in range(args.requests)]
+            for q in queries:
+                q["date_to"] = q["date_from"]
+            report = run_load(session, lambda s, i: s.get(f"{args.url}/get_free_times_bulk", params=queries[i], timeout=60),
+                              args.requests, args.concurrency)
+        results[scenario] = report
+
+    if args.dsn:
+        cleanup(args.dsn)
+    write_results("http", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Пропускная способность приёма обновлений: вебхук по одному, вебхук пачками и long polling getUpdates.
+
+Поднимает заглушку Telegram и по очереди запускает приложение в режимах:
+  webhook-async — WEBHOOK_DISPATCH_MODE=async, UPDATE_BATCH_SIZE=1 (как до пачек);
+  webhook-batch — WEBHOOK_DISPATCH_MODE=batch (окно WEBHOOK_BATCH_WINDOW_MS);
+  poll          — python lis.py poll, обновления забираются из заглушки через getUpdates.
+В вебхук-режимах обновления шлются POST /webhook с заданной параллельностью,
+в режиме poll заранее кладутся в очередь getUpdates заглушки. Для каждого
+режима печатаются время приёма и полной обработки (пока бот не перестанет
+отвечать в заглушку), обновлений в секунду и средние по этапам из /stats.
+
+    BENCH_DATABASE_URL=postgresql://... python bench/bench_ingest.py --updates 5000 --concurrency 100
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import requests
+
+from _common import write_results
+from bench_asgi import ROOT, start_server, stop_server
+from bench_http import BENCH_FIRST_USER_ID, cleanup, make_session, run_load, telegram_stats, wait_telegram_quiet
+from fake_telegram import FakeTelegram
+from updates import UpdateFactory
+
+MODES = ("webhook-async", "webhook-batch", "poll")
+
+
+def mode_setup(mode, args, port):
+    """Команда запуска и переменные окружения режима."""
+    env = {"UPDATE_BATCH_SIZE": str(args.batch_size), "WEBHOOK_WORKERS": str(args.workers),
+           "WEBHOOK_QUEUE_SIZE": str(max(args.updates, 1000)), "WEBHOOK_BATCH_BUFFER": str(max(args.updates, 1000))}
+    if mode == "poll":
+        env.update(PORT=str(port), POLL_TIMEOUT="5")
+        return [sys.executable, "lis.py", "poll"], env
+    env["WEBHOOK_DISPATCH_MODE"] = mode.split("-")[1]
+    if mode == "webhook-async":
+        env["UPDATE_BATCH_SIZE"] = "1"
+    else:
+        env["WEBHOOK_BATCH_WINDOW_MS"] = str(args.window_ms)
+    command = ["gunicorn", "-w", "1", "--threads", str(args.threads), "-b", f"127.0.0.1:{port}",
+               "--log-level", "warning", "lis:create_app()"]
+    return command, env
+
+
+def wait_confirmed(fake, count, timeout=300.0):
+    """Ждёт, пока бот подтвердит offset всех обновлений очереди getUpdates; возвращает время."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if fake.stats()["updates_confirmed"] >= count:
+            break
+        time.sleep(0.05)
+    return round(time.perf_counter() - started, 3)
+
+
+def stage_summary(stats):
+    dispatcher = stats.get("webhook") or {}
+    return {
+        "batch_avg": round(dispatcher.get("batch_avg", 0.0), 2),
+        "queue_wait_avg_ms": round(dispatcher.get("queue_wait_avg", 0.0) * 1000, 3),
+        "handle_batch_avg_ms": round(dispatcher.get("handle_time_avg", 0.0) * 1000, 3),
+        "rejected": dispatcher.get("rejected", 0),
+        "batcher": stats.get("webhook_batcher"),
+        "poller": stats.get("poller"),
+    }
+
+
+def run_mode(mode, args, fake, url, session, payloads):
+    fake.reset()
+    started = time.perf_counter()
+    if mode == "poll":
+        fake.push_updates(payloads)
+        # Последняя пачка подтверждается следующим getUpdates — не позже чем через POLL_TIMEOUT
+        report = {"ingest_sec": wait_confirmed(fake, len(payloads))}
+    else:
+        bodies = [json.dumps(u, ensure_ascii=False).encode("utf-8") for u in payloads]
+        report = run_load(session, lambda s, i: s.post(
+            f"{url}/webhook", data=bodies[i], headers={"Content-Type": "application/json"}, timeout=60),
+            len(bodies), args.concurrency)
+        report["ingest_sec"] = round(time.perf_counter() - started, 3)
+    # Полная обработка — до последнего ответа бота в заглушку
+    quiet_from = time.perf_counter()
+    report["telegram"], drain = wait_telegram_quiet(fake.url)
+    report["total_sec"] = round(quiet_from - started + drain, 3)
+    report["ingest_updates_per_sec"] = round(len(payloads) / report["ingest_sec"], 1) if report["ingest_sec"] else None
+    report["stages"] = stage_summary(requests.get(f"{url}/stats", timeout=10).json())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"))
+    parser.add_argument("--mode", action="append", choices=MODES, help="по умолчанию все")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100, help="параллельных POST /webhook")
+    parser.add_argument("--threads", type=int, default=32, help="потоков gunicorn в вебхук-режимах")
+    parser.add_argument("--workers", type=int, default=4, help="WEBHOOK_WORKERS")
+    parser.add_argument("--batch-size", type=int, default=50, help="UPDATE_BATCH_SIZE")
+    parser.add_argument("--window-ms", type=float, default=5.0, help="WEBHOOK_BATCH_WINDOW_MS")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--telegram-latency-ms", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("Нужен --dsn или BENCH_DATABASE_URL")
+    modes = args.mode or list(MODES)
+
+    fake = FakeTelegram(latency_ms=args.telegram_latency_ms).start()
+    url = f"http://127.0.0.1:{args.port}"
+    base_env = dict(
+        os.environ,
+        DATABASE_URL=args.dsn,
+        TELEGRAM_API_URL=fake.url,
+        BOT_TOKEN=os.environ.get("BOT_TOKEN") or "1:bench",
+        RENDER_EXTERNAL_URL=os.environ.get("RENDER_EXTERNAL_URL") or "https://bench.invalid",
+        LOG_LEVEL="WARNING",
+        PYTHONPATH=ROOT,
+    )
+    results = {"updates": args.updates, "concurrency": args.concurrency, "batch_size": args.batch_size,
+               "window_ms": args.window_ms, "telegram_latency_ms": args.telegram_latency_ms}
+    session = make_session(args.concurrency)
+    try:
+        for mode in modes:
+            cleanup(args.dsn)
+            command, env = mode_setup(mode, args, args.port)
+            print(f"Режим {mode}: {' '.join(command)}", file=sys.stderr)
+            process = start_server(command, dict(base_env, **env), url)
+            try:
+                # Одинаковый набор обновлений для всех режимов
+                factory = UpdateFactory(seed=args.seed, first_user_id=BENCH_FIRST_USER_ID)
+                results[mode] = run_mode(mode, args, fake, url, session, factory.mixed(args.updates))
+                results[mode]["getUpdates_calls"] = telegram_stats(fake.url)["get_updates_calls"]
+            finally:
+                stop_server(process)
+    finally:
+        cleanup(args.dsn)
+        fake.stop()
+    results["summary"] = {mode: {"ingest_updates_per_sec": results[mode]["ingest_updates_per_sec"],
+                                 "total_sec": results[mode]["total_sec"]} for mode in modes}
+    write_results("ingest", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
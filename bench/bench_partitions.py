@@ -0,0 +1,200 @@
+"""Бенчмарк горячих запросов к броням по мере роста истории: одна таблица против помесячных партиций.
+
+Создаёт bench_bookings_plain (индексы как у bookings в режиме plain) и
+bench_bookings_part (партиции ensure_month_partition из partitions.py, индексы
+как после миграции bookings_partitioned). Обе таблицы содержат одинаковые
+будущие брони на ближайшие две недели; на каждом шаге --steps в них
+добавляется прошлая история до заданного числа строк, после чего замеряются
+запросы из горячих обработчиков и размер индексов, которые эти запросы читают.
+
+    BENCH_DATABASE_URL=postgresql://... python bench/bench_partitions.py --steps 100000,1000000,5000000
+"""
+import argparse
+import os
+import random
+from datetime import timedelta
+
+import psycopg2
+
+from _common import summarize, timed, write_results
+from clock import now_local
+from partitions import PARTITION_FUNCTION_SQL, add_months, attached_partitions, ensure_partitions
+from queries import day_bounds
+
+PLAIN = "bench_bookings_plain"
+PARTITIONED = "bench_bookings_part"
+
+COLUMNS = """
+    booking_id BIGSERIAL,
+    user_id BIGINT,
+    user_name TEXT,
+    table_id INT NOT NULL,
+    time_slot TEXT NOT NULL,
+    booked_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    booking_for TIMESTAMP WITH TIME ZONE NOT NULL,
+    duration_hours INT DEFAULT 1
+"""
+
+# Запросы горячих обработчиков (get_next_booking, слоты стола за день, админ-панель, /history)
+QUERIES = {
+    "next_booking": """
+        SELECT booking_id, table_id, time_slot, booking_for
+        FROM {table}
+        WHERE user_id = %(user_id)s AND booking_for > NOW()
+        ORDER BY booking_for ASC
+        LIMIT 1
+    """,
+    "table_day": """
+        SELECT booking_id, booking_for, duration_hours
+        FROM {table}
+        WHERE table_id = %(table_id)s AND booking_for >= %(day_start)s AND booking_for < %(day_end)s
+    """,
+    "admin_first_page": """
+        SELECT booking_id, user_name, table_id, time_slot, booking_for
+        FROM {table}
+        WHERE booking_for > NOW()
+        ORDER BY booking_for, booking_id
+        LIMIT 11
+    """,
+    "history": """
+        SELECT booking_id, user_name, table_id, time_slot, booked_at, booking_for
+        FROM {table}
+        ORDER BY booked_at DESC
+        LIMIT 50
+    """,
+}
+
+
+def create_tables(cur, history_days):
+    cur.execute(f"DROP TABLE IF EXISTS {PLAIN}, {PARTITIONED} CASCADE;")
+    cur.execute(f"CREATE TABLE {PLAIN} ({COLUMNS}, PRIMARY KEY (booking_id));")
+    for sql in (
+        f"CREATE INDEX ON {PLAIN} (table_id, booking_for);",
+        f"CREATE INDEX ON {PLAIN} (user_id, booking_for DESC);",
+        f"CREATE INDEX ON {PLAIN} (booking_for, booking_id);",
+        f"CREATE INDEX ON {PLAIN} (booked_at DESC);",
+    ):
+        cur.execute(sql)
+
+    cur.execute(PARTITION_FUNCTION_SQL)
+    cur.execute(f"""
+        CREATE TABLE {PARTITIONED} ({COLUMNS}, PRIMARY KEY (booking_id, booking_for))
+        PARTITION BY RANGE (booking_for);
+    """)
+    for sql in (
+        f"CREATE INDEX ON {PARTITIONED} (table_id, booking_for);",
+        f"CREATE INDEX ON {PARTITIONED} (booking_for, booking_id);",
+        f"CREATE INDEX ON {PARTITIONED} (booked_at DESC);",
+    ):
+        cur.execute(sql)
+    # История уходит на history_days назад, будущие брони — на две недели вперёд (с запасом в месяц)
+    today = now_local().date()
+    ensure_partitions(cur, PARTITIONED, add_months((today - timedelta(days=history_days)).replace(day=1), -1),
+                      add_months(today.replace(day=1), 1))
+
+
+def insert_rows(cur, first, last, users, tables, history_days, future=False):
+    """Брони с номерами first..last: прошлые (в пределах history_days) или будущие на 14 дней."""
+    if future:
+        when = "date_trunc('day', NOW()) + (1 + g %% 14) * INTERVAL '1 day' + INTERVAL '12 hours' + (g %% 20) * INTERVAL '30 minutes'"
+    else:
+        when = (f"date_trunc('day', NOW()) - (1 + (g / {tables}) %% {history_days}) * INTERVAL '1 day'"
+                " + INTERVAL '12 hours' + (g %% 20) * INTERVAL '30 minutes'")
+    for table in (PLAIN, PARTITIONED):
+        cur.execute(f"""
+            INSERT INTO {table} (user_id, user_name, table_id, time_slot, booked_at, booking_for, duration_hours)
+            SELECT g %% %s, 'Гость ' || g, 1 + g %% %s, '19:00', b - INTERVAL '2 days', b, 1 + g %% 3
+            FROM generate_series(%s, %s) AS g, LATERAL (SELECT {when} AS b) AS t;
+        """, (users, tables, first, last))
+        cur.execute(f"ANALYZE {table};")
+
+
+def hot_index_bytes(cur, table, partitioned):
+    """Размер индексов, которые читают запросы по будущим броням."""
+    if not partitioned:
+        cur.execute("SELECT pg_indexes_size(%s::regclass);", (table,))
+        return cur.fetchone()[0]
+    # Только текущая и будущие партиции: остальные отсекаются по booking_for > NOW()
+    this_month = now_local().date().replace(day=1)
+    total = 0
+    for name, month in attached_partitions(cur, table).items():
+        if month >= this_month:
+            cur.execute("SELECT pg_indexes_size(%s::regclass);", (name,))
+            total += cur.fetchone()[0]
+    return total
+
+
+def measure(cur, table, probes, repeat):
+    results = {}
+    for name, template in QUERIES.items():
+        sql = template.format(table=table)
+        probe_iter = iter(probes * (repeat // len(probes) + 2))
+
+        def run():
+            cur.execute(sql, next(probe_iter))
+            cur.fetchall()
+
+        run()  # прогрев кэша планов и буферов
+        results[name] = summarize(timed(run, repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"))
+    parser.add_argument("--steps", default="100000,1000000,5000000", help="размер истории на каждом шаге, через запятую")
+    parser.add_argument("--future", type=int, default=2000, help="число будущих броней")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--history-days", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=300)
+    parser.add_argument("--keep", action="store_true", help="не удалять таблицы после прогона")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("Нужен --dsn или BENCH_DATABASE_URL")
+    steps = sorted(int(s) for s in args.steps.split(",") if s.strip())
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    create_tables(cur, args.history_days)
+    # Будущие брони — с номерами после всей истории: шаги добавляют только прошлые
+    insert_rows(cur, steps[-1] + 1, steps[-1] + args.future, args.users, args.tables, args.history_days, future=True)
+
+    rnd = random.Random(42)
+    today = now_local().date()
+    probes = []
+    for _ in range(100):
+        # Половина пользователей — с будущей бронью, половина — только с историей
+        g = rnd.randint(steps[-1] + 1, steps[-1] + args.future) if rnd.random() < 0.5 else rnd.randint(1, steps[-1])
+        day_start, day_end = day_bounds(today + timedelta(days=rnd.randint(1, 14)))
+        probes.append({"user_id": g % args.users, "table_id": rnd.randint(1, args.tables),
+                       "day_start": day_start, "day_end": day_end})
+
+    results = {"future_rows": args.future, "steps": []}
+    loaded = 0
+    for target in steps:
+        print(f"История: {target} строк...")
+        insert_rows(cur, loaded + 1, target, args.users, args.tables, args.history_days)
+        loaded = target
+        results["steps"].append({
+            "history_rows": target,
+            "plain": {
+                "hot_index_bytes": hot_index_bytes(cur, PLAIN, partitioned=False),
+                **measure(cur, PLAIN, probes, args.repeat),
+            },
+            "partitioned": {
+                "hot_index_bytes": hot_index_bytes(cur, PARTITIONED, partitioned=True),
+                **measure(cur, PARTITIONED, probes, args.repeat),
+            },
+        })
+
+    if not args.keep:
+        cur.execute(f"DROP TABLE {PLAIN}, {PARTITIONED} CASCADE;")
+    conn.close()
+    write_results("partitions", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Проверка и нагрузка чтения с реплики (replicas.ReplicaRouter) на двух локальных Postgres.
+
+Сценарии:
+  ryw   — read-your-writes: бронь пишется в основную БД, её ключ помечается, и сразу
+          читается через маршрутизатор — бронь должна найтись всегда. Для сравнения
+          то же чтение напрямую с реплики (сколько раз бронь ещё не доехала);
+  load  — читатели выполняют запрос занятости стола (как /get_booked_times), пока
+          писатели держат FOR UPDATE по броням дня в основной БД; задержки чтения
+          только из основной БД против чтения через маршрутизатор;
+  lag   — на реплике ставится на паузу применение WAL (pg_wal_replay_pause, нужен
+          суперпользователь), маршрутизатор должен перевести чтения в основную БД,
+          а после pg_wal_replay_resume — вернуть их на реплику.
+
+Две локальные инстанции (основная на 5433, потоковая реплика на 5434):
+
+    initdb -D /tmp/pg_primary && pg_ctl -D /tmp/pg_primary -o "-p 5433" -l /tmp/pg_primary.log start
+    createdb -p 5433 lis
+    pg_basebackup -p 5433 -D /tmp/pg_replica -R && pg_ctl -D /tmp/pg_replica -o "-p 5434" -l /tmp/pg_replica.log start
+
+    python bench/bench_replicas.py --primary postgresql://localhost:5433/lis --replica postgresql://localhost:5434/lis
+"""
+import argparse
+import os
+import threading
+import time
+from datetime import timedelta
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from _common import summarize, write_results
+from bench_http import BENCH_FIRST_USER_ID, cleanup
+from clock import local_day, now_local
+from db_pool import ConnectionPool
+from migrations import run_migrations
+from queries import INSERT_BOOKING_SQL, TABLE_DAY_BOOKINGS_SQL, day_bounds
+from replicas import ReplicaRouter
+
+SCENARIOS = ("ryw", "load", "lag")
+NEXT_BOOKING_SQL = "SELECT booking_id FROM bookings WHERE user_id = %s AND booking_for > NOW() LIMIT 1;"
+
+
+def make_pool(dsn, size):
+    return ConnectionPool(dsn, minconn=0, maxconn=size, cursor_factory=RealDictCursor)
+
+
+def insert_booking(pool, user_id, table_id, booking_for):
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute(INSERT_BOOKING_SQL, (user_id, "bench", None, table_id, booking_for.strftime("%H:%M"), 2,
+                                         now_local(), booking_for, 1))
+        return cur.fetchone()['booking_id']
+
+
+def read_next_booking(connection, user_id):
+    with connection as conn, conn.cursor() as cur:
+        cur.execute(NEXT_BOOKING_SQL, (user_id,))
+        return cur.fetchone()
+
+
+def run_ryw(primary, replica, router, iterations):
+    """Каждая бронь сразу после COMMIT читается через маршрутизатор (должна найтись) и напрямую с реплики."""
+    found, missed_on_replica = 0, 0
+    base = now_local() + timedelta(days=2)
+    for i in range(iterations):
+        user_id = BENCH_FIRST_USER_ID + i
+        insert_booking(primary, user_id, 1 + i % 20, base + timedelta(minutes=i))
+        router.note_write(("user", user_id))
+        if read_next_booking(router.connection(("user", user_id)), user_id) is not None:
+            found += 1
+        if read_next_booking(replica.connection(), user_id) is None:
+            missed_on_replica += 1
+    assert found == iterations, f"read-your-writes нарушен: найдено {found} из {iterations}"
+    return {"iterations": iterations, "found_via_router": found, "missed_on_replica_directly": missed_on_replica,
+            "router": router.stats()}
+
+
+def run_load(primary, connection_for_read, readers, writers, seconds):
+    """Задержки запроса занятости стола у readers потоков при writers потоках с FOR UPDATE в основной БД."""
+    day = local_day(now_local() + timedelta(days=3))
+    start, end = day_bounds(day)
+    stop = threading.Event()
+    samples, lock = [], threading.Lock()
+
+    def writer(n):
+        while not stop.is_set():
+            with primary.connection() as conn, conn.cursor() as cur:
+                cur.execute(TABLE_DAY_BOOKINGS_SQL + " FOR UPDATE;", (1 + n % 20, start, end))
+                time.sleep(0.005)
+                conn.rollback()
+
+    def reader(n):
+        own = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            with connection_for_read() as conn, conn.cursor() as cur:
+                cur.execute(TABLE_DAY_BOOKINGS_SQL + ";", (1 + n % 20, start, end))
+                cur.fetchall()
+            own.append(time.perf_counter() - started)
+        with lock:
+            samples.extend(own)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, seconds)
+
+
+def run_lag(replica_dsn, router, max_lag, check_interval, primary):
+    """Пауза применения WAL на реплике: чтения уходят в основную БД, после возобновления — возвращаются."""
+    control = psycopg2.connect(replica_dsn)
+    control.autocommit = True
+    try:
+        with control.cursor() as cur:
+            cur.execute("SELECT pg_wal_replay_pause();")
+        # Записи в основной БД, которые реплика не применит, пока стоит на паузе
+        deadline = time.monotonic() + max_lag + 3 * check_interval + 2
+        base = now_local() + timedelta(days=2)
+        i = 0
+        while time.monotonic() < deadline and router.choose() is not None:
+            insert_booking(primary, BENCH_FIRST_USER_ID + 10_000 + i, 1, base + timedelta(minutes=i))
+            i += 1
+            time.sleep(check_interval / 2)
+        paused_to_primary = router.choose() is None
+    finally:
+        with control.cursor() as cur:
+            cur.execute("SELECT pg_wal_replay_resume();")
+        control.close()
+    deadline = time.monotonic() + max_lag + 3 * check_interval + 5
+    while time.monotonic() < deadline and router.choose() is None:
+        time.sleep(check_interval / 2)
+    resumed_to_replica = router.choose() is not None
+    assert paused_to_primary and resumed_to_replica, (paused_to_primary, resumed_to_replica)
+    return {"paused_to_primary": paused_to_primary, "resumed_to_replica": resumed_to_replica, "router": router.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--primary", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"))
+    parser.add_argument("--replica", default=os.environ.get("BENCH_REPLICA_URL"))
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="по умолчанию ryw и load")
+    parser.add_argument("--iterations", type=int, default=200, help="броней в сценарии ryw")
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0, help="длительность каждого прогона load")
+    parser.add_argument("--max-lag", type=float, default=2.0, help="REPLICA_MAX_LAG_SEC")
+    parser.add_argument("--check-interval", type=float, default=0.5, help="REPLICA_CHECK_SEC")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+    if not args.primary or not args.replica:
+        parser.error("Нужны --primary и --replica (или BENCH_DATABASE_URL и BENCH_REPLICA_URL)")
+
+    run_migrations(args.primary)
+    cleanup(args.primary)
+    primary = make_pool(args.primary, args.readers + args.writers + 2)
+    replica = make_pool(args.replica, args.readers + 2)
+    router = ReplicaRouter({"replica1": replica}, primary.connection, max_lag=args.max_lag,
+                           sticky=args.max_lag + 2 * args.check_interval, check_interval=args.check_interval).start()
+    # Первая проверка отставания — до чтений
+    time.sleep(args.check_interval * 2)
+    results = {"max_lag_sec": args.max_lag, "check_interval_sec": args.check_interval}
+    try:
+        for scenario in args.scenario or ["ryw", "load"]:
+            if scenario == "ryw":
+                results["ryw"] = run_ryw(primary, replica, router, args.iterations)
+            elif scenario == "load":
+                results["load"] = {
+                    "primary_only": run_load(primary, primary.connection, args.readers, args.writers, args.seconds),
+                    "routed": run_load(primary, router.connection, args.readers, args.writers, args.seconds),
+                    "router": router.stats(),
+                }
+            else:
+                results["lag"] = run_lag(args.replica, router, args.max_lag, args.check_interval, primary)
+    finally:
+        router.shutdown()
+        primary.closeall()
+        cleanup(args.primary)
+    write_results("replicas", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
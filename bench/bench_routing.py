@@ -0,0 +1,127 @@
+"""Микробенчмарк выбора обработчика: перебор func-предикатов против routing.Router.
+
+Для каждого числа обработчиков (--handlers) регистрируются кнопки "Кнопка i" и
+callback-префиксы "cbi_" двумя способами: как раньше в lis.py (по обработчику
+на кнопку с предикатом `"текст" in m.text` / `c.data.startswith(...)`) и через
+Router (точный текст / префикс в словаре). Замеряется:
+  match    — только выбор обработчика (без telebot);
+  telebot  — bot.process_new_updates([update]) целиком, с пустыми обработчиками.
+Сценарии: первый и последний зарегистрированный обработчик, текст без
+обработчика, сообщение без текста (стикер) и callback с последним префиксом.
+Предикат старого вида на сообщении без текста падает с TypeError (в telebot
+его прикрывает фильтр content_types=["text"] по умолчанию) — такие случаи
+отмечены как errors.
+
+    python bench/bench_routing.py --handlers 5,20,50,100,200 --repeat 20000
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from telebot import TeleBot, types
+
+from _common import summarize, timed, write_results
+from routing import Router
+
+
+def noop(_):
+    return None
+
+
+def legacy_tables(count):
+    messages = [(lambda m, t=f"Кнопка {i}": t in m.text) for i in range(count)]
+    callbacks = [(lambda c, p=f"cb{i}_": c.data.startswith(p)) for i in range(count)]
+    return messages, callbacks
+
+
+def legacy_match(predicates, obj):
+    for predicate in predicates:
+        if predicate(obj):
+            return predicate
+    return None
+
+
+def make_router(count):
+    router = Router()
+    for i in range(count):
+        router.text(f"Кнопка {i}")(noop)
+        router.callback(f"cb{i}_")(noop)
+    return router
+
+
+def make_bots(count):
+    """Два бота с одинаковыми обработчиками: предикатами (как было, с content_types по умолчанию у @bot.message_handler) и через Router."""
+    legacy = TeleBot("1:bench", threaded=False, validate_token=False)
+    for i in range(count):
+        legacy.register_message_handler(noop, content_types=["text"], func=lambda m, t=f"Кнопка {i}": t in m.text)
+        legacy.register_callback_query_handler(noop, func=lambda c, p=f"cb{i}_": c.data.startswith(p))
+    routed = TeleBot("1:bench", threaded=False, validate_token=False)
+    make_router(count).install(routed)
+    return legacy, routed
+
+
+def update_json(update_id, **fields):
+    user = {"id": 42, "is_bot": False, "first_name": "Bench"}
+    message = {"message_id": update_id, "date": int(time.time()), "chat": {"id": 42, "type": "private"}, "from": user}
+    if "callback_data" in fields:
+        return json.dumps({"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": "1", "data": fields["callback_data"], "message": message}})
+    message.update(fields)
+    return json.dumps({"update_id": update_id, "message": message})
+
+
+def scenarios(count):
+    last = count - 1
+    return {
+        "first_button": ({"text": "Кнопка 0"}, SimpleNamespace(text="Кнопка 0")),
+        "last_button": ({"text": f"Кнопка {last}"}, SimpleNamespace(text=f"Кнопка {last}")),
+        "unmatched_text": ({"text": "просто текст"}, SimpleNamespace(text="просто текст")),
+        "no_text": ({"sticker": {"file_id": "s", "file_unique_id": "s", "type": "regular", "width": 512,
+                                 "height": 512, "is_animated": False, "is_video": False}}, SimpleNamespace(text=None)),
+        "last_callback": ({"callback_data": f"cb{last}_17"}, SimpleNamespace(data=f"cb{last}_17")),
+    }
+
+
+def measure(fn, repeat):
+    """summarize по repeat вызовам; если fn падает — {"errors": repeat}."""
+    try:
+        fn()
+    except TypeError:
+        return {"errors": repeat}
+    return summarize(timed(fn, repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--handlers", default="5,20,50,100,200", help="число кнопок (и префиксов) через запятую")
+    parser.add_argument("--repeat", type=int, default=20000)
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    results = {}
+    for count in [int(c) for c in args.handlers.split(",") if c.strip()]:
+        legacy_messages, legacy_callbacks = legacy_tables(count)
+        router = make_router(count)
+        legacy_bot, routed_bot = make_bots(count)
+        per_count = results[str(count)] = {}
+        for name, (fields, obj) in scenarios(count).items():
+            callback = "callback_data" in fields
+            update = types.Update.de_json(update_json(1, **fields))
+            per_count[name] = {
+                "match": {
+                    "legacy": measure(lambda: legacy_match(legacy_callbacks if callback else legacy_messages, obj),
+                                      args.repeat),
+                    "router": measure(lambda: router.match_callback(obj) if callback else router.match_text(obj),
+                                      args.repeat),
+                },
+                "telebot": {
+                    "legacy": measure(lambda: legacy_bot.process_new_updates([update]), args.repeat),
+                    "router": measure(lambda: routed_bot.process_new_updates([update]), args.repeat),
+                },
+            }
+    write_results("routing", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
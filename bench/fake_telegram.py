@@ -0,0 +1,254 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Отвечает на вызовы бота так же, как api.telegram.org (в объёме, нужном lis.py),
+записывает sendMessage/sendPhoto/... и умеет добавлять задержку и ответы 429.
+Приложение направляется на заглушку переменной TELEGRAM_API_URL.
+
+    python bench/fake_telegram.py --port 8081 --latency-ms 40 --rate-429 0.02
+    TELEGRAM_API_URL=http://127.0.0.1:8081 gunicorn 'lis:create_app()' ...
+
+Служебные адреса: GET /_stats — счётчики вызовов, POST /_reset — сброс,
+POST /_config {"latency_ms": .., "rate_429": .., "retry_after": ..} — смена параметров на ходу,
+POST /_updates {"updates": [...]} — поставить обновления в очередь getUpdates (для python lis.py poll).
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeTelegram:
+    """HTTP-сервер в отдельном потоке; calls — записанные вызовы (method, chat_id, время)."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0, retry_after=1, seed=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self.calls = []
+        self.rate_limited = Counter()
+        # Очередь getUpdates: обновления уходят из неё, когда бот подтверждает их offset
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._updates_ready = threading.Condition(self._lock)
+        self.updates_confirmed = 0
+        self.get_updates_calls = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.rate_limited.clear()
+            self._updates.clear()
+            self.updates_confirmed = 0
+            self.get_updates_calls = 0
+
+    def push_updates(self, updates):
+        """Ставит обновления в очередь getUpdates; update_id назначаются по порядку, как в Telegram."""
+        with self._lock:
+            for update in updates:
+                self._updates.append(dict(update, update_id=next(self._update_ids)))
+            self._updates_ready.notify_all()
+            return len(self._updates)
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = min(100, int(params.get("limit") or 100))
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._lock:
+            self.get_updates_calls += 1
+            # Как в Bot API: запрос с offset подтверждает все обновления с меньшим update_id
+            confirmed = 0
+            while confirmed < len(self._updates) and self._updates[confirmed]["update_id"] < offset:
+                confirmed += 1
+            del self._updates[:confirmed]
+            self.updates_confirmed += confirmed
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_ready.wait(remaining)
+            return self._updates[:limit]
+
+    def stats(self):
+        with self._lock:
+            by_method = Counter(method for method, _, _ in self.calls)
+            chats = {chat for _, chat, _ in self.calls if chat is not None}
+            return {
+                "calls": len(self.calls),
+                "by_method": dict(by_method),
+                "chats": len(chats),
+                "rate_limited": dict(self.rate_limited),
+                "updates_pending": len(self._updates),
+                "updates_confirmed": self.updates_confirmed,
+                "get_updates_calls": self.get_updates_calls,
+                "latency_ms": self.latency_ms,
+                "rate_429": self.rate_429,
+            }
+
+    # ---------- ответы Bot API ----------
+    def _should_limit(self):
+        with self._lock:
+            return self.rate_429 > 0 and self._rnd.random() < self.rate_429
+
+    def _delay(self):
+        if self.latency_ms or self.jitter_ms:
+            with self._lock:
+                jitter = self._rnd.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+            time.sleep((self.latency_ms + jitter) / 1000.0)
+
+    def _message(self, chat_id, **fields):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+        }
+        message.update(fields)
+        return message
+
+    def _photo(self):
+        file_no = next(self._file_ids)
+        return [{"file_id": f"fake-file-{file_no}", "file_unique_id": f"u{file_no}", "width": 800, "height": 600}]
+
+    def handle(self, api_method, params):
+        """Возвращает (HTTP-статус, тело ответа) для вызова api_method."""
+        chat_id = params.get("chat_id")
+        self._delay()
+        if api_method == "getUpdates":
+            # Не попадает в calls: опрос идёт постоянно и не является ответом бота
+            return 200, {"ok": True, "result": self._get_updates(params)}
+        if api_method in RATE_LIMITED_METHODS and self._should_limit():
+            with self._lock:
+                self.rate_limited[api_method] += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        with self._lock:
+            self.calls.append((api_method, chat_id, time.time()))
+
+        if api_method == "sendMessage":
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif api_method == "sendPhoto":
+            result = self._message(chat_id, photo=self._photo(), caption=params.get("caption"))
+        elif api_method == "sendMediaGroup":
+            media = json.loads(params.get("media") or "[]")
+            result = [self._message(chat_id, photo=self._photo()) for _ in media]
+        elif api_method == "editMessageText":
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif api_method in ("answerCallbackQuery", "setWebhook", "deleteWebhook", "deleteMessage"):
+            result = True
+        else:
+            return 404, {"ok": False, "error_code": 404, "description": f"Not Found: method {api_method}"}
+        return 200, {"ok": True, "result": result}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _params(self):
+                split = urlsplit(self.path)
+                params = dict(parse_qsl(split.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type", "")
+                if body and content_type.startswith("application/json"):
+                    params.update(json.loads(body))
+                elif body and content_type.startswith("application/x-www-form-urlencoded"):
+                    params.update(parse_qsl(body.decode("utf-8")))
+                # multipart (загрузка файлов) не разбираем: нужные поля telebot передаёт в query string
+                return split.path, params
+
+            def _dispatch(self):
+                path, params = self._params()
+                if path == "/_stats":
+                    return self._reply(200, fake.stats())
+                if path == "/_reset":
+                    fake.reset()
+                    return self._reply(200, {"ok": True})
+                if path == "/_updates":
+                    return self._reply(200, {"ok": True, "pending": fake.push_updates(params.get("updates") or [])})
+                if path == "/_config":
+                    for key in ("latency_ms", "jitter_ms", "rate_429", "retry_after"):
+                        if key in params:
+                            setattr(fake, key, float(params[key]) if key != "retry_after" else int(params[key]))
+                    return self._reply(200, fake.stats())
+                # /bot<token>/<method>
+                parts = path.strip("/").split("/")
+                if len(parts) != 2 or not parts[0].startswith("bot"):
+                    return self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                self._reply(*fake.handle(parts[1], params))
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+        return Handler
+
+
+# Методы, на которых реальный Telegram отвечает 429 при превышении лимитов
+RATE_LIMITED_METHODS = frozenset({"sendMessage", "sendPhoto", "sendMediaGroup", "editMessageText"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка каждого ответа")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="случайная добавка к задержке (0..jitter)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429 на отправку сообщений (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.host, args.port, args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after).start()
+    print(f"Заглушка Telegram Bot API: {fake.url} (TELEGRAM_API_URL={fake.url})", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
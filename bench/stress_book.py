@@ -0,0 +1,109 @@
+"""Нагрузочный тест конкурентных броней: сотни параллельных POST /book на одни и те же столы.
+
+Проверяет, что при любом BOOKING_CONFLICT_MODE в базе не появляется
+пересекающихся броней, и печатает распределение ответов и задержки.
+
+    python bench/stress_book.py --url http://127.0.0.1:5000 --requests 500 --concurrency 100 \\
+        --dsn postgresql://... --date 2031-01-15
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import psycopg2
+import requests
+
+from _common import summarize, write_results
+from queries import day_bounds
+
+# Пары пересекающихся броней одного стола за день (должно быть 0)
+OVERLAP_SQL = """
+    SELECT count(*)
+    FROM bookings a
+    JOIN bookings b
+      ON a.table_id = b.table_id
+     AND a.booking_id < b.booking_id
+     AND a.booking_for < b.booking_for + COALESCE(b.duration_hours, 1) * INTERVAL '1 hour'
+     AND b.booking_for < a.booking_for + COALESCE(a.duration_hours, 1) * INTERVAL '1 hour'
+    WHERE a.booking_for >= %s AND a.booking_for < %s
+      AND b.booking_for >= %s AND b.booking_for < %s;
+"""
+
+SLOTS = [f"{h:02d}:{m:02d}" for h in range(12, 22) for m in (0, 30)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=os.environ.get("BENCH_APP_URL", "http://127.0.0.1:5000"))
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DATABASE_URL") or os.environ.get("DATABASE_URL"))
+    parser.add_argument("--date", required=True, help="дата броней (YYYY-MM-DD); брони на эту дату удаляются перед прогоном")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--tables", type=int, default=2, help="сколько столов делят нагрузку (меньше — больше конфликтов)")
+    parser.add_argument("--output", help="путь для JSON с результатами")
+    args = parser.parse_args()
+
+    start, end = day_bounds(datetime.strptime(args.date, "%Y-%m-%d").date())
+    if args.dsn:
+        with psycopg2.connect(args.dsn) as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM bookings WHERE booking_for >= %s AND booking_for < %s;", (start, end))
+
+    rnd = random.Random(7)
+    payloads = [{
+        "user_id": 100000 + i,
+        "user_name": f"stress-{i}",
+        "phone": "+375291234567",
+        "guests": 2,
+        "table": rnd.randint(1, args.tables),
+        "time": rnd.choice(SLOTS),
+        "date": args.date,
+        "duration_hours": rnd.randint(1, 3),
+    } for i in range(args.requests)]
+
+    barrier = threading.Barrier(min(args.concurrency, args.requests))
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def fire(payload, sync_start):
+        if sync_start:
+            barrier.wait()  # первая волна стартует одновременно
+        started = time.perf_counter()
+        try:
+            status = session.post(f"{args.url}/book", json=payload, timeout=60).status_code
+        except requests.RequestException:
+            status = "error"
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda ip: fire(ip[1], ip[0] < barrier.parties), enumerate(payloads)))
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter(str(status) for status, _ in results)
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "tables": args.tables,
+        "statuses": dict(statuses),
+        "latency": summarize([lat for _, lat in results], elapsed),
+    }
+    if args.dsn:
+        with psycopg2.connect(args.dsn) as conn, conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM bookings WHERE booking_for >= %s AND booking_for < %s;", (start, end))
+            report["rows_created"] = cur.fetchone()[0]
+            cur.execute(OVERLAP_SQL, (start, end, start, end))
+            report["overlapping_pairs"] = cur.fetchone()[0]
+    write_results("stress_book", report, args.output)
+    if report.get("overlapping_pairs"):
+        raise SystemExit("ОШИБКА: в базе есть пересекающиеся брони!")
+
+
+if __name__ == "__main__":
+    main()
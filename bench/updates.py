@@ -0,0 +1,118 @@
+"""Генератор синтетических Update для /webhook: текстовые команды, web_app_data и callback-запросы.
+
+Форма полезной нагрузки — как у Telegram (см. types.Update.de_json), поэтому
+lis.py обрабатывает их теми же обработчиками, что и настоящие обновления.
+
+    from updates import UpdateFactory
+    factory = UpdateFactory(seed=1)
+    payloads = factory.mixed(1000)
+"""
+import itertools
+import json
+import random
+import time
+from datetime import date, timedelta
+
+# Копия lis.MENU_CATEGORIES (импорт lis требует всех переменных окружения)
+MENU_CATEGORIES = [
+    "🥣 Закуски (Холодные)",
+    "🌶️ Закуски (Горячие/Супы)",
+    "🥗 Салаты",
+    "🍔 Бургеры",
+    "🌯 Сэндвичи & Роллы",
+    "🍖 Основное (Говядина)",
+    "🐟 Основное (Рыба/Свинина)",
+    "🍗 Основное (Курица/Утка)",
+    "🥩 Премиум Стейки",
+    "☕ Десерты & Напитки",
+]
+TEXT_COMMANDS = ["/start", "📖 Меню", "📋 Моя бронь"]
+SLOTS = [f"{h:02d}:{m:02d}" for h in range(12, 22) for m in (0, 30)]
+
+# Доли типов обновлений в mixed() — примерно как в живом трафике бота
+DEFAULT_MIX = {"text": 0.55, "callback_menu": 0.25, "web_app_data": 0.15, "callback_cancel": 0.05}
+
+
+class UpdateFactory:
+    """Генерирует словари Update; user_id берутся из диапазона [first_user_id, first_user_id + users)."""
+
+    def __init__(self, seed=1, users=500, first_user_id=500000, tables=20, days_ahead=14):
+        self.rnd = random.Random(seed)
+        self.users = users
+        self.first_user_id = first_user_id
+        self.tables = tables
+        self.days_ahead = days_ahead
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+
+    def _user(self, user_id=None):
+        user_id = user_id or self.first_user_id + self.rnd.randrange(self.users)
+        return {"id": user_id, "is_bot": False, "first_name": f"Bench {user_id}", "language_code": "ru"}
+
+    def _message(self, user, **fields):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private", "first_name": user["first_name"]},
+            "from": user,
+        }
+        message.update(fields)
+        return message
+
+    def _update(self, **fields):
+        update = {"update_id": next(self._update_ids)}
+        update.update(fields)
+        return update
+
+    # ---------- отдельные типы ----------
+    def text(self, text=None, user_id=None):
+        user = self._user(user_id)
+        text = text or self.rnd.choice(TEXT_COMMANDS)
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"offset": 0, "length": len(text.split()[0]), "type": "bot_command"}]
+        return self._update(message=self._message(user, **fields))
+
+    def booking_payload(self, table_id=None, day=None, slot=None):
+        day = day or date.today() + timedelta(days=self.rnd.randint(1, self.days_ahead))
+        return {
+            "phone": "+37529" + "".join(str(self.rnd.randrange(10)) for _ in range(7)),
+            "guests": self.rnd.randint(1, 8),
+            "table": table_id or self.rnd.randint(1, self.tables),
+            "time": slot or self.rnd.choice(SLOTS),
+            "date": day.isoformat(),
+            "duration_hours": self.rnd.randint(1, 3),
+        }
+
+    def web_app_data(self, user_id=None, **booking):
+        user = self._user(user_id)
+        data = json.dumps(self.booking_payload(**booking), ensure_ascii=False)
+        return self._update(message=self._message(user, web_app_data={"data": data, "button_text": "🗓️ Забронировать"}))
+
+    def callback(self, data, user_id=None):
+        user = self._user(user_id)
+        bot_message = self._message({"id": user["id"], "first_name": user["first_name"]}, text="⬇️ Выберите раздел:")
+        bot_message["from"] = {"id": 1, "is_bot": True, "first_name": "Bot"}
+        return self._update(callback_query={
+            "id": str(next(self._callback_ids)),
+            "from": user,
+            "message": bot_message,
+            "chat_instance": str(user["id"]),
+            "data": data,
+        })
+
+    def callback_menu(self, user_id=None):
+        return self.callback(f"menu_cat_{self.rnd.choice(MENU_CATEGORIES)}", user_id)
+
+    def callback_cancel(self, booking_id=None, user_id=None):
+        return self.callback(f"cancel_{booking_id or self.rnd.randint(1, 10 ** 6)}", user_id)
+
+    # ---------- смесь ----------
+    def mixed(self, count, mix=None):
+        """Список из count обновлений в пропорциях mix ({тип: доля})."""
+        mix = mix or DEFAULT_MIX
+        kinds, weights = zip(*mix.items())
+        makers = {"text": self.text, "callback_menu": self.callback_menu,
+                  "web_app_data": self.web_app_data, "callback_cancel": self.callback_cancel}
+        return [makers[kind]() for kind in self.rnd.choices(kinds, weights, k=count)]
@@ -0,0 +1,222 @@
+import html
+import re
+from collections import namedtuple
+
+from clock import local_date_str, parse_local
+from outbox import enqueue_message
+from queries import insert_booking, insert_bookings
+
+# =========================
+# БРОНИРОВАНИЕ: ПРОВЕРКА И ЗАПИСЬ
+# =========================
+# Единственный путь брони для всех входов: POST /book и /book_batch (lis.py),
+# данные WebApp (lis.on_webapp_data) и асинхронный asgi.py.
+#
+# parse_booking_request проверяет поля без обращения к БД и возвращает
+# BookingRequest с уже приведёнными типами; create_booking / create_bookings
+# в текущей транзакции вставляют бронь (или пакет броней) и кладут уведомления
+# гостю и админу в outbox — либо всё, либо ничего.
+
+MIN_GUESTS, MAX_GUESTS = 1, 20
+MIN_DURATION_HOURS, MAX_DURATION_HOURS = 1, 3
+# Значение поля table, при котором стол подбирается автоматически (allocation.py)
+AUTO_TABLE = "auto"
+# Начиная с этого числа гостей предварительный заказ согласуется с администратором
+LARGE_PARTY_GUESTS = 10
+
+PHONE_RE = re.compile(r'^\+375(25|29|33|44)\d{7}$')
+
+LARGE_PARTY_NOTICE = (
+    "⚠️ При количестве гостей 10 и более необходимо согласовать предварительный заказ. "
+    "Администратор свяжется с Вами в ближайшее время!"
+)
+LARGE_PARTY_ADMIN_NOTE = "⚠️ ВНИМАНИЕ: гостей больше 10 — согласовать заказ."
+
+BookingRequest = namedtuple("BookingRequest", (
+    "user_id", "user_name", "phone", "guests", "table_id", "time_slot", "date_str", "duration_hours", "booking_start",
+))
+
+
+class BookingError(Exception):
+    """Запрос на бронь не прошёл проверку; status — HTTP-код ответа, details — ошибки по броням пакета."""
+
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+
+def parse_duration_hours(value) -> int:
+    """Длительность брони в часах (целое от MIN до MAX_DURATION_HOURS); BookingError — при ошибке."""
+    try:
+        duration_hours = int(value)
+    except (TypeError, ValueError):
+        raise BookingError("Некорректная длительность брони.")
+    if duration_hours < MIN_DURATION_HOURS or duration_hours > MAX_DURATION_HOURS:
+        raise BookingError("Длительность брони должна быть от 1 до 3 часов.")
+    return duration_hours
+
+
+def parse_booking_request(data, user_id=None, user_name=None, require_phone=False) -> BookingRequest:
+    """Проверяет данные брони и возвращает BookingRequest; BookingError — при ошибке.
+
+    user_id / user_name, если заданы, берутся вместо полей data (WebApp: из сообщения
+    Telegram, а не из присланных данных). Телефон проверяется всегда, когда он указан.
+    table="auto" — стол не выбран (table_id=None), его подбирает автоподбор.
+    """
+    data = data or {}
+    duration_hours = parse_duration_hours(data.get('duration_hours', 1))
+
+    phone = data.get('phone')
+    guests = data.get('guests')
+    table_id = data.get('table')
+    time_slot = data.get('time')
+    date_str = data.get('date')
+    if not all([guests, table_id, time_slot, date_str]) or (require_phone and not phone):
+        raise BookingError("Не хватает данных для бронирования")
+
+    if phone is not None:
+        phone = str(phone)
+        if not PHONE_RE.match(phone):
+            raise BookingError("Неверный формат телефона. Укажите в формате +375 (ХХ) ХХХХХХХ.")
+
+    try:
+        guests = int(guests)
+    except (TypeError, ValueError):
+        raise BookingError("Некорректное значение количества гостей.")
+    if guests < MIN_GUESTS or guests > MAX_GUESTS:
+        raise BookingError("Количество гостей должно быть от 1 до 20.")
+
+    try:
+        # None — стол подберёт lis.book по числу гостей
+        table_id = None if table_id == AUTO_TABLE else int(table_id)
+        booking_start = parse_local(date_str, time_slot)
+    except (TypeError, ValueError):
+        raise BookingError("Некорректный стол, дата или время.")
+
+    if user_id is None:
+        try:
+            user_id = int(data.get('user_id') or 0)
+        except (TypeError, ValueError):
+            raise BookingError("Некорректный user_id.")
+
+    # Типы приводятся здесь: asyncpg, в отличие от psycopg2, не преобразует их сам
+    return BookingRequest(
+        user_id=user_id,
+        user_name=str(user_name or data.get('user_name') or 'Неизвестный'),
+        phone=phone,
+        guests=guests,
+        table_id=table_id,
+        time_slot=time_slot,
+        date_str=date_str,
+        duration_hours=duration_hours,
+        booking_start=booking_start,
+    )
+
+
+def parse_batch_request(data, max_size) -> list:
+    """Пакет броней: {"bookings": [...], общие user_id / user_name / phone}.
+
+    Проверяются все брони; если хоть одна не прошла — BookingError с details
+    [{"index": i, "message": ...}, ...].
+    """
+    data = data or {}
+    items = data.get('bookings')
+    if not isinstance(items, list) or not items:
+        raise BookingError("Нужен непустой список bookings.")
+    if len(items) > max_size:
+        raise BookingError(f"Не больше {max_size} броней в одном пакете.")
+    shared = {key: data[key] for key in ('user_id', 'user_name', 'phone') if key in data}
+    requests, errors = [], []
+    for i, item in enumerate(items):
+        try:
+            req = parse_booking_request({**shared, **(item or {})})
+        except BookingError as e:
+            errors.append({"index": i, "message": e.message})
+            continue
+        if req.table_id is None:
+            errors.append({"index": i, "message": "В пакете стол нужно указать явно."})
+            continue
+        requests.append(req)
+    if errors:
+        raise BookingError(f"Ошибки в бронях пакета: {len(errors)}.", details=errors)
+    return requests
+
+
+# ---------- уведомления ----------
+def _booking_line(req):
+    return (f"Стол: {req.table_id}\nДата: {local_date_str(req.booking_start)}\n"
+            f"Время: {req.time_slot}\nДлительность: {req.duration_hours} ч.")
+
+
+def user_link(user_id, user_name):
+    """Ссылка на пользователя для уведомлений админу с parse_mode=HTML (имя экранируется)."""
+    # Имя задаёт сам пользователь
+    name = html.escape(user_name or "")
+    return f'<a href="tg://user?id={user_id}">{name}</a>' if user_id else name
+
+
+def _user_link(req):
+    return user_link(req.user_id, req.user_name)
+
+
+def booking_messages(req, admin_id=None):
+    """Уведомления о новой брони: список (chat_id, kind, text, parse_mode) для outbox."""
+    messages = []
+    large_party = req.guests >= LARGE_PARTY_GUESTS
+    if req.user_id:
+        if large_party:
+            messages.append((req.user_id, "message", LARGE_PARTY_NOTICE, None))
+        messages.append((req.user_id, "message", f"✅ Ваша бронь успешно оформлена!\n\n{_booking_line(req)}", None))
+    if admin_id:
+        text = (f"Новая бронь:\nПользователь: {_user_link(req)}\n{_booking_line(req)}\n"
+                f"Гостей: {req.guests}\nТелефон: {req.phone or 'Не указан'}")
+        if large_party:
+            text += f"\n{LARGE_PARTY_ADMIN_NOTE}"
+        messages.append((admin_id, "admin", text, "HTML"))
+    return messages
+
+
+def batch_messages(reqs, admin_id=None):
+    """Уведомления о пакете: одно сообщение каждому гостю и одно админу."""
+    messages = []
+    by_user = {}
+    for req in reqs:
+        if req.user_id:
+            by_user.setdefault(req.user_id, []).append(req)
+    for user_id, own in by_user.items():
+        text = "✅ Ваши брони успешно оформлены!\n\n" + "\n\n".join(_booking_line(req) for req in own)
+        if any(req.guests >= LARGE_PARTY_GUESTS for req in own):
+            messages.append((user_id, "message", LARGE_PARTY_NOTICE, None))
+        messages.append((user_id, "message", text, None))
+    if admin_id:
+        lines = [f"Новые брони ({len(reqs)}):"]
+        for req in reqs:
+            lines.append(f"\n{_user_link(req)}, гостей: {req.guests}, телефон: {req.phone or 'Не указан'}\n{_booking_line(req)}")
+        if any(req.guests >= LARGE_PARTY_GUESTS for req in reqs):
+            lines.append(f"\n{LARGE_PARTY_ADMIN_NOTE}")
+        messages.append((admin_id, "admin", "\n".join(lines), "HTML"))
+    return messages
+
+
+# ---------- запись ----------
+def _row(req, booked_at):
+    return (req.user_id, req.user_name, req.phone, req.table_id, req.time_slot, req.guests, booked_at,
+            req.booking_start, req.duration_hours)
+
+
+def create_booking(cur, conflict_mode, req, booked_at, admin_id=None) -> int:
+    """Бронь и уведомления в текущей транзакции; возвращает booking_id. BookingConflict — стол занят."""
+    booking_id = insert_booking(cur, conflict_mode, *_row(req, booked_at))
+    for chat_id, kind, text, parse_mode in booking_messages(req, admin_id):
+        enqueue_message(cur, chat_id, text, parse_mode=parse_mode, kind=kind)
+    return booking_id
+
+
+def create_bookings(cur, conflict_mode, reqs, booked_at, admin_id=None) -> list:
+    """Пакет броней и уведомления в текущей транзакции; booking_id в порядке reqs."""
+    booking_ids = insert_bookings(cur, conflict_mode, [_row(req, booked_at) for req in reqs])
+    for chat_id, kind, text, parse_mode in batch_messages(reqs, admin_id):
+        enqueue_message(cur, chat_id, text, parse_mode=parse_mode, kind=kind)
+    return booking_ids
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+# =========================
+# КЭШ С TTL И LRU-ВЫТЕСНЕНИЕМ
+# =========================
+# Потокобезопасный кэш в памяти процесса. Запись живёт не дольше ttl секунд,
+# при переполнении вытесняется самая давно использованная.
+#
+# Защита от гонки "читатель загрузил старые данные, писатель инвалидировал,
+# читатель положил старое в кэш": перед загрузкой читатель берёт token(),
+# а set(..., token=...) ничего не сохранит, если с тех пор была инвалидация.
+
+MISSING = object()
+
+
+class TTLCache:
+    """LRU-кэш с ограничением по времени жизни записей и счётчиками попаданий."""
+
+    def __init__(self, maxsize=1000, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "stale_sets_skipped": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0 and self.ttl > 0
+
+    def token(self):
+        """Метка для set(): запись не сохранится, если после неё была инвалидация."""
+        with self._lock:
+            return self._epoch
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl=None, token=None):
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if token is not None and token != self._epoch:
+                self._stats["stale_sets_skipped"] += 1
+                return
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._stats["invalidations"] += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl})
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_ratio"] = round(snapshot["hits"] / lookups, 3) if lookups else 0.0
+        return snapshot
@@ -0,0 +1,88 @@
+from datetime import date, datetime, time, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from dateutil import tz
+
+# =========================
+# ЧАСЫ РЕСТОРАНА
+# =========================
+# Единственное место, где задан часовой пояс ресторана, и все преобразования
+# "момент времени <-> местная дата/время". Зона создаётся один раз при импорте
+# (zoneinfo кэширует её и считает смещения на C), поэтому в обработчиках
+# больше нет tz.gettz()/pytz.timezone() на каждый вызов.
+#
+# Значения из БД (timestamptz) приходят aware; наивные значения считаются уже
+# местным временем — так с ними обращался прежний код.
+#
+# Строки для сообщений ("дд.мм.гггг", "ЧЧ:ММ") кэшируются по номеру минуты от
+# эпохи: брони стоят на сетке слотов, поэтому в списках админ-панели и истории
+# почти каждая строка — попадание в кэш, без astimezone и strftime.
+
+RESTAURANT_TZ_NAME = "Europe/Moscow"
+RESTAURANT_TZ = ZoneInfo(RESTAURANT_TZ_NAME)
+
+DATE_FORMAT = "%d.%m.%Y"
+TIME_FORMAT = "%H:%M"
+
+
+def now_local() -> datetime:
+    """Текущий момент в часовом поясе ресторана."""
+    return datetime.now(RESTAURANT_TZ)
+
+
+def to_local(value: datetime) -> datetime:
+    """Момент времени в часовом поясе ресторана (наивное значение — уже местное)."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=RESTAURANT_TZ)
+    return value.astimezone(RESTAURANT_TZ)
+
+
+def localize(day: date, at: time, tzinfo=RESTAURANT_TZ) -> datetime:
+    """Местные дата и время -> aware datetime (по умолчанию в часовом поясе ресторана).
+
+    Несуществующее время (перевод часов вперёд) сдвигается на величину перехода,
+    неоднозначное (перевод назад) — первое из двух (fold=0).
+    """
+    return tz.resolve_imaginary(datetime.combine(day, at, tzinfo=tzinfo))
+
+
+def parse_local(date_str: str, time_str: str) -> datetime:
+    """'ГГГГ-ММ-ДД' и 'ЧЧ:ММ' из WebApp -> aware datetime в часовом поясе ресторана."""
+    return localize(date.fromisoformat(date_str), datetime.strptime(time_str, TIME_FORMAT).time())
+
+
+def local_day(value: datetime) -> date:
+    """Местная дата момента времени."""
+    return to_local(value).date()
+
+
+def _epoch_minute(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=RESTAURANT_TZ)
+    return int(value.timestamp()) // 60
+
+
+@lru_cache(maxsize=8192)
+def _local_strings(epoch_minute: int):
+    local = datetime.fromtimestamp(epoch_minute * 60, RESTAURANT_TZ)
+    return f"{local.day:02d}.{local.month:02d}.{local.year:04d}", f"{local.hour:02d}:{local.minute:02d}"
+
+
+def local_date_str(value: datetime) -> str:
+    """Местная дата в формате дд.мм.гггг."""
+    return _local_strings(_epoch_minute(value))[0]
+
+
+def local_time_str(value: datetime) -> str:
+    """Местное время в формате ЧЧ:ММ."""
+    return _local_strings(_epoch_minute(value))[1]
+
+
+def local_date_time_str(value: datetime):
+    """(дд.мм.гггг, ЧЧ:ММ) за одно обращение к кэшу."""
+    return _local_strings(_epoch_minute(value))
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
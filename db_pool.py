@@ -0,0 +1,325 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+log = logging.getLogger("lis.db_pool")
+
+# =========================
+# ПУЛ СОЕДИНЕНИЙ POSTGRESQL
+# =========================
+# Один пул на процесс (воркер gunicorn). Соединения переиспользуются между
+# обработчиками, поэтому TCP+TLS+auth рукопожатие происходит только при
+# создании нового соединения, а не на каждый запрос.
+#
+# Выдача идёт с "горячего" конца очереди (LIFO), поэтому простаивающие
+# соединения копятся на другом конце и при выдаче не проверяются. Их закрывает
+# фоновый поток раз в reap_interval: просроченные по max_lifetime — всегда,
+# по max_idle — только сверх minconn; затем пул добирается до minconn.
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+class _PooledConn:
+    """Служебная запись о соединении в пуле."""
+
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений psycopg2 со статистикой.
+
+    - minconn / maxconn — минимальное и максимальное число соединений;
+    - timeout — сколько ждать свободное соединение, прежде чем выбросить PoolTimeout;
+    - health_check_after — соединение, простоявшее дольше этого, проверяется "SELECT 1";
+    - max_idle — простоявшее дольше этого соединение закрывается (idle recycling);
+    - max_lifetime — соединение старше этого закрывается при возврате/выдаче;
+    - reap_interval — как часто фоновый поток закрывает просроченные простаивающие
+      соединения и добирает пул до minconn (0/None — без потока, см. reap());
+    - configure(conn) — вызывается для каждого нового соединения (например, PREPARE запросов).
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=5.0, health_check_after=30.0,
+                 max_idle=300.0, max_lifetime=3600.0, reap_interval=60.0, configure=None, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Некорректные размеры пула: min={minconn}, max={maxconn}")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.reap_interval = reap_interval
+        self.configure = configure
+        self.connect_kwargs = connect_kwargs
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._closed = False
+        self._reaper_stop = threading.Event()
+        self._reaper = None
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "closed": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+            "peak_in_use": 0,
+        }
+
+        self._fill()
+        if reap_interval:
+            self._reaper = threading.Thread(target=self._reap_loop, name="db-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    # ---------- служебное ----------
+    def _incr(self, key, value=1):
+        with self._cond:
+            self._stats[key] += value
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        if self.configure is not None:
+            try:
+                self.configure(conn)
+                conn.commit()
+            except Exception:
+                conn.close()
+                raise
+        self._incr("created")
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._incr("closed")
+
+    def _is_expired(self, item, now):
+        if self.max_lifetime and now - item.created_at > self.max_lifetime:
+            return True
+        if self.max_idle and now - item.last_used > self.max_idle:
+            return True
+        return False
+
+    def _fill(self):
+        """Создаёт соединения, пока их меньше minconn."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                item = _PooledConn(self._connect())
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                if not self._closed:
+                    self._idle.append(item)
+                    self._cond.notify()
+                    continue
+                self._size -= 1
+            self._close(item.conn)
+
+    def _reap_loop(self):
+        while not self._reaper_stop.wait(self.reap_interval):
+            try:
+                self.reap()
+            except Exception as e:
+                log.warning("Пул соединений: ошибка обслуживания: %s", e)
+
+    def reap(self):
+        """Закрывает просроченные простаивающие соединения по всей очереди и добирает пул до minconn.
+
+        Возвращает число закрытых соединений.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            if self._closed:
+                return 0
+            keep = deque()
+            # От самых давно простаивающих: сверх minconn закрываем и по max_idle
+            for item in self._idle:
+                too_old = self.max_lifetime and now - item.created_at > self.max_lifetime
+                too_idle = self.max_idle and now - item.last_used > self.max_idle
+                if too_old or (too_idle and self._size - len(expired) > self.minconn):
+                    expired.append(item)
+                else:
+                    keep.append(item)
+            self._idle = keep
+            self._size -= len(expired)
+            self._stats["recycled"] += len(expired)
+            if expired:
+                self._cond.notify(len(expired))
+        for item in expired:
+            self._close(item.conn)
+        self._fill()
+        return len(expired)
+
+    def _is_healthy(self, item, now):
+        if item.conn.closed:
+            return False
+        if self.health_check_after is None or now - item.last_used < self.health_check_after:
+            return True
+        try:
+            with item.conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            item.conn.rollback()
+            return True
+        except Exception:
+            self._incr("health_check_failures")
+            return False
+
+    # ---------- выдача / возврат ----------
+    def getconn(self):
+        """Выдаёт соединение из пула (или создаёт новое, если есть место)."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Пул соединений закрыт.")
+                if self._idle:
+                    item = self._idle.pop()  # LIFO: "горячие" соединения, хвост очереди стареет и закрывается
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    item = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"Нет свободных соединений за {self.timeout} с (max={self.maxconn}).")
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_time = time.monotonic() - started
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_time_total"] += wait_time
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+
+        # Проверки и подключение выполняются вне блокировки
+        now = time.monotonic()
+        if item is not None and (self._is_expired(item, now) or not self._is_healthy(item, now)):
+            self._close(item.conn)
+            self._incr("recycled")
+            item = None
+        if item is None:
+            try:
+                item = _PooledConn(self._connect())
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            self._in_use[id(item.conn)] = item
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], len(self._in_use))
+        return item.conn
+
+    def putconn(self, conn, discard=False):
+        """Возвращает соединение в пул; битые и незавершённые транзакции откатываются."""
+        with self._cond:
+            item = self._in_use.pop(id(conn), None)
+        if item is None:
+            return
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                discard = True
+        now = time.monotonic()
+        if discard or conn.closed or self._closed or (self.max_lifetime and now - item.created_at > self.max_lifetime):
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        item.last_used = now
+        with self._cond:
+            self._idle.append(item)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: commit при успехе, rollback при исключении, возврат в пул."""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            if not conn.closed and conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INTRANS:
+                conn.commit()
+        except Exception:
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard or bool(conn.closed))
+
+    def closeall(self):
+        """Закрывает все простаивающие соединения и запрещает новые выдачи."""
+        self._reaper_stop.set()
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for item in idle:
+            self._close(item.conn)
+
+    # ---------- статистика ----------
+    def stats(self) -> dict:
+        """Снимок статистики пула: выдачи, ожидание, насыщенность."""
+        with self._cond:
+            in_use = len(self._in_use)
+            snapshot = dict(self._stats)
+            snapshot.update({
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "saturation": round(in_use / self.maxconn, 3),
+            })
+        checkouts = snapshot["checkouts"]
+        snapshot["wait_time_avg"] = snapshot["wait_time_total"] / checkouts if checkouts else 0.0
+        return snapshot
@@ -0,0 +1,270 @@
+import os
+import queue
+import threading
+import time
+import logging
+
+from metrics import UPDATE_BATCH_SIZE, UPDATE_STAGE_SECONDS
+
+log = logging.getLogger("lis.dispatch")
+
+# =========================
+# ФОНОВАЯ ОБРАБОТКА ОБНОВЛЕНИЙ
+# =========================
+# Вебхук кладёт Update в ограниченную очередь и сразу отвечает Telegram 200.
+# Пул потоков разбирает очереди. Обновления одного чата всегда попадают в один
+# и тот же поток (шард по chat_id), поэтому порядок внутри чата сохраняется.
+# Поток забирает из своей очереди всё, что накопилось (до batch_size), и
+# передаёт обработчику списками подряд идущих обновлений одного вида:
+# bot.process_new_updates перегруппировывает список по видам (сначала все
+# сообщения, потом callback-запросы...), и смешанный список нарушил бы порядок.
+
+_UPDATE_KINDS = ("message", "edited_message", "channel_post", "edited_channel_post", "callback_query",
+                 "inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll",
+                 "poll_answer", "my_chat_member", "chat_member", "chat_join_request")
+
+_STOP = object()
+
+
+def update_chat_id(update):
+    """Возвращает chat_id обновления (или user_id / update_id, если чата нет)."""
+    for attr in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        msg = getattr(update, attr, None)
+        if msg is not None:
+            return msg.chat.id
+    call = getattr(update, "callback_query", None)
+    if call is not None:
+        if call.message is not None:
+            return call.message.chat.id
+        return call.from_user.id
+    for attr in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "my_chat_member", "chat_member"):
+        obj = getattr(update, attr, None)
+        if obj is not None:
+            chat = getattr(obj, "chat", None)
+            if chat is not None:
+                return chat.id
+            return obj.from_user.id
+    return update.update_id
+
+
+def update_kind(update):
+    """Вид обновления — имя заполненного поля Update ("message", "callback_query", ...)."""
+    for attr in _UPDATE_KINDS:
+        if getattr(update, attr, None) is not None:
+            return attr
+    return None
+
+
+def same_kind_runs(updates):
+    """Разбивает список на отрезки подряд идущих обновлений одного вида, сохраняя порядок."""
+    runs = []
+    for update in updates:
+        kind = update_kind(update)
+        if runs and runs[-1][0] == kind:
+            runs[-1][1].append(update)
+        else:
+            runs.append((kind, [update]))
+    return [run for _, run in runs]
+
+
+class QueueFull(Exception):
+    """Очередь шарда заполнена — обновление не принято."""
+
+
+class UpdateDispatcher:
+    """Пул потоков с ограниченными очередями и шардированием по чату.
+
+    handler — функция, принимающая список Update (обычно bot.process_new_updates);
+    ошибка одного обновления не должна прерывать обработку остальных в списке.
+    В одном списке — только обновления одного вида, в порядке поступления.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=1000, enqueue_timeout=0.0, batch_size=1, name="updates"):
+        if workers < 1:
+            raise ValueError("workers должно быть >= 1")
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = max(1, batch_size)
+        self.enqueue_timeout = enqueue_timeout
+        self.name = name
+        self.pid = os.getpid()
+        # Общая ёмкость делится между шардами
+        per_shard = max(1, queue_size // workers)
+        self._queues = [queue.Queue(maxsize=per_shard) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "batches": 0,
+            "batch_max": 0,
+            "failed": 0,
+            "rejected": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "handle_time_total": 0.0,
+            "handle_time_max": 0.0,
+            "max_depth": 0,
+        }
+
+    def start(self):
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def _incr(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                self._stats[key] += value
+
+    def _shard(self, update):
+        return self._queues[hash(update_chat_id(update)) % self.workers]
+
+    def _put(self, q, update, timeout):
+        try:
+            if timeout > 0:
+                q.put((time.monotonic(), update), timeout=timeout)
+            else:
+                q.put_nowait((time.monotonic(), update))
+        except queue.Full:
+            return False
+        return True
+
+    def submit(self, update, timeout=None):
+        """Ставит обновление в очередь шарда. При переполнении бросает QueueFull.
+
+        timeout — сколько ждать места в очереди (по умолчанию enqueue_timeout).
+        """
+        if self._stopping:
+            raise QueueFull("Диспетчер останавливается.")
+        q = self._shard(update)
+        if not self._put(q, update, self.enqueue_timeout if timeout is None else timeout):
+            self._incr(rejected=1)
+            raise QueueFull(f"Очередь переполнена ({q.maxsize}).")
+        depth = q.qsize()
+        with self._lock:
+            self._stats["enqueued"] += 1
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+
+    def submit_many(self, updates, timeout=None, prefix=False) -> list:
+        """Ставит пачку обновлений в очереди шардов; возвращает не принятые (в исходном порядке).
+
+        Если очередь шарда заполнилась, остальные обновления этого шарда тоже
+        не ставятся — иначе порядок внутри чата нарушится при повторной отправке.
+        prefix=True — остановиться на первом отказе: принятые обновления всегда
+        образуют начало пачки (нужно, чтобы подтвердить их одним offset).
+        """
+        if self._stopping:
+            return list(updates)
+        timeout = self.enqueue_timeout if timeout is None else timeout
+        rejected, full = [], set()
+        accepted = depth = 0
+        for i, update in enumerate(updates):
+            q = self._shard(update)
+            if id(q) in full or not self._put(q, update, timeout):
+                if prefix:
+                    rejected = list(updates[i:])
+                    break
+                full.add(id(q))
+                rejected.append(update)
+                continue
+            accepted += 1
+            depth = max(depth, q.qsize())
+        with self._lock:
+            self._stats["enqueued"] += accepted
+            self._stats["rejected"] += len(rejected)
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+        return rejected
+
+    def _take_batch(self, q):
+        """Первое обновление — с ожиданием, остальные — сколько уже лежит в очереди (до batch_size)."""
+        batch = [q.get()]
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self, q):
+        while True:
+            batch = self._take_batch(q)
+            stop = batch[-1] is _STOP
+            items = batch[:-1] if stop else batch
+            try:
+                if items:
+                    self._handle(items)
+            finally:
+                for _ in batch:
+                    q.task_done()
+            if stop:
+                return
+
+    def _handle(self, items):
+        started = time.monotonic()
+        updates = [update for _, update in items]
+        waits = [started - enqueued_at for enqueued_at, _ in items]
+        failed = 0
+        for run in same_kind_runs(updates):
+            try:
+                self.handler(run)
+            except Exception as e:
+                failed += len(run)
+                ids = [update.update_id for update in run]
+                log.error("Ошибка обработки обновлений %s: %s", ids, e, exc_info=True)
+        elapsed = time.monotonic() - started
+        for waited in waits:
+            UPDATE_STAGE_SECONDS.observe(waited, "dispatcher", "queue_wait")
+        UPDATE_STAGE_SECONDS.observe(elapsed, "dispatcher", "handle")
+        UPDATE_BATCH_SIZE.observe(len(updates), "handle")
+        with self._lock:
+            self._stats["processed"] += len(updates)
+            self._stats["batches"] += 1
+            self._stats["batch_max"] = max(self._stats["batch_max"], len(updates))
+            self._stats["failed"] += failed
+            self._stats["queue_wait_total"] += sum(waits)
+            self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], max(waits))
+            self._stats["handle_time_total"] += elapsed
+            self._stats["handle_time_max"] = max(self._stats["handle_time_max"], elapsed)
+
+    def shutdown(self, timeout=10.0):
+        """Перестаёт принимать обновления и дожидается, пока очереди опустеют."""
+        if self._stopping:
+            return
+        self._stopping = True
+        deadline = time.monotonic() + timeout
+        for q in self._queues:
+            # Стоп-маркер встаёт в конец очереди — всё, что уже принято, будет обработано
+            try:
+                q.put(_STOP, timeout=max(0.01, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        left = sum(q.qsize() for q in self._queues)
+        if left:
+            log.warning("Диспетчер %s: не обработано %s обновлений при остановке.", self.name, left)
+
+    def stats(self) -> dict:
+        """Снимок метрик: глубина очередей, ожидание, отказы (backpressure)."""
+        depths = [q.qsize() for q in self._queues]
+        with self._lock:
+            snapshot = dict(self._stats)
+        processed = snapshot["processed"]
+        batches = snapshot["batches"]
+        snapshot.update({
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "batch_avg": processed / batches if batches else 0.0,
+            "depth": sum(depths),
+            "depth_per_worker": depths,
+            "capacity": sum(q.maxsize for q in self._queues),
+            "queue_wait_avg": snapshot["queue_wait_total"] / processed if processed else 0.0,
+            "handle_time_avg": snapshot["handle_time_total"] / batches if batches else 0.0,
+        })
+        return snapshot
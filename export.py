@@ -0,0 +1,158 @@
+import csv
+import io
+import json
+from datetime import date
+
+from psycopg2.extensions import cursor as TupleCursor
+
+from clock import to_local
+from queries import day_bounds
+
+# =========================
+# ВЫГРУЗКА ИСТОРИИ БРОНЕЙ
+# =========================
+# Брони читаются серверным (именованным) курсором: Postgres отдаёт их пачками
+# по batch_size строк, и в памяти процесса одновременно находится не больше
+# одной пачки и одного сформированного куска CSV/NDJSON — независимо от того,
+# сколько всего строк в выгрузке. Куски отдаются генератором, который можно
+# передать прямо в потоковый ответ Flask или писать в файл.
+
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_COLUMNS = (
+    "booking_id", "user_id", "user_name", "phone", "guests", "table_id",
+    "time_slot", "duration_hours", "booking_for", "booked_at",
+)
+CONTENT_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson; charset=utf-8"}
+FILE_EXTENSIONS = {"csv": "csv", "ndjson": "ndjson"}
+
+_TIMESTAMP_COLUMNS = frozenset({"booking_for", "booked_at"})
+
+
+def export_query(date_from=None, date_to=None, table_ids=None):
+    """SQL и параметры выгрузки; date_from/date_to — местные даты включительно."""
+    conditions, params = [], []
+    if date_from is not None:
+        conditions.append("booking_for >= %s")
+        params.append(day_bounds(date_from)[0])
+    if date_to is not None:
+        conditions.append("booking_for < %s")
+        params.append(day_bounds(date_to)[1])
+    if table_ids:
+        conditions.append("table_id = ANY(%s)")
+        params.append(list(table_ids))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Порядок по (booking_for, booking_id) идёт по индексу idx_bookings_keyset, без сортировки в памяти
+    sql = f"""
+        SELECT {', '.join(EXPORT_COLUMNS)}
+        FROM bookings
+        {where}
+        ORDER BY booking_for, booking_id;
+    """
+    return sql, params
+
+
+def iter_booking_batches(conn, date_from=None, date_to=None, table_ids=None, batch_size=1000):
+    """Пачки строк (кортежи в порядке EXPORT_COLUMNS) из серверного курсора.
+
+    conn должен быть в транзакции (не autocommit): именованный курсор живёт до её конца.
+    """
+    sql, params = export_query(date_from, date_to, table_ids)
+    with conn.cursor(name="bookings_export", cursor_factory=TupleCursor) as cur:
+        cur.itersize = batch_size
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def _format_value(column, value):
+    if value is None:
+        return None
+    if column in _TIMESTAMP_COLUMNS:
+        return to_local(value).isoformat(timespec="seconds")
+    return value
+
+
+def _prepare(row):
+    return [_format_value(column, value) for column, value in zip(EXPORT_COLUMNS, row)]
+
+
+def csv_chunks(batches):
+    """CSV: заголовок и по одному куску текста на пачку."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(_prepare(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(batches):
+    """NDJSON: одна JSON-строка на бронь, по одному куску текста на пачку."""
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, _prepare(row))), ensure_ascii=False, default=str) + "\n"
+            for row in rows
+        )
+
+
+def export_chunks(fmt, batches):
+    """Куски текста выгрузки в формате fmt ("csv" или "ndjson")."""
+    if fmt == "csv":
+        return csv_chunks(batches)
+    if fmt == "ndjson":
+        return ndjson_chunks(batches)
+    raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+
+def export_filename(fmt, date_from=None, date_to=None, table_ids=None):
+    parts = ["bookings"]
+    if date_from or date_to:
+        parts.append(f"{date_from or ''}_{date_to or ''}")
+    if table_ids:
+        parts.append("t" + "-".join(str(t) for t in table_ids))
+    return ".".join(("_".join(parts), FILE_EXTENSIONS[fmt]))
+
+
+def write_export(fileobj, fmt, batches):
+    """Пишет выгрузку в двоичный файл (UTF-8); возвращает число записанных байт."""
+    written = 0
+    for chunk in export_chunks(fmt, batches):
+        data = chunk.encode("utf-8")
+        fileobj.write(data)
+        written += len(data)
+    return written
+
+
+def parse_export_args(args):
+    """Разбор аргументов /export: формат, даты ГГГГ-ММ-ДД, номера столов через запятую (в любом порядке).
+
+    Одна дата — выгрузка за этот день, две — за период включительно.
+    Возвращает (fmt, date_from, date_to, table_ids); ValueError — при ошибке.
+    """
+    fmt, dates, table_ids = "csv", [], []
+    for arg in args:
+        arg = arg.strip().lower()
+        if not arg:
+            continue
+        if arg in ("json", "ndjson"):
+            fmt = "ndjson"
+        elif arg == "csv":
+            fmt = "csv"
+        elif arg.count("-") == 2:
+            dates.append(date.fromisoformat(arg))
+        else:
+            table_ids.extend(int(t) for t in arg.split(",") if t)
+    if len(dates) > 2:
+        raise ValueError("Укажите не больше двух дат: начало и конец периода.")
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else date_from
+    if date_from and date_to and date_to < date_from:
+        raise ValueError("Дата окончания раньше даты начала.")
+    return fmt, date_from, date_to, sorted(set(table_ids)) or None
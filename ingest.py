@@ -0,0 +1,275 @@
+import collections
+import logging
+import os
+import random
+import threading
+import time
+
+from dispatch import QueueFull
+from metrics import UPDATE_BATCH_SIZE, UPDATE_STAGE_SECONDS
+
+log = logging.getLogger("lis.ingest")
+
+# =========================
+# ПРИЁМ ОБНОВЛЕНИЙ ПАЧКАМИ
+# =========================
+# Два источника обновлений для одного UpdateDispatcher:
+#
+# WebhookBatcher — Telegram присылает по одному Update на HTTP-запрос; вебхук
+# кладёт его в буфер, а поток пачки раз в window секунд (или как только
+# набралось max_batch) передаёт накопленное диспетчеру одним submit_many.
+# Запрос вебхука ждёт, пока диспетчер примет (или отклонит) его обновление, и
+# только тогда отвечает: 200 — обновление в очереди, 503 — Telegram повторит.
+#
+# UpdatePoller — long polling getUpdates для локального и staging-запуска
+# (python lis.py poll): забирает до limit обновлений за вызов, отдаёт их
+# диспетчеру и подтверждает offset только после того, как диспетчер принял
+# всю пачку. Вебхук и getUpdates у одного бота взаимоисключающие.
+#
+# Время этапов пишется в гистограмму update_stage_duration_seconds:
+# receive / fetch -> batch_wait -> enqueue здесь, queue_wait -> handle в диспетчере.
+
+
+class _Pending:
+    """Обновление в буфере пачки и ответ диспетчера для ждущего запроса вебхука."""
+
+    __slots__ = ("update", "done", "accepted")
+
+    def __init__(self, update):
+        self.update = update
+        self.done = threading.Event()
+        self.accepted = False
+
+
+class WebhookBatcher:
+    """Буфер обновлений вебхука с периодической отправкой пачками в диспетчер.
+
+    buffer_size — сколько обновлений может ждать отправки; сверх него submit
+    бросает QueueFull, и вебхук отвечает 503 (Telegram повторит доставку).
+    enqueue_timeout — сколько поток пачки ждёт места в очереди диспетчера.
+    submit возвращается, только когда диспетчер принял обновление, и бросает
+    QueueFull, если не принял или ответа нет дольше ack_timeout (по умолчанию
+    window + 2 * enqueue_timeout + 1 с). В последнем случае обновление может
+    быть и принято — Telegram доставит его повторно: лучше дубль, чем потеря.
+    """
+
+    def __init__(self, dispatcher, window=0.005, max_batch=100, buffer_size=1000, enqueue_timeout=1.0,
+                 ack_timeout=None, name="webhook-batcher"):
+        self.dispatcher = dispatcher
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.buffer_size = buffer_size
+        self.enqueue_timeout = enqueue_timeout
+        self.ack_timeout = window + 2 * enqueue_timeout + 1.0 if ack_timeout is None else ack_timeout
+        self.name = name
+        self.pid = os.getpid()
+        self._buffer = collections.deque()  # (время поступления, _Pending)
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._stats = {"received": 0, "rejected": 0, "flushes": 0, "dispatcher_rejected": 0, "ack_timeouts": 0,
+                       "batch_max": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, update):
+        """Кладёт обновление в буфер и ждёт, пока его примет диспетчер; иначе QueueFull."""
+        pending = _Pending(update)
+        with self._cond:
+            if self._stopping:
+                raise QueueFull("Приём обновлений останавливается.")
+            if len(self._buffer) >= self.buffer_size:
+                self._stats["rejected"] += 1
+                raise QueueFull(f"Буфер пачки переполнен ({self.buffer_size}).")
+            self._buffer.append((time.monotonic(), pending))
+            self._stats["received"] += 1
+            # Поток пачки ждёт первого обновления или полной пачки
+            if len(self._buffer) == 1 or len(self._buffer) >= self.max_batch:
+                self._cond.notify()
+        if not pending.done.wait(self.ack_timeout):
+            with self._cond:
+                self._stats["ack_timeouts"] += 1
+            raise QueueFull(f"Диспетчер не ответил за {self.ack_timeout:.1f} с.")
+        if not pending.accepted:
+            raise QueueFull("Диспетчер не принял обновление.")
+
+    def _next_batch(self):
+        """Ждёт, пока наберётся пачка или истечёт окно первого обновления; None — остановка и буфер пуст."""
+        with self._cond:
+            while not self._buffer:
+                if self._stopping:
+                    return None
+                self._cond.wait()
+            deadline = self._buffer[0][0] + self.window
+            while len(self._buffer) < self.max_batch and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._buffer), self.max_batch)
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._flush(batch)
+            except Exception as e:
+                log.error("Ошибка отправки пачки обновлений в диспетчер: %s", e, exc_info=True)
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        UPDATE_STAGE_SECONDS.observe(started - batch[0][0], "webhook", "batch_wait")
+        UPDATE_BATCH_SIZE.observe(len(batch), "webhook")
+        # Если submit_many упадёт, обновления считаются не принятыми
+        rejected = [pending.update for _, pending in batch]
+        try:
+            rejected = self.dispatcher.submit_many(rejected, timeout=self.enqueue_timeout)
+        finally:
+            refused = {id(update) for update in rejected}
+            for _, pending in batch:
+                pending.accepted = id(pending.update) not in refused
+                pending.done.set()
+        UPDATE_STAGE_SECONDS.observe(time.monotonic() - started, "webhook", "enqueue")
+        if rejected:
+            # Вебхук ответит на них 503 — Telegram доставит их повторно
+            log.warning("Диспетчер не принял %s обновлений вебхука: %s",
+                        len(rejected), [update.update_id for update in rejected])
+        with self._cond:
+            self._stats["flushes"] += 1
+            self._stats["dispatcher_rejected"] += len(rejected)
+            self._stats["batch_max"] = max(self._stats["batch_max"], len(batch))
+
+    def shutdown(self, timeout=10.0):
+        """Перестаёт принимать обновления и передаёт диспетчеру то, что уже в буфере."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._buffer:
+            log.warning("Приём пачками: не передано диспетчеру %s обновлений при остановке.", len(self._buffer))
+
+    def stats(self) -> dict:
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot["buffered"] = len(self._buffer)
+        flushes = snapshot["flushes"]
+        snapshot.update({
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batch_avg": (snapshot["received"] - snapshot["buffered"]) / flushes if flushes else 0.0,
+        })
+        return snapshot
+
+
+class UpdatePoller:
+    """Long polling getUpdates в отдельном потоке; обновления уходят в диспетчер.
+
+    limit — до скольких обновлений за вызов (максимум Bot API — 100),
+    poll_timeout — сколько Telegram держит запрос, если обновлений нет.
+    """
+
+    def __init__(self, bot, dispatcher, limit=100, poll_timeout=25, allowed_updates=None, enqueue_timeout=1.0,
+                 backoff_max=30.0, name="update-poller"):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.limit = limit
+        self.poll_timeout = poll_timeout
+        self.allowed_updates = allowed_updates
+        self.enqueue_timeout = enqueue_timeout
+        self.backoff_max = backoff_max
+        self.name = name
+        self.pid = os.getpid()
+        self.offset = None  # update_id следующего ещё не подтверждённого обновления
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"polls": 0, "empty_polls": 0, "updates": 0, "errors": 0, "enqueue_retries": 0,
+                       "batch_max": 0, "last_update_id": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def _incr(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self._incr("errors")
+                delay = min(self.backoff_max, 2 ** failures) * (0.5 + random.random() / 2)
+                log.error("getUpdates: %s; повтор через %.1f с", e, delay, exc_info=failures == 1)
+                self._stop.wait(delay)
+
+    def poll_once(self) -> int:
+        """Один вызов getUpdates и передача пачки диспетчеру; возвращает число обновлений."""
+        started = time.monotonic()
+        updates = self.bot.get_updates(
+            offset=self.offset,
+            limit=self.limit,
+            # Таймаут HTTP-запроса должен быть больше времени, на которое Telegram задерживает ответ
+            timeout=self.poll_timeout + 10,
+            allowed_updates=self.allowed_updates,
+            long_polling_timeout=self.poll_timeout,
+        )
+        if not updates:
+            self._incr("polls")
+            self._incr("empty_polls")
+            return 0
+        UPDATE_STAGE_SECONDS.observe(time.monotonic() - started, "poll", "fetch")
+        UPDATE_BATCH_SIZE.observe(len(updates), "poll")
+
+        started = time.monotonic()
+        pending = updates
+        while pending:
+            # Принятые — всегда начало пачки: при остановке offset подтверждает ровно их
+            pending = self.dispatcher.submit_many(pending, timeout=self.enqueue_timeout, prefix=True)
+            if pending:
+                # Очередь заполнена: ждём, не подтверждая offset (иначе Telegram забудет эти обновления)
+                self._incr("enqueue_retries")
+                if self._stop.wait(0.05):
+                    self.offset = pending[0].update_id
+                    log.warning("getUpdates: при остановке не передано диспетчеру %s обновлений.", len(pending))
+                    return len(updates) - len(pending)
+        UPDATE_STAGE_SECONDS.observe(time.monotonic() - started, "poll", "enqueue")
+
+        last_id = updates[-1].update_id
+        self.offset = last_id + 1
+        with self._lock:
+            self._stats["polls"] += 1
+            self._stats["updates"] += len(updates)
+            self._stats["batch_max"] = max(self._stats["batch_max"], len(updates))
+            self._stats["last_update_id"] = last_id
+        return len(updates)
+
+    def shutdown(self, timeout=None):
+        """Останавливает опрос и подтверждает Telegram принятые обновления."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.poll_timeout + 15 if timeout is None else timeout)
+        if self.offset is not None:
+            # Offset подтверждается только следующим вызовом getUpdates
+            try:
+                self.bot.get_updates(offset=self.offset, limit=1, timeout=5, long_polling_timeout=0)
+            except Exception as e:
+                log.warning("getUpdates: не удалось подтвердить offset %s: %s", self.offset, e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot.update({"offset": self.offset or 0, "limit": self.limit, "poll_timeout": self.poll_timeout})
+        return snapshot
@@ -1,24 +1,67 @@
 import os
-import re
+import sys
+import atexit
+import functools
+import hmac
+import html
 import logging
-from datetime import datetime, timedelta, date, timezone
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, date
+from urllib.parse import urlencode
 import requests 
 import json 
-from dateutil import tz # Добавлен для корректной работы с часовыми поясами
 
-from flask import Flask, request, jsonify
-from telebot import TeleBot, types
-import psycopg2
-import pytz
+from flask import Flask, Response, request, jsonify, stream_with_context
+from telebot import ExceptionHandler, TeleBot, types
+from telebot import apihelper, util
+from telebot.apihelper import ApiTelegramException
 from psycopg2.extras import RealDictCursor
 from flask_cors import CORS
 
+from allocation import TableAllocator
+from availability import AvailabilityEngine
+from booking import (
+    AUTO_TABLE, BookingError, create_booking, create_bookings, parse_batch_request, parse_booking_request,
+    parse_duration_hours, user_link,
+)
+from cache import MISSING, TTLCache
+from clock import RESTAURANT_TZ, local_date_str, local_day, now_local, utc_now
+from db_pool import ConnectionPool
+from dispatch import QueueFull, UpdateDispatcher
+from export import (
+    CONTENT_TYPES, EXPORT_FORMATS, export_chunks, export_filename, iter_booking_batches, parse_export_args, write_export,
+)
+from ingest import UpdatePoller, WebhookBatcher
+from logging_setup import setup_logging
+from menu_photos import MEDIA_GROUP_LIMIT, MenuPhotoCache
+from metrics import (
+    PROMETHEUS_CONTENT_TYPE, REGISTRY, UPDATE_STAGE_SECONDS, instrument_bot_handlers, instrument_flask,
+    instrument_router, instrument_telegram_api, timed_cursor_factory,
+)
+from migrations import run_migrations
+from outbox import OutboxRelay, enqueue_message
+from partitions import STORAGE_MODES, PartitionManager
+from pg_listener import PgListener, notify_booking_change
+from sender import OutboundSender
+from routing import Router
+from reminders import ReminderScheduler
+from replicas import ReplicaRouter
+from queries import (
+    CONFLICT_MODES, BookingConflict, decode_keyset, encode_keyset,
+    fetch_active_bookings_page, fetch_bookings_by_table_day, fetch_table_day_bookings, fetch_tables_day,
+    prepare_statements,
+)
+
 # =========================
 # ЛОГИРОВАНИЕ
 # =========================
-# Настройка логирования (используем и print, и logging для надежности)
-logging.basicConfig(level=logging.INFO)
-print("Логирование настроено.") 
+# Структурированные логи через очередь (см. logging_setup): LOG_LEVEL — порог, LOG_FORMAT — json или text.
+# Настраиваются в create_app(), а не при импорте.
+LOG_LEVEL = (os.environ.get("LOG_LEVEL") or "INFO").strip().upper()
+LOG_FORMAT = (os.environ.get("LOG_FORMAT") or "json").strip().lower()
+log = logging.getLogger("lis")
 
 # =========================
 # ENV
@@ -28,35 +71,167 @@ DATABASE_URL = (os.environ.get("DATABASE_URL") or "").strip()
 ADMIN_ID_ENV = (os.environ.get("ADMIN_ID") or "").strip()
 WEBAPP_URL = (os.environ.get("WEBAPP_URL") or "https://gitrepo-drab.vercel.app").strip() 
 RENDER_EXTERNAL_URL = os.environ.get("RENDER_EXTERNAL_URL") 
-
-print(f"BOT_TOKEN_STATUS: {'SET' if BOT_TOKEN else 'NOT SET'}")
-print(f"DATABASE_URL_STATUS: {'SET' if DATABASE_URL else 'NOT SET'}")
-print(f"RENDER_EXTERNAL_URL_STATUS: {'SET' if RENDER_EXTERNAL_URL else 'NOT SET'}")
-
-if not BOT_TOKEN:
-    raise RuntimeError("Ошибка: BOT_TOKEN пуст или не задан!")
-if not DATABASE_URL:
-    raise RuntimeError("Ошибка: DATABASE_URL не задан!")
-if not RENDER_EXTERNAL_URL: 
-    raise RuntimeError("Ошибка: RENDER_EXTERNAL_URL не задан! Проверьте переменные окружения на Render.")
-
+# Адрес Bot API (по умолчанию api.telegram.org); для нагрузочных тестов — bench/fake_telegram.py
+TELEGRAM_API_URL = (os.environ.get("TELEGRAM_API_URL") or "").strip().rstrip("/")
 
 if "render.com/" in DATABASE_URL and ":5432" not in DATABASE_URL:
     DATABASE_URL = DATABASE_URL.replace(".render.com/", ".render.com:5432/")
 
-ADMIN_ID = None
-if ADMIN_ID_ENV:
-    try:
-        ADMIN_ID = int(ADMIN_ID_ENV)
-        print(f"ADMIN_ID установлен: {ADMIN_ID}")
-    except ValueError:
-        print(f"Предупреждение: ADMIN_ID ('{ADMIN_ID_ENV}') не является числом; админ-функции отключены.")
+ADMIN_ID = int(ADMIN_ID_ENV) if ADMIN_ID_ENV.lstrip("-").isdigit() else None
+
+# Настройки пула соединений (на один воркер gunicorn)
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "5"))
+DB_POOL_HEALTH_CHECK_SEC = float(os.environ.get("DB_POOL_HEALTH_CHECK_SEC", "30"))
+DB_POOL_MAX_IDLE_SEC = float(os.environ.get("DB_POOL_MAX_IDLE_SEC", "300"))
+DB_POOL_MAX_LIFETIME_SEC = float(os.environ.get("DB_POOL_MAX_LIFETIME_SEC", "3600"))
+# Период фоновой чистки простаивающих соединений и добора до DB_POOL_MIN (0 — выключена)
+DB_POOL_REAP_SEC = float(os.environ.get("DB_POOL_REAP_SEC", "60"))
+
+# Реплики для чтения (через запятую, пусто — всё читается из DATABASE_URL): наибольшее допустимое
+# отставание, сколько секунд после записи читать её ключи из основной БД, период проверки отставания
+DATABASE_REPLICA_URLS = [u.strip() for u in (os.environ.get("DATABASE_REPLICA_URLS") or "").split(",") if u.strip()]
+REPLICA_MAX_LAG_SEC = float(os.environ.get("REPLICA_MAX_LAG_SEC", "5"))
+READ_YOUR_WRITES_SEC = float(os.environ.get("READ_YOUR_WRITES_SEC", "10"))
+REPLICA_CHECK_SEC = float(os.environ.get("REPLICA_CHECK_SEC", "1"))
+REPLICA_POOL_MAX = int(os.environ.get("REPLICA_POOL_MAX", str(DB_POOL_MAX)))
+
+# Обработка вебхука: "sync" — внутри запроса (как раньше), "async" — через фоновый пул потоков,
+# "batch" — через пул потоков пачками: вебхук копит обновления WEBHOOK_BATCH_WINDOW_MS
+WEBHOOK_DISPATCH_MODE = (os.environ.get("WEBHOOK_DISPATCH_MODE") or "sync").strip().lower()
+DISPATCH_MODES = ("sync", "async", "batch")
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.environ.get("WEBHOOK_ENQUEUE_TIMEOUT", "0"))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.environ.get("WEBHOOK_SHUTDOWN_TIMEOUT", "10"))
+WEBHOOK_BATCH_WINDOW_MS = float(os.environ.get("WEBHOOK_BATCH_WINDOW_MS", "5"))
+WEBHOOK_BATCH_BUFFER = int(os.environ.get("WEBHOOK_BATCH_BUFFER", "1000"))
+# Сколько обновлений поток диспетчера передаёт обработчику за раз (1 — по одному)
+UPDATE_BATCH_SIZE = int(os.environ.get("UPDATE_BATCH_SIZE", "50"))
+
+# Long polling (python lis.py poll): обновлений за вызов getUpdates и время ожидания на стороне Telegram
+POLL_LIMIT = int(os.environ.get("POLL_LIMIT", "100"))
+POLL_TIMEOUT = int(os.environ.get("POLL_TIMEOUT", "25"))
+PORT = int(os.environ.get("PORT", "5000"))
+
+# Исходящие сообщения: лимиты Telegram (30/с на бота, ~1/с на чат), повторы, дайджест уведомлений админу
+OUTBOUND_GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.environ.get("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.environ.get("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_WORKERS = int(os.environ.get("OUTBOUND_WORKERS", "4"))
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", "5"))
+OUTBOUND_QUEUE_SIZE = int(os.environ.get("OUTBOUND_QUEUE_SIZE", "10000"))
+OUTBOUND_SHUTDOWN_TIMEOUT = float(os.environ.get("OUTBOUND_SHUTDOWN_TIMEOUT", "10"))
+ADMIN_DIGEST_SEC = float(os.environ.get("ADMIN_DIGEST_SEC", "2"))
+
+# Outbox уведомлений о бронях: размер пачки, опрос, аренда строки, число попыток, хранение отправленных
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_SEC = float(os.environ.get("OUTBOX_POLL_SEC", "1"))
+OUTBOX_LEASE_SEC = float(os.environ.get("OUTBOX_LEASE_SEC", "60"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", "7"))
+
+# Сколько броней показывать на одной странице админ-панели
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", "10"))
+
+# Выгрузка истории броней: токен для /export/bookings (пусто — маршрут выключен), размер пачки
+# серверного курсора, сколько держать в памяти до сброса во временный файл, предел документа Telegram
+EXPORT_TOKEN = (os.environ.get("EXPORT_TOKEN") or "").strip()
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_SPOOL_MAX_BYTES = int(os.environ.get("EXPORT_SPOOL_MAX_BYTES", str(1024 * 1024)))
+EXPORT_DOCUMENT_MAX_BYTES = 50 * 1024 * 1024
+
+# Сколько броней можно оформить одним запросом /book_batch
+BOOK_BATCH_MAX = int(os.environ.get("BOOK_BATCH_MAX", "50"))
+
+# Автоподбор стола (table="auto"): сколько раз пробовать следующий стол при гонке за стол,
+# сколько вариантов и с каким наибольшим сдвигом времени (минуты) предлагать в /suggest_tables
+ALLOCATION_RETRIES = int(os.environ.get("ALLOCATION_RETRIES", "3"))
+SUGGEST_LIMIT = int(os.environ.get("SUGGEST_LIMIT", "5"))
+SUGGEST_MAX_SHIFT_MIN = int(os.environ.get("SUGGEST_MAX_SHIFT_MIN", "180"))
+
+# Максимальный диапазон дат для /get_free_times_bulk
+BULK_MAX_DAYS = int(os.environ.get("BULK_MAX_DAYS", "14"))
+
+# Как часто проверять (HEAD-запросом), не изменились ли фото меню по URL
+MENU_PHOTO_REVALIDATE_SEC = float(os.environ.get("MENU_PHOTO_REVALIDATE_SEC", str(6 * 3600)))
+
+# Кэш занятости (стол, дата): время жизни, размер (0 — выключен), LISTEN/NOTIFY между воркерами
+AVAILABILITY_CACHE_TTL = float(os.environ.get("AVAILABILITY_CACHE_TTL", "30"))
+AVAILABILITY_CACHE_SIZE = int(os.environ.get("AVAILABILITY_CACHE_SIZE", "5000"))
+BOOKINGS_NOTIFY = (os.environ.get("BOOKINGS_NOTIFY") or "0").strip().lower() in ("1", "true", "yes")
+
+# Кэш ближайшей брони пользователя для "📋 Моя бронь" и клавиатур (на воркер)
+USER_BOOKING_CACHE_TTL = float(os.environ.get("USER_BOOKING_CACHE_TTL", "60"))
+USER_BOOKING_CACHE_SIZE = int(os.environ.get("USER_BOOKING_CACHE_SIZE", "10000"))
+KEYBOARD_CACHE_SIZE = int(os.environ.get("KEYBOARD_CACHE_SIZE", "4096"))
+
+# Проверка пересечений броней: "lock" (FOR UPDATE + проверка в Python) или "exclusion" (GiST constraint)
+BOOKING_CONFLICT_MODE = (os.environ.get("BOOKING_CONFLICT_MODE") or "lock").strip().lower()
+
+# Хранение броней: "plain" — одна таблица, "partitioned" — помесячные партиции с архивом старых (см. partitions.py)
+BOOKINGS_STORAGE = (os.environ.get("BOOKINGS_STORAGE") or "plain").strip().lower()
+PARTITION_PREMAKE_MONTHS = int(os.environ.get("PARTITION_PREMAKE_MONTHS", "3"))
+PARTITION_RETAIN_MONTHS = int(os.environ.get("PARTITION_RETAIN_MONTHS", "12"))
+PARTITION_MAINTENANCE_SEC = float(os.environ.get("PARTITION_MAINTENANCE_SEC", "3600"))
+
+# Напоминания гостям: за сколько минут до брони (0 — выключены), на сколько секунд вперёд загружать
+# напоминания, как часто перечитывать окно, насколько можно опоздать (простой, смена воркера-владельца)
+REMINDER_LEAD_MIN = float(os.environ.get("REMINDER_LEAD_MIN", "120"))
+REMINDER_WINDOW_SEC = float(os.environ.get("REMINDER_WINDOW_SEC", "3600"))
+REMINDER_RELOAD_SEC = float(os.environ.get("REMINDER_RELOAD_SEC", "60"))
+REMINDER_GRACE_SEC = float(os.environ.get("REMINDER_GRACE_SEC", "900"))
+REMINDER_MAX_LOADED = int(os.environ.get("REMINDER_MAX_LOADED", "10000"))
+
+# Применять миграции схемы при старте (0 — если их запускает отдельный шаг деплоя: python lis.py migrate)
+MIGRATE_ON_START = (os.environ.get("MIGRATE_ON_START") or "1").strip().lower() in ("1", "true", "yes")
+
+def check_env():
+    """Проверка обязательных переменных окружения (вызывается из create_app, а не при импорте)."""
+    log.info("Переменные окружения", extra={
+        "bot_token": "SET" if BOT_TOKEN else "NOT SET",
+        "database_url": "SET" if DATABASE_URL else "NOT SET",
+        "database_replicas": len(DATABASE_REPLICA_URLS),
+        "render_external_url": "SET" if RENDER_EXTERNAL_URL else "NOT SET",
+    })
+    if DATABASE_REPLICA_URLS and READ_YOUR_WRITES_SEC <= REPLICA_MAX_LAG_SEC + REPLICA_CHECK_SEC:
+        log.warning("READ_YOUR_WRITES_SEC не больше REPLICA_MAX_LAG_SEC + REPLICA_CHECK_SEC: "
+                    "сразу после окна записи реплика может её ещё не показать")
+    if not BOT_TOKEN:
+        raise RuntimeError("Ошибка: BOT_TOKEN пуст или не задан!")
+    if not util.is_string(BOT_TOKEN) or ":" not in BOT_TOKEN:
+        raise RuntimeError("Ошибка: BOT_TOKEN имеет неверный формат (ожидается '<id>:<secret>').")
+    if not DATABASE_URL:
+        raise RuntimeError("Ошибка: DATABASE_URL не задан!")
+    if not RENDER_EXTERNAL_URL:
+        raise RuntimeError("Ошибка: RENDER_EXTERNAL_URL не задан! Проверьте переменные окружения на Render.")
+    if BOOKING_CONFLICT_MODE not in CONFLICT_MODES:
+        raise RuntimeError(f"Ошибка: BOOKING_CONFLICT_MODE должен быть одним из {CONFLICT_MODES}, получено '{BOOKING_CONFLICT_MODE}'.")
+    if WEBHOOK_DISPATCH_MODE not in DISPATCH_MODES:
+        raise RuntimeError(f"Ошибка: WEBHOOK_DISPATCH_MODE должен быть одним из {DISPATCH_MODES}, получено '{WEBHOOK_DISPATCH_MODE}'.")
+    if BOOKINGS_STORAGE not in STORAGE_MODES:
+        raise RuntimeError(f"Ошибка: BOOKINGS_STORAGE должен быть одним из {STORAGE_MODES}, получено '{BOOKINGS_STORAGE}'.")
+    if BOOKINGS_STORAGE == "partitioned" and BOOKING_CONFLICT_MODE == "exclusion":
+        # Exclusion constraint на партиционированной таблице обязан сравнивать ключ партиции через "="
+        raise RuntimeError("Ошибка: BOOKINGS_STORAGE=partitioned работает только с BOOKING_CONFLICT_MODE=lock.")
+    if ADMIN_ID is not None:
+        log.info("ADMIN_ID установлен: %s", ADMIN_ID)
+    elif ADMIN_ID_ENV:
+        log.warning("ADMIN_ID ('%s') не является числом; админ-функции отключены.", ADMIN_ID_ENV)
 
 # =========================
 # КОНСТАНТЫ МЕНЮ (ТОЛЬКО ТЕКСТ)
 # =========================
 RESTAURANT_NAME = "Мама Хуана"
 
+# Тексты кнопок основной клавиатуры (по ним же ищется обработчик, см. router)
+BTN_BOOK = "🗓️ Забронировать"
+BTN_MY_BOOKING = "📋 Моя бронь"
+BTN_MENU = "📖 Меню"
+BTN_ADMIN = "🛠 Управление"
+BTN_HISTORY = "🗂 История"
+
 MENU_CATEGORIES = [
     "🥣 Закуски (Холодные)",
     "🌶️ Закуски (Горячие/Супы)",
@@ -70,6 +245,10 @@ MENU_CATEGORIES = [
     "☕ Десерты & Напитки",
 ]
 
+# Рабочее окно для бронирования: 12:00–23:00, шаг 30 минут, не раньше чем через 30 минут от "сейчас"
+availability = AvailabilityEngine(RESTAURANT_TZ)
+allocator = TableAllocator(availability)
+
 # =========================
 # МЕНЮ: ссылки на фото
 # =========================
@@ -89,138 +268,488 @@ MENU_PHOTOS = {
 # =========================
 # DB INIT
 # =========================
-def db_connect():
-    """Устанавливает соединение с базой данных."""
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+# Курсор с замером времени каждого запроса (гистограмма db_query_duration_seconds)
+TimedRealDictCursor = timed_cursor_factory(RealDictCursor)
+
+def get_db_pool() -> ConnectionPool:
+    """Возвращает пул соединений текущего процесса (создаётся лениво, после fork)."""
+    global _db_pool
+    if _db_pool is None or _db_pool.pid != os.getpid():
+        with _db_pool_lock:
+            if _db_pool is None or _db_pool.pid != os.getpid():
+                # Соединения родителя после fork не трогаем — просто создаём новый пул.
+                _db_pool = ConnectionPool(
+                    DATABASE_URL,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    health_check_after=DB_POOL_HEALTH_CHECK_SEC,
+                    max_idle=DB_POOL_MAX_IDLE_SEC,
+                    max_lifetime=DB_POOL_MAX_LIFETIME_SEC,
+                    reap_interval=DB_POOL_REAP_SEC,
+                    configure=prepare_statements,
+                    cursor_factory=TimedRealDictCursor,
+                )
+    return _db_pool
+
+def db_connection():
+    """Соединение из пула: commit при успехе, rollback при ошибке, возврат в пул."""
+    return get_db_pool().connection()
+
+_replica_router = None
+_replica_router_lock = threading.Lock()
+
+def _read_only(conn):
+    conn.set_session(readonly=True)
+
+def get_replica_router():
+    """Маршрутизатор чтений на реплики текущего процесса или None, если DATABASE_REPLICA_URLS пуст."""
+    global _replica_router
+    if not DATABASE_REPLICA_URLS:
+        return None
+    if _replica_router is None or _replica_router.pid != os.getpid():
+        with _replica_router_lock:
+            if _replica_router is None or _replica_router.pid != os.getpid():
+                # Соединения создаются по требованию: недоступная при старте реплика не мешает воркеру
+                pools = {
+                    f"replica{i}": ConnectionPool(
+                        url,
+                        minconn=0,
+                        maxconn=REPLICA_POOL_MAX,
+                        timeout=DB_POOL_TIMEOUT,
+                        health_check_after=DB_POOL_HEALTH_CHECK_SEC,
+                        max_idle=DB_POOL_MAX_IDLE_SEC,
+                        max_lifetime=DB_POOL_MAX_LIFETIME_SEC,
+                        reap_interval=DB_POOL_REAP_SEC,
+                        configure=_read_only,
+                        cursor_factory=TimedRealDictCursor,
+                        connect_timeout=5,
+                    )
+                    for i, url in enumerate(DATABASE_REPLICA_URLS, 1)
+                }
+                _replica_router = ReplicaRouter(
+                    pools,
+                    db_connection,
+                    max_lag=REPLICA_MAX_LAG_SEC,
+                    sticky=READ_YOUR_WRITES_SEC,
+                    check_interval=REPLICA_CHECK_SEC,
+                ).start()
+    return _replica_router
+
+@atexit.register
+def _stop_replica_router():
+    if _replica_router is not None and _replica_router.pid == os.getpid():
+        _replica_router.shutdown()
+
+def read_connection(*keys):
+    """Соединение только для чтения: реплика, если она не отстаёт и ключи keys не записывались
+    последние READ_YOUR_WRITES_SEC (см. replicas.py); иначе — основная БД."""
+    router = get_replica_router()
+    return router.connection(*keys) if router is not None else db_connection()
+
+def note_write(*keys):
+    """Вызывать после COMMIT: чтения с этими ключами ещё READ_YOUR_WRITES_SEC идут в основную БД."""
+    router = get_replica_router()
+    if router is not None:
+        router.note_write(*keys)
+
+def user_read_key(user_id):
+    return ("user", int(user_id))
+
+def table_day_read_key(table_id, day):
+    return ("table_day", int(table_id), day)
 
-def init_db():
-    """Инициализация таблиц и столов."""
-    print("Инициализация базы данных...")
+# =========================
+# КЭШ ЗАНЯТОСТИ СТОЛОВ
+# =========================
+availability_cache = TTLCache(maxsize=AVAILABILITY_CACHE_SIZE, ttl=AVAILABILITY_CACHE_TTL)
+# user_id -> ближайшая активная бронь (строка bookings) или None.
+# Запись живёт не дольше USER_BOOKING_CACHE_TTL и не переживает начало самой брони.
+user_booking_cache = TTLCache(maxsize=USER_BOOKING_CACHE_SIZE, ttl=USER_BOOKING_CACHE_TTL)
+_pg_listener = None
+_pg_listener_lock = threading.Lock()
+
+def _on_booking_notify(payload):
+    """Инвалидация кэшей и очереди напоминаний по уведомлению об изменении брони (в т.ч. из других воркеров)."""
+    if payload.get("user_id") is not None:
+        user_booking_cache.invalidate(int(payload["user_id"]))
+        note_write(user_read_key(payload["user_id"]))
+    if payload.get("booking_id") is not None and payload.get("booking_for"):
+        if payload.get("op") == "insert":
+            schedule_reminder(payload["booking_id"], datetime.fromisoformat(payload["booking_for"]))
+        elif payload.get("op") == "delete":
+            unschedule_reminder(payload["booking_id"])
+    if payload.get("table_id") is None or not payload.get("booking_for"):
+        availability_cache.clear()
+        return
+    invalidate_availability(payload["table_id"], datetime.fromisoformat(payload["booking_for"]))
+
+def _on_listener_reconnect():
+    # Уведомления, пришедшие во время разрыва, потеряны — сбрасываем всё
+    availability_cache.clear()
+    user_booking_cache.clear()
+    if _reminders is not None and _reminders.pid == os.getpid():
+        _reminders.invalidate()
+
+def _ensure_pg_listener():
+    """При BOOKINGS_NOTIFY=1 запускает в процессе слушатель LISTEN (один на воркер)."""
+    global _pg_listener
+    if BOOKINGS_NOTIFY and (_pg_listener is None or _pg_listener.pid != os.getpid()):
+        with _pg_listener_lock:
+            if _pg_listener is None or _pg_listener.pid != os.getpid():
+                _pg_listener = PgListener(DATABASE_URL)
+                _pg_listener.subscribe(_on_booking_notify, on_reconnect=_on_listener_reconnect)
+                _pg_listener.start()
+
+def get_availability_cache() -> TTLCache:
+    """Кэш занятости; при BOOKINGS_NOTIFY=1 в процессе запускается слушатель LISTEN."""
+    _ensure_pg_listener()
+    return availability_cache
+
+def get_user_booking_cache() -> TTLCache:
+    """Кэш ближайшей брони пользователя. Без BOOKINGS_NOTIFY брони, сделанные через другой
+    воркер, становятся видны здесь не позже чем через USER_BOOKING_CACHE_TTL."""
+    _ensure_pg_listener()
+    return user_booking_cache
+
+def invalidate_user_booking(user_id):
+    """Сбрасывает кэш брони пользователя и читает её из основной БД, пока реплики не догонят (вызывать после COMMIT)."""
+    if user_id:
+        user_booking_cache.invalidate(int(user_id))
+        note_write(user_read_key(user_id))
+
+def invalidate_availability(table_id, booking_for):
+    """Сбрасывает кэш занятости стола на день брони (вызывать после COMMIT); см. invalidate_user_booking."""
+    day = local_day(booking_for)
+    availability_cache.invalidate((int(table_id), day), ("day_index", day))
+    note_write(table_day_read_key(table_id, day))
+
+def booking_changed(cur, op, table_id, booking_for, booking_id=None, user_id=None):
+    """Вызывается внутри транзакции записи: оповещает другие воркеры через pg_notify."""
+    if BOOKINGS_NOTIFY:
+        notify_booking_change(cur, op, table_id, booking_for, booking_id, user_id)
+
+def init_db(strict=False):
+    """Применяет недостающие миграции схемы (см. migrations.py); если схема актуальна — один SELECT.
+
+    strict=True — ошибка пробрасывается (шаг деплоя должен завершиться с ненулевым кодом).
+    """
+    features = tuple(feature for feature, enabled in (
+        ("exclusion", BOOKING_CONFLICT_MODE == "exclusion"),
+        ("partitioned", BOOKINGS_STORAGE == "partitioned"),
+    ) if enabled)
     try:
-        with db_connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                CREATE TABLE IF NOT EXISTS tables (
-                    id INT PRIMARY KEY
-                );
-                """)
-                cur.execute("""
-                CREATE TABLE IF NOT EXISTS bookings (
-                    booking_id SERIAL PRIMARY KEY,
-                    user_id BIGINT,
-                    user_name VARCHAR(255),
-                    phone TEXT,
-                    guests INT,
-                    table_id INT NOT NULL,
-                    time_slot TEXT NOT NULL,
-                    booked_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                    booking_for TIMESTAMP WITH TIME ZONE -- Изменено на TIMESTAMP WITH TIME ZONE
-                );
-                """)
-                cur.execute("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS duration_hours INT DEFAULT 1;")
-
-                # Обновление структуры таблицы, если она была создана без столбцов
-                cur.execute("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS user_id BIGINT;")
-                cur.execute("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS user_name TEXT;")
-                cur.execute("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS phone TEXT;")
-                cur.execute("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS guests INT;")
-                # Это может вызвать ошибку, если столбец уже существует как TIMESTAMP без TZ.
-                # Для продакшена лучше использовать ALTER COLUMN, но для учебного проекта оставим так.
-                # cur.execute("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS booking_for TIMESTAMP WITH TIME ZONE;") 
-                
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_conflict ON bookings (table_id, booking_for);")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user_active ON bookings (user_id, booking_for DESC);")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_future_time ON bookings (booking_for);")
-                cur.execute("CREATE INDEX IF NOT EXISTS idx_bookings_booked_at ON bookings (booked_at DESC);")
-
-                TARGET_TABLE_COUNT = 20
-                cur.execute("SELECT id FROM tables ORDER BY id ASC;")
-                existing_table_ids = [row['id'] for row in cur.fetchall()]
-                tables_to_add = [i for i in range(1, TARGET_TABLE_COUNT + 1) if i not in existing_table_ids]
-                
-                if tables_to_add:
-                    insert_values = ",".join(f"({i})" for i in tables_to_add)
-                    cur.execute(f"INSERT INTO tables (id) VALUES {insert_values};")
-                    print(f"База данных: Добавлено {len(tables_to_add)} новых столов (ID: {tables_to_add}).")
-                else:
-                    print("База данных: Все столы до 20 уже существуют.")
-
-            conn.commit()
-        print("База данных: Инициализация завершена успешно.")
+        applied = run_migrations(DATABASE_URL, features)
+        if applied:
+            log.info("База данных: применены миграции %s.", applied)
     except Exception as e:
-        print(f"Ошибка инициализации базы: {e}")
+        log.exception("Ошибка инициализации базы: %s", e)
+        if strict:
+            raise
 
 # =========================
 # BOT & APP
 # =========================
 # КРИТИЧЕСКОЕ ИЗМЕНЕНИЕ: threaded=False, чтобы избежать конфликтов с Flask/Gunicorn и Webhook.
-bot = TeleBot(BOT_TOKEN, parse_mode="HTML", threaded=False)
+# validate_token=False: токен проверяется в create_app(), импорт модуля не падает без окружения.
+# Ошибка обработчика логируется и не прерывает остальные обновления пачки (см. UPDATE_BATCH_SIZE).
+class _LogHandlerErrors(ExceptionHandler):
+    def handle(self, exception):
+        log.error("Ошибка обработчика бота: %s", exception, exc_info=exception)
+        return True
+
+bot = TeleBot(BOT_TOKEN, parse_mode="HTML", threaded=False, validate_token=False, exception_handler=_LogHandlerErrors())
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": ["https://gitrepo-drab.vercel.app"]}}, supports_credentials=True)
+menu_photo_cache = MenuPhotoCache(bot, db_connection, revalidate_after=MENU_PHOTO_REVALIDATE_SEC)
+instrument_flask(app)
+
+_sender = None
+_sender_lock = threading.Lock()
+
+def get_sender() -> OutboundSender:
+    """Очередь исходящих сообщений текущего процесса (потоки стартуют лениво, после fork)."""
+    global _sender
+    if _sender is None or _sender.pid != os.getpid():
+        with _sender_lock:
+            if _sender is None or _sender.pid != os.getpid():
+                _sender = OutboundSender(
+                    bot,
+                    global_rate=OUTBOUND_GLOBAL_RATE,
+                    chat_rate=OUTBOUND_CHAT_RATE,
+                    chat_burst=OUTBOUND_CHAT_BURST,
+                    workers=OUTBOUND_WORKERS,
+                    max_retries=OUTBOUND_MAX_RETRIES,
+                    digest_window=ADMIN_DIGEST_SEC,
+                    queue_size=OUTBOUND_QUEUE_SIZE,
+                ).start()
+    return _sender
+
+@atexit.register
+def _drain_sender():
+    """При остановке воркера отправляем то, что уже поставлено в очередь.
+
+    atexit вызывает функции в обратном порядке регистрации: очередь отправки
+    зарегистрирована раньше диспетчера, поэтому останавливается после него и
+    успевает принять сообщения от дорабатывающих обработчиков.
+    """
+    if _sender is not None and _sender.pid == os.getpid():
+        _sender.shutdown(OUTBOUND_SHUTDOWN_TIMEOUT)
+
+def send_message(chat_id, text, **kwargs):
+    """Ставит сообщение в очередь отправки (не ждёт ответа Telegram)."""
+    return get_sender().send_message(chat_id, text, **kwargs)
+
+def edit_message_text(text, chat_id, message_id, **kwargs):
+    return get_sender().edit_message_text(text, chat_id, message_id, **kwargs)
+
+_outbox_relay = None
+_outbox_relay_lock = threading.Lock()
+# Доставка строк outbox; asgi.py подменяет её на асинхронный клиент Bot API (см. set_outbox_deliver)
+_outbox_deliver = None
+
+def deliver_outbox(row):
+    """Передаёт строку outbox в очередь отправки; Future завершится после ответа Telegram."""
+    if row['kind'] == "admin":
+        return get_sender().notify(row['chat_id'], row['text'], parse_mode=row['parse_mode'])
+    return get_sender().send_message(row['chat_id'], row['text'], parse_mode=row['parse_mode'])
+
+def set_outbox_deliver(deliver):
+    """Задаёт функцию доставки outbox (row -> Future) до первого запуска ретранслятора в процессе."""
+    global _outbox_deliver
+    _outbox_deliver = deliver
+
+def get_outbox_relay() -> OutboxRelay:
+    """Ретранслятор outbox текущего процесса (поток стартует лениво, после fork)."""
+    global _outbox_relay
+    if _outbox_relay is None or _outbox_relay.pid != os.getpid():
+        with _outbox_relay_lock:
+            if _outbox_relay is None or _outbox_relay.pid != os.getpid():
+                _outbox_relay = OutboxRelay(
+                    db_connection,
+                    _outbox_deliver or deliver_outbox,
+                    batch_size=OUTBOX_BATCH_SIZE,
+                    poll_interval=OUTBOX_POLL_SEC,
+                    lease=OUTBOX_LEASE_SEC,
+                    max_attempts=OUTBOX_MAX_ATTEMPTS,
+                    retention_days=OUTBOX_RETENTION_DAYS,
+                ).start()
+    return _outbox_relay
+
+@atexit.register
+def _drain_outbox():
+    """Отмечаем отправленное до остановки очереди отправки (зарегистрирован после неё — выполняется раньше)."""
+    if _outbox_relay is not None and _outbox_relay.pid == os.getpid():
+        _outbox_relay.shutdown(OUTBOX_LEASE_SEC / 2)
+
+def outbox_committed():
+    """Вызывается после COMMIT транзакции, записавшей outbox: будит ретранслятор."""
+    get_outbox_relay().wake()
+
+@app.before_request
+def _start_outbox_relay():
+    """Ретранслятор запускается с первым запросом воркера: строки, оставшиеся после падения, уйдут без новых броней."""
+    get_outbox_relay()
+
+_partition_manager = None
+_partition_manager_lock = threading.Lock()
+
+def get_partition_manager() -> PartitionManager:
+    """Обслуживание партиций bookings в текущем процессе (поток стартует лениво, после fork)."""
+    global _partition_manager
+    if _partition_manager is None or _partition_manager.pid != os.getpid():
+        with _partition_manager_lock:
+            if _partition_manager is None or _partition_manager.pid != os.getpid():
+                _partition_manager = PartitionManager(
+                    db_connection,
+                    premake_months=PARTITION_PREMAKE_MONTHS,
+                    retain_months=PARTITION_RETAIN_MONTHS,
+                    interval=PARTITION_MAINTENANCE_SEC,
+                ).start()
+    return _partition_manager
+
+@atexit.register
+def _stop_partition_manager():
+    if _partition_manager is not None and _partition_manager.pid == os.getpid():
+        _partition_manager.shutdown()
+
+@app.before_request
+def _start_partition_manager():
+    """Партиции на ближайшие месяцы создаются с первым запросом воркера и дальше раз в PARTITION_MAINTENANCE_SEC."""
+    if BOOKINGS_STORAGE == "partitioned":
+        get_partition_manager()
+
+_reminders = None
+_reminders_lock = threading.Lock()
+
+def get_reminder_scheduler() -> ReminderScheduler:
+    """Планировщик напоминаний текущего процесса; работает только в воркере, взявшем advisory lock."""
+    global _reminders
+    if _reminders is None or _reminders.pid != os.getpid():
+        with _reminders_lock:
+            if _reminders is None or _reminders.pid != os.getpid():
+                _reminders = ReminderScheduler(
+                    DATABASE_URL,
+                    db_connection,
+                    lead=REMINDER_LEAD_MIN * 60,
+                    window=REMINDER_WINDOW_SEC,
+                    reload_interval=REMINDER_RELOAD_SEC,
+                    grace=REMINDER_GRACE_SEC,
+                    max_loaded=REMINDER_MAX_LOADED,
+                    on_enqueued=outbox_committed,
+                ).start()
+        # Брони и отмены других воркеров попадают в очередь напоминаний через LISTEN
+        _ensure_pg_listener()
+    return _reminders
+
+@atexit.register
+def _stop_reminders():
+    """Отпускает advisory lock до остановки ретранслятора outbox (зарегистрирован после него — выполняется раньше)."""
+    if _reminders is not None and _reminders.pid == os.getpid():
+        _reminders.shutdown()
+
+@app.before_request
+def _start_reminders():
+    if REMINDER_LEAD_MIN > 0:
+        get_reminder_scheduler()
+
+def schedule_reminder(booking_id, booking_for):
+    """Новая бронь (вызывать после COMMIT): если её напоминание в загруженном окне — ставим в очередь."""
+    if _reminders is not None and _reminders.pid == os.getpid():
+        _reminders.add(int(booking_id), booking_for, booked_at=utc_now())
+
+def unschedule_reminder(booking_id):
+    """Отменённая бронь (вызывать после COMMIT)."""
+    if _reminders is not None and _reminders.pid == os.getpid():
+        _reminders.remove(int(booking_id))
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher() -> UpdateDispatcher:
+    """Фоновый диспетчер обновлений текущего процесса (потоки стартуют лениво, после fork)."""
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.pid != os.getpid():
+        with _dispatcher_lock:
+            if _dispatcher is None or _dispatcher.pid != os.getpid():
+                _dispatcher = UpdateDispatcher(
+                    bot.process_new_updates,
+                    workers=WEBHOOK_WORKERS,
+                    queue_size=WEBHOOK_QUEUE_SIZE,
+                    enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT,
+                    batch_size=UPDATE_BATCH_SIZE,
+                ).start()
+    return _dispatcher
+
+@atexit.register
+def _drain_dispatcher():
+    """При остановке воркера дорабатываем уже принятые обновления."""
+    if _dispatcher is not None and _dispatcher.pid == os.getpid():
+        _dispatcher.shutdown(WEBHOOK_SHUTDOWN_TIMEOUT)
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def get_update_batcher() -> WebhookBatcher:
+    """Буфер пачек вебхука текущего процесса (WEBHOOK_DISPATCH_MODE=batch)."""
+    global _batcher
+    if _batcher is None or _batcher.pid != os.getpid():
+        with _batcher_lock:
+            if _batcher is None or _batcher.pid != os.getpid():
+                _batcher = WebhookBatcher(
+                    get_dispatcher(),
+                    window=WEBHOOK_BATCH_WINDOW_MS / 1000,
+                    max_batch=UPDATE_BATCH_SIZE,
+                    buffer_size=WEBHOOK_BATCH_BUFFER,
+                    enqueue_timeout=max(WEBHOOK_ENQUEUE_TIMEOUT, 1.0),
+                ).start()
+    return _batcher
+
+@atexit.register
+def _drain_batcher():
+    """Буфер отдаёт накопленное диспетчеру до его остановки (зарегистрирован позже — выполняется раньше)."""
+    if _batcher is not None and _batcher.pid == os.getpid():
+        _batcher.shutdown(WEBHOOK_SHUTDOWN_TIMEOUT)
+
+def submit_update(update):
+    """Передаёт обновление вебхука в фоновую обработку по WEBHOOK_DISPATCH_MODE; QueueFull — нет места."""
+    if WEBHOOK_DISPATCH_MODE == "batch":
+        get_update_batcher().submit(update)
+    else:
+        get_dispatcher().submit(update)
+
 
-if __name__ == "__main__":
-    with app.app_context():
-        init_db()
-    app.run(host="0.0.0.0", port=5000)
 
 
 # =========================
 # HELPERS (UI)
 # =========================
 def main_reply_kb(user_id: int, user_name: str) -> types.ReplyKeyboardMarkup:
-    """Генерирует основную клавиатуру бота."""
+    """Основная клавиатура бота (готовый объект из кэша; не изменять)."""
+    is_admin = bool(ADMIN_ID) and str(user_id) == str(ADMIN_ID)
+    return _build_main_reply_kb(user_id, user_name, is_admin)
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _build_main_reply_kb(user_id, user_name, is_admin):
     kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    
+
     # URL для WebApp должен содержать данные пользователя и ссылку на бота/бэкэнд
-    web_app_url = f"{WEBAPP_URL}?user_id={user_id}&user_name={user_name}&bot_url={RENDER_EXTERNAL_URL}"
-    
+    query = urlencode({"user_id": user_id, "user_name": user_name, "bot_url": RENDER_EXTERNAL_URL or ""})
+    web_app_url = f"{WEBAPP_URL}?{query}"
+
     row1 = [
-        types.KeyboardButton(text="🗓️ Забронировать", web_app=types.WebAppInfo(url=web_app_url)),
-        types.KeyboardButton("📋 Моя бронь"),
+        types.KeyboardButton(text=BTN_BOOK, web_app=types.WebAppInfo(url=web_app_url)),
+        types.KeyboardButton(BTN_MY_BOOKING),
     ]
-    row2 = [types.KeyboardButton("📖 Меню")]
+    row2 = [types.KeyboardButton(BTN_MENU)]
     kb.row(*row1)
     kb.row(*row2)
-    if ADMIN_ID and str(user_id) == str(ADMIN_ID):
-        kb.row(types.KeyboardButton("🛠 Управление"), types.KeyboardButton("🗂 История"))
+    if is_admin:
+        kb.row(types.KeyboardButton(BTN_ADMIN), types.KeyboardButton(BTN_HISTORY))
     return kb
 
 # =========================
 # COMMANDS & BUTTONS
 # =========================
+# Кнопки и callback-запросы маршрутизируются через router (поиск в словаре), команды — через telebot.
+# Без эмодзи текст кнопки тоже принимается: его могут набрать вручную.
+router = Router()
 
 @bot.message_handler(commands=["start"])
 def cmd_start(message: types.Message):
     """Обработка команды /start (рабочая версия)."""
-    print(f"[{datetime.now()}] (Обработчик) Получена команда /start от user_id: {message.from_user.id}")
+    log.debug("Команда /start", extra={"user_id": message.from_user.id})
     user_id = message.from_user.id
     user_name = message.from_user.full_name or "Неизвестный"
     
     try:
-        bot.send_message(
+        send_message(
             message.chat.id,
             f"<b>Ресторан «{RESTAURANT_NAME}»</b> приветствует вас!\nТут вы можете дистанционно забронировать любой понравившийся столик и получить меню! Используйсте кнопки снизу",
             reply_markup=main_reply_kb(user_id, user_name),
             parse_mode="HTML"
         )
-        print(f"[{datetime.now()}] (Обработчик) Отправлено приветственное сообщение для user_id: {user_id}")
+        log.debug("Приветствие поставлено в очередь", extra={"user_id": user_id})
     except Exception as e:
-        print(f"[{datetime.now()}] (Обработчик) КРИТИЧЕСКАЯ ОШИБКА при отправке приветственного сообщения user_id: {user_id}: {e}")
+        log.exception("Ошибка при отправке приветственного сообщения: %s", e, extra={"user_id": user_id})
         try:
-            bot.send_message(message.chat.id, "Извините, произошла ошибка при загрузке приветствия. Попробуйте позже.")
+            send_message(message.chat.id, "Извините, произошла ошибка при загрузке приветствия. Попробуйте позже.")
         except Exception as e_inner:
-            print(f"[{datetime.now()}] (Обработчик) НЕ УДАЛОСЬ ОТПРАВИТЬ СООБЩЕНИЕ ОБ ОШИБКЕ пользователю {user_id}: {e_inner}")
+            log.error("Не удалось отправить сообщение об ошибке: %s", e_inner, extra={"user_id": user_id})
 
 
 @bot.message_handler(commands=["history"])
 def cmd_history(message: types.Message):
     """Отображение истории для админа."""
-    print(f"[{datetime.now()}] (Обработчик) Получена команда /history от user_id: {message.from_user.id}")
+    log.debug("Команда /history", extra={"user_id": message.from_user.id})
     if not ADMIN_ID or str(message.chat.id) != str(ADMIN_ID):
-        bot.send_message(message.chat.id, "У вас нет прав для этой команды.")
+        send_message(message.chat.id, "У вас нет прав для этой команды.")
         return
     try:
-        with db_connect() as conn:
+        with read_connection(user_read_key(ADMIN_ID)) as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     SELECT booking_id, user_name, table_id, time_slot, booked_at, booking_for
@@ -230,49 +759,96 @@ def cmd_history(message: types.Message):
                 """)
                 rows = cur.fetchall()
         if not rows:
-            bot.send_message(message.chat.id, "История пуста.")
+            send_message(message.chat.id, "История пуста.")
             return
-        text = "<b>История бронирований (последние 50):</b>\n\n"
+        lines = ["<b>История бронирований (последние 50):</b>", ""]
         for r in rows:
-            booking_date = r['booking_for'].strftime("%d.%m.%Y")
-            text += f"#{r['booking_id']} — {r['user_name']}, стол {r['table_id']}, {r['time_slot']}, {booking_date}\n"
-        bot.send_message(message.chat.id, text)
+            booking_date = local_date_str(r['booking_for'])
+            lines.append(f"#{r['booking_id']} — {html.escape(r['user_name'] or '')}, стол {r['table_id']}, {r['time_slot']}, {booking_date}")
+        lines.extend(["", "Полная история — /export"])
+        # Длинный список режем по строкам, чтобы не упереться в лимит сообщения Telegram
+        for chunk in util.smart_split("\n".join(lines), util.MAX_MESSAGE_LENGTH):
+            send_message(message.chat.id, chunk)
+    except Exception as e:
+        send_message(message.chat.id, f"Ошибка истории: {e}")
+
+
+EXPORT_USAGE = "Формат: /export [csv|json] [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [столы через запятую]"
+
+@bot.message_handler(commands=["export"])
+def cmd_export(message: types.Message):
+    """Выгрузка истории броней документом (для админа): CSV или NDJSON, фильтры по датам и столам."""
+    log.debug("Команда /export", extra={"user_id": message.from_user.id})
+    if not ADMIN_ID or str(message.chat.id) != str(ADMIN_ID):
+        send_message(message.chat.id, "У вас нет прав для этой команды.")
+        return
+    try:
+        fmt, date_from, date_to, table_ids = parse_export_args(message.text.split()[1:])
+    except ValueError as e:
+        send_message(message.chat.id, f"Ошибка: {html.escape(str(e))}\n{EXPORT_USAGE}")
+        return
+
+    # До EXPORT_SPOOL_MAX_BYTES файл в памяти, дальше — на диске: память не растёт с числом строк
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    try:
+        with db_connection() as conn:
+            size = write_export(spool, fmt, iter_booking_batches(conn, date_from, date_to, table_ids, EXPORT_BATCH_SIZE))
     except Exception as e:
-        bot.send_message(message.chat.id, f"Ошибка истории: {e}")
+        spool.close()
+        log.exception("Ошибка /export: %s", e)
+        send_message(message.chat.id, f"Ошибка выгрузки: {html.escape(str(e))}")
+        return
+    if size > EXPORT_DOCUMENT_MAX_BYTES:
+        spool.close()
+        send_message(message.chat.id, "Выгрузка больше 50 МБ — сузьте период или воспользуйтесь /export/bookings.")
+        return
+
+    filename = export_filename(fmt, date_from, date_to, table_ids)
+
+    def upload(chat_id):
+        # При повторе после 429 файл отправляется сначала
+        spool.seek(0)
+        return bot.send_document(chat_id, spool, visible_file_name=filename, caption=f"Брони: {filename}")
+
+    future = get_sender().submit(message.chat.id, upload, (message.chat.id,))
+    future.add_done_callback(lambda _: spool.close())
+    log.info("Выгрузка броней поставлена в очередь", extra={"user_id": message.from_user.id, "bytes": size, "format": fmt})
+
+
+@bot.message_handler(commands=["warmup_menu"])
+def cmd_warmup_menu(message: types.Message):
+    """Предзагрузка фото меню в Telegram (для админа): после неё все категории уходят по file_id."""
+    log.debug("Команда /warmup_menu", extra={"user_id": message.from_user.id})
+    if not ADMIN_ID or str(message.chat.id) != str(ADMIN_ID):
+        send_message(message.chat.id, "У вас нет прав для этой команды.")
+        return
+    def warm_up(chat_id):
+        try:
+            uploaded = menu_photo_cache.warm_up(chat_id, MENU_PHOTOS)
+            bot.send_message(chat_id, f"Фото меню прогреты. Загружено новых: {uploaded}.")
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                raise  # очередь отправки повторит прогрев после retry_after
+            bot.send_message(chat_id, f"Ошибка прогрева меню: {e}")
 
+    # Прогрев отправляет все категории подряд — выполняем его в очереди отправки, с её лимитами
+    get_sender().submit(message.chat.id, warm_up, (message.chat.id,), cost=len(MENU_PHOTOS) + 1)
 
-@bot.message_handler(func=lambda m: "Моя бронь" in m.text)
+
+@router.text(BTN_MY_BOOKING, "Моя бронь")
 def on_my_booking(message: types.Message):
     """Отображение активной брони пользователя."""
-    print(f"[{datetime.now()}] (Обработчик) Нажата кнопка 'Моя бронь' от user_id: {message.from_user.id}")
+    log.debug("Кнопка 'Моя бронь'", extra={"user_id": message.from_user.id})
     try:
-        # Устанавливаем часовой пояс для сравнения с NOW()
-        local_tz = tz.gettz("Europe/Moscow")
-        now_local = datetime.now(tz=local_tz)
-
-        with db_connect() as conn:
-            with conn.cursor() as cur:
-                # Ищем самую последнюю активную бронь (booking_for > NOW())
-                cur.execute("""
-                    SELECT booking_id, table_id, time_slot, booking_for, phone, guests
-                    FROM bookings
-                    WHERE user_id=%s AND booking_for > NOW()
-                    ORDER BY booking_for ASC
-                    LIMIT 1;
-                """, (message.from_user.id,))
-                row = cur.fetchone()
-        
         user_id = message.from_user.id
         user_name = message.from_user.full_name or "Неизвестный"
+        row = get_next_booking(user_id)
 
         if not row:
-            bot.send_message(message.chat.id, "У вас нет активной брони.", reply_markup=main_reply_kb(user_id, user_name))
+            send_message(message.chat.id, "У вас нет активной брони.", reply_markup=main_reply_kb(user_id, user_name))
             return
         
-        # Преобразование даты в локальный формат для пользователя
-        # Если booking_for - timezone aware (должен быть), to_datetime переведет его
-        booking_for_dt = row['booking_for'].astimezone(local_tz) if row['booking_for'].tzinfo else row['booking_for'] 
-        booking_date = booking_for_dt.strftime("%d.%m.%Y")
+        booking_date = local_date_str(row['booking_for'])
         
         kb = types.InlineKeyboardMarkup()
         kb.add(types.InlineKeyboardButton(text="❌ Отменить бронь", callback_data=f"cancel_{row['booking_id']}"))
@@ -286,19 +862,49 @@ def on_my_booking(message: types.Message):
             f"Телефон: {row.get('phone', 'Не указан')}"
         )
         
-        bot.send_message(message.chat.id, 
+        send_message(message.chat.id, 
                          message_text, 
                          parse_mode="HTML",
                          reply_markup=kb)
     except Exception as e:
-        print(f"[{datetime.now()}] (Обработчик) Ошибка в on_my_booking: {e}")
-        bot.send_message(message.chat.id, "Ошибка при получении брони. Попробуйте позже.")
-
-
-@bot.message_handler(func=lambda m: "Меню" in m.text)
+        log.exception("Ошибка в on_my_booking: %s", e)
+        send_message(message.chat.id, "Ошибка при получении брони. Попробуйте позже.")
+
+def get_next_booking(user_id):
+    """Ближайшая активная бронь пользователя (booking_for > NOW()) или None; из кэша, если есть."""
+    cache = get_user_booking_cache()
+    row = cache.get(user_id)
+    if row is not MISSING:
+        if row is None or row['booking_for'] > utc_now():
+            return row
+        # Бронь началась — ищем следующую
+
+    token = cache.token()
+    with read_connection(user_read_key(user_id)) as conn:
+        with conn.cursor() as cur:
+            # Ищем ближайшую активную бронь (booking_for > NOW())
+            cur.execute("""
+                SELECT booking_id, table_id, time_slot, booking_for, phone, guests
+                FROM bookings
+                WHERE user_id=%s AND booking_for > NOW()
+                ORDER BY booking_for ASC
+                LIMIT 1;
+            """, (user_id,))
+            row = cur.fetchone()
+
+    ttl = None
+    if row is not None:
+        # Запись истекает в момент начала брони, даже если TTL ещё не вышел
+        ttl = min(user_booking_cache.ttl, (row['booking_for'] - utc_now()).total_seconds())
+    if ttl is None or ttl > 0:
+        cache.set(user_id, row, ttl=ttl, token=token)
+    return row
+
+
+@router.text(BTN_MENU, "Меню")
 def on_menu(message: types.Message):
     """Обработчик кнопки Меню."""
-    print(f"[{datetime.now()}] (Обработчик) Нажата кнопка 'Меню' от user_id: {message.from_user.id}")
+    log.debug("Кнопка 'Меню'", extra={"user_id": message.from_user.id})
     kb = types.InlineKeyboardMarkup(row_width=2) 
     
     buttons = []
@@ -308,60 +914,81 @@ def on_menu(message: types.Message):
     kb.add(*buttons)
     
     try:
-        bot.send_message(
+        send_message(
             message.chat.id, 
             "🍽️ Выберите интересующий вас раздел меню:",
             reply_markup=kb
         )
-        print(f"[{datetime.now()}] (Обработчик) Отправлено меню с категориями для user_id: {message.from_user.id}")
+        log.debug("Меню с категориями поставлено в очередь", extra={"user_id": message.from_user.id})
     except Exception as e:
-        print(f"[{datetime.now()}] (Обработчик) Ошибка при отправке меню user_id: {message.from_user.id}: {e}")
-        bot.send_message(message.chat.id, "Извините, произошла ошибка при загрузке меню. Попробуйте позже.")
+        log.exception("Ошибка при отправке меню: %s", e, extra={"user_id": message.from_user.id})
+        send_message(message.chat.id, "Извините, произошла ошибка при загрузке меню. Попробуйте позже.")
 
 
 # =========================
 # АДМИН-ПАНЕЛЬ
 # =========================
-@bot.message_handler(func=lambda m: "Управление" in m.text)
+ADMIN_PAGE_DIRECTIONS = {"f": "first", "n": "next", "p": "prev", "a": "at"}
+
+def render_admin_page(direction="first", anchor=None):
+    """Одна страница активных броней: (текст, клавиатура) или (None, None), если броней нет.
+
+    callback_data: admp_<f|n|p|a>[_<микросекунды>_<id>] — навигация,
+    admc_<booking_id>_<ключ первой строки> — отмена с перерисовкой текущей страницы.
+    """
+    # Админ видит свои отмены сразу (admin_cancel_booking помечает его ключ), чужие брони — с отставанием реплики
+    with read_connection(user_read_key(ADMIN_ID)) as conn:
+        with conn.cursor() as cur:
+            rows, has_more = fetch_active_bookings_page(cur, ADMIN_PAGE_SIZE, direction, anchor)
+            if not rows and direction != "first":
+                # Страница опустела (брони отменены или прошли) — показываем начало
+                direction = "first"
+                rows, has_more = fetch_active_bookings_page(cur, ADMIN_PAGE_SIZE, direction)
+    if not rows:
+        return None, None
+
+    lines = ["<b>Активные бронирования:</b>", ""]
+    for r in rows:
+        booking_date = local_date_str(r['booking_for'])
+        lines.append(f"🔖 <b>#{r['booking_id']}</b> — {html.escape(r['user_name'] or 'Неизвестный')}")
+        lines.append(f"   Стол {r['table_id']}, {r['time_slot']} ({booking_date}), тел. {html.escape(r['phone'] or 'не указан')}")
+
+    first_key = encode_keyset(rows[0]['booking_for'], rows[0]['booking_id'])
+    last_key = encode_keyset(rows[-1]['booking_for'], rows[-1]['booking_id'])
+
+    kb = types.InlineKeyboardMarkup(row_width=3)
+    kb.add(*[types.InlineKeyboardButton(text=f"❌ #{r['booking_id']}", callback_data=f"admc_{r['booking_id']}_{first_key}")
+             for r in rows])
+    has_prev = has_more if direction == "prev" else direction != "first"
+    has_next = has_more if direction != "prev" else True
+    nav = []
+    if has_prev:
+        nav.append(types.InlineKeyboardButton(text="◀️ Назад", callback_data=f"admp_p_{first_key}"))
+    nav.append(types.InlineKeyboardButton(text="🔄", callback_data=f"admp_a_{first_key}"))
+    if has_next:
+        nav.append(types.InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"admp_n_{last_key}"))
+    kb.row(*nav)
+    return "\n".join(lines), kb
+
+
+@router.text(BTN_ADMIN, "Управление")
 def on_admin_panel(message: types.Message):
-    """Отображение активных бронирований для админа."""
-    print(f"[{datetime.now()}] (Обработчик) Нажата кнопка 'Управление' от user_id: {message.from_user.id}")
+    """Отображение активных бронирований для админа (постранично, одним сообщением)."""
+    log.debug("Кнопка 'Управление'", extra={"user_id": message.from_user.id})
     if not ADMIN_ID or str(message.chat.id) != str(ADMIN_ID):
-        bot.send_message(message.chat.id, "У вас нет прав для этой команды.")
+        send_message(message.chat.id, "У вас нет прав для этой команды.")
         return
     try:
-        with db_connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT booking_id, user_name, table_id, time_slot, booking_for, phone
-                    FROM bookings
-                    WHERE booking_for > NOW()
-                    ORDER BY booking_for ASC;
-                """)
-                rows = cur.fetchall()
-        if not rows:
-            bot.send_message(message.chat.id, "Активных бронирований нет.")
+        text, kb = render_admin_page()
+        if text is None:
+            send_message(message.chat.id, "Активных бронирований нет.")
             return
-        
-        for r in rows:
-            # Устанавливаем часовой пояс для отображения
-            local_tz = tz.gettz("Europe/Moscow")
-            booking_for_dt = r['booking_for'].astimezone(local_tz) if r['booking_for'].tzinfo else r['booking_for']
-            booking_date = booking_for_dt.strftime("%d.%m.%Y")
-            
-            text = f"🔖 Бронь #{r['booking_id']} — {r['user_name']}\n"
-            text += f"   - Стол: {r['table_id']}\n"
-            text += f"   - Время: {r['time_slot']} ({booking_date})\n"
-            text += f"   - Телефон: {r['phone']}\n"
-            
-            kb = types.InlineKeyboardMarkup()
-            kb.add(types.InlineKeyboardButton(text="❌ Отменить", callback_data=f"admin_cancel_{r['booking_id']}"))
-            bot.send_message(message.chat.id, text, parse_mode="HTML", reply_markup=kb)
+        send_message(message.chat.id, text, parse_mode="HTML", reply_markup=kb)
 
     except Exception as e:
-        bot.send_message(message.chat.id, f"Ошибка админ-панели: {e}")
+        send_message(message.chat.id, f"Ошибка админ-панели: {e}")
 
-@bot.message_handler(func=lambda m: "История" in m.text)
+@router.text(BTN_HISTORY, "История")
 def on_history_btn(message: types.Message):
     """Обработка кнопки Истории."""
     return cmd_history(message)
@@ -369,10 +996,10 @@ def on_history_btn(message: types.Message):
 # =========================
 # CALLBACKS
 # =========================
-@bot.callback_query_handler(func=lambda c: c.data.startswith("menu_cat_"))
+@router.callback("menu_cat_")
 def on_menu_category_select(call: types.CallbackQuery):
     """Обработка выбора категории меню."""
-    print(f"[{datetime.now()}] (Обработчик) Получен callback от кнопки меню '{call.data}' от user_id: {call.from_user.id}")
+    log.debug("Callback меню", extra={"user_id": call.from_user.id, "data": call.data})
     category_name = call.data.split("menu_cat_")[1]
 
     kb = types.InlineKeyboardMarkup(row_width=2)
@@ -382,36 +1009,37 @@ def on_menu_category_select(call: types.CallbackQuery):
     try:
         photos = MENU_PHOTOS.get(category_name, [])
         if photos:
-            for url in photos:
-                bot.send_photo(call.message.chat.id, url)
+            # Повторно отправляем по file_id; несколько фото — одним альбомом (один вызов API на 10 фото)
+            get_sender().submit(call.message.chat.id, menu_photo_cache.send, (call.message.chat.id, photos),
+                                cost=-(-len(photos) // MEDIA_GROUP_LIMIT))
         else:
-            bot.send_message(call.message.chat.id, f"Раздел <b>{category_name}</b> пока пуст.", parse_mode="HTML")
+            send_message(call.message.chat.id, f"Раздел <b>{category_name}</b> пока пуст.", parse_mode="HTML")
 
-        bot.send_message(
+        send_message(
             call.message.chat.id,
             "⬇️ Выберите следующий раздел:",
             reply_markup=kb
         )
 
         bot.answer_callback_query(call.id, text=f"Открываю: {category_name}")
-        print(f"[{datetime.now()}] (Обработчик) Отправлено текстовое меню для категории '{category_name}' user_id: {call.from_user.id}")
+        log.debug("Раздел меню поставлен в очередь", extra={"user_id": call.from_user.id, "category": category_name})
 
     except Exception as e:
-        logging.error(f"[{datetime.now()}] (Обработчик) Ошибка при отправке текстового меню для user_id: {call.from_user.id}: {e}")
-        bot.send_message(call.message.chat.id, f"Произошла ошибка при загрузке раздела <b>{category_name}</b>.", parse_mode="HTML")
+        log.exception("Ошибка при отправке раздела меню: %s", e, extra={"user_id": call.from_user.id})
+        send_message(call.message.chat.id, f"Произошла ошибка при загрузке раздела <b>{category_name}</b>.", parse_mode="HTML")
         bot.answer_callback_query(call.id, text="Ошибка загрузки.", show_alert=True)
 
 
-@bot.callback_query_handler(func=lambda c: c.data.startswith("cancel_"))
+@router.callback("cancel_")
 def on_cancel_user(call: types.CallbackQuery):
     """Отмена брони пользователем."""
-    print(f"[{datetime.now()}] (Обработчик) Получен callback для отмены брони пользователем '{call.data}' от user_id: {call.from_user.id}")
+    log.debug("Callback отмены брони пользователем", extra={"user_id": call.from_user.id, "data": call.data})
     booking_id = int(call.data.split("_")[1])
     try:
         booking_info = None
         rows_deleted = 0
         
-        with db_connect() as conn:
+        with db_connection() as conn:
             with conn.cursor() as cur:
                 # Получаем инфо до удаления
                 cur.execute("""
@@ -424,211 +1052,242 @@ def on_cancel_user(call: types.CallbackQuery):
                 # Удаляем запись
                 cur.execute("DELETE FROM bookings WHERE booking_id=%s AND user_id=%s;", (booking_id, call.from_user.id))
                 rows_deleted = cur.rowcount
+                if rows_deleted > 0 and booking_info:
+                    booking_changed(cur, "delete", booking_info['table_id'], booking_info['booking_for'], booking_id, booking_info['user_id'])
+
+                    # Уведомление админа — в той же транзакции, что и удаление
+                    if ADMIN_ID:
+                        booking_date = local_date_str(booking_info['booking_for'])
+                        user_id = booking_info['user_id']
+                        user_name = booking_info['user_name'] or call.from_user.full_name or 'Неизвестный пользователь'
+
+                        message_text = (
+                            f"❌ Бронь отменена пользователем:\n"
+                            f"ID Брони: <b>#{booking_id}</b>\n"
+                            f"Пользователь: {user_link(user_id, user_name)}\n"
+                            f"Стол: {booking_info['table_id']}\n"
+                            f"Дата: {booking_date}\n"
+                            f"Время: {booking_info['time_slot']}\n"
+                            f"Гостей: {booking_info.get('guests', 'N/A')}\n"
+                            f"Телефон: {booking_info.get('phone', 'Не указан')}"
+                        )
+                        enqueue_message(cur, ADMIN_ID, message_text, parse_mode="HTML", kind="admin")
                 conn.commit()
         
         if rows_deleted > 0:
-            bot.edit_message_text("Бронь отменена.", chat_id=call.message.chat.id, message_id=call.message.id)
-            print(f"[{datetime.now()}] (Обработчик) Бронь #{booking_id} отменена пользователем {call.from_user.id}")
-            
-            if ADMIN_ID and booking_info:
-                try:
-                    local_tz = tz.gettz("Europe/Moscow")
-                    booking_for_dt = booking_info['booking_for'].astimezone(local_tz) if booking_info['booking_for'].tzinfo else booking_info['booking_for']
-                    booking_date = booking_for_dt.strftime("%d.%m.%Y")
-                    user_id = booking_info['user_id']
-                    user_name = booking_info['user_name'] or call.from_user.full_name or 'Неизвестный пользователь'
-                    user_link = f'<a href="tg://user?id={user_id}">{user_name}</a>' if user_id else user_name
-                    
-                    message_text = (
-                        f"❌ Бронь отменена пользователем:\n"
-                        f"ID Брони: <b>#{booking_id}</b>\n"
-                        f"Пользователь: {user_link}\n"
-                        f"Стол: {booking_info['table_id']}\n"
-                        f"Дата: {booking_date}\n"
-                        f"Время: {booking_info['time_slot']}\n"
-                        f"Гостей: {booking_info.get('guests', 'N/A')}\n"
-                        f"Телефон: {booking_info.get('phone', 'Не указан')}"
-                    )
-                    bot.send_message(ADMIN_ID, message_text, parse_mode="HTML")
-                    print(f"[{datetime.now()}] (Обработчик) Уведомление админа об отмене брони #{booking_id} отправлено.")
-                except Exception as e:
-                    print(f"[{datetime.now()}] (Обработчик) Не удалось уведомить админа об отмене брони: {e}")
+            if booking_info:
+                invalidate_availability(booking_info['table_id'], booking_info['booking_for'])
+                invalidate_user_booking(booking_info['user_id'])
+                unschedule_reminder(booking_id)
+                outbox_committed()
+            edit_message_text("Бронь отменена.", chat_id=call.message.chat.id, message_id=call.message.id)
+            log.info("Бронь #%s отменена пользователем", booking_id, extra={"user_id": call.from_user.id, "booking_id": booking_id})
 
         else:
             bot.answer_callback_query(call.id, "Бронь уже была отменена или не найдена.", show_alert=True)
-            print(f"[{datetime.now()}] (Обработчик) Пользователь {call.from_user.id} пытался отменить несуществующую/уже отмененную бронь #{booking_id}")
+            log.info("Попытка отменить несуществующую/уже отменённую бронь #%s", booking_id, extra={"user_id": call.from_user.id, "booking_id": booking_id})
             
     except Exception as e:
-        print(f"[{datetime.now()}] (Обработчик) Ошибка при отмене брони пользователем {call.from_user.id} брони #{booking_id}: {e}")
+        log.exception("Ошибка при отмене брони #%s пользователем: %s", booking_id, e, extra={"user_id": call.from_user.id, "booking_id": booking_id})
         bot.answer_callback_query(call.id, f"Ошибка: {e}", show_alert=True)
 
 
-@bot.callback_query_handler(func=lambda c: c.data.startswith("admin_cancel_"))
+def admin_cancel_booking(booking_id):
+    """Удаляет бронь от имени админа и уведомляет пользователя. Возвращает данные брони или None."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            # Получаем инфо до удаления
+            cur.execute("SELECT user_id, user_name, table_id, time_slot, booking_for, phone FROM bookings WHERE booking_id=%s;", (booking_id,))
+            booking_info = cur.fetchone()
+
+            # Удаляем запись
+            cur.execute("DELETE FROM bookings WHERE booking_id=%s;", (booking_id,))
+            if booking_info:
+                booking_changed(cur, "delete", booking_info['table_id'], booking_info['booking_for'], booking_id, booking_info['user_id'])
+
+                # Уведомление пользователя — в той же транзакции, что и удаление
+                user_id = booking_info['user_id']
+                if user_id:
+                    booking_date = local_date_str(booking_info['booking_for'])
+                    message_text = f"❌ Ваша бронь отменена администратором.\n\nСтол: {booking_info['table_id']}\nДата: {booking_date}\nВремя: {booking_info['time_slot']}"
+                    enqueue_message(cur, user_id, message_text)
+            conn.commit()
+
+    if booking_info:
+        invalidate_availability(booking_info['table_id'], booking_info['booking_for'])
+        invalidate_user_booking(booking_info['user_id'])
+        if ADMIN_ID:
+            note_write(user_read_key(ADMIN_ID))
+        unschedule_reminder(booking_id)
+        outbox_committed()
+    return booking_info
+
+
+@router.callback("admin_cancel_")
 def on_cancel_admin(call: types.CallbackQuery):
     """Отмена брони администратором."""
-    print(f"[{datetime.now()}] (Обработчик) Получен callback для отмены брони админом '{call.data}' от user_id: {call.from_user.id}")
+    log.debug("Callback отмены брони админом", extra={"user_id": call.from_user.id, "data": call.data})
     booking_id = int(call.data.split("_")[2])
     if not ADMIN_ID or str(call.from_user.id) != str(ADMIN_ID):
         bot.answer_callback_query(call.id, "У вас нет прав для этого действия.", show_alert=True)
         return
     try:
-        booking_info = None
-        
-        with db_connect() as conn:
-            with conn.cursor() as cur:
-                # Получаем инфо до удаления
-                cur.execute("SELECT user_id, user_name, table_id, time_slot, booking_for, phone FROM bookings WHERE booking_id=%s;", (booking_id,))
-                booking_info = cur.fetchone()
+        admin_cancel_booking(booking_id)
+        edit_message_text(f"Бронь #{booking_id} успешно отменена.", chat_id=call.message.chat.id, message_id=call.message.id)
+        bot.answer_callback_query(call.id, "Бронь отменена.", show_alert=True)
+        log.info("Бронь #%s отменена админом", booking_id, extra={"user_id": call.from_user.id, "booking_id": booking_id})
+    except Exception as e:
+        log.exception("Ошибка при отмене брони #%s админом: %s", booking_id, e, extra={"user_id": call.from_user.id, "booking_id": booking_id})
+        bot.answer_callback_query(call.id, f"Ошибка: {e}", show_alert=True)
 
-                # Удаляем запись
-                cur.execute("DELETE FROM bookings WHERE booking_id=%s;", (booking_id,))
-                conn.commit()
-        
-        if booking_info:
-            user_id = booking_info['user_id']
-            local_tz = tz.gettz("Europe/Moscow")
-            booking_for_dt = booking_info['booking_for'].astimezone(local_tz) if booking_info['booking_for'].tzinfo else booking_info['booking_for']
-            booking_date = booking_for_dt.strftime("%d.%m.%Y")
-            
-            message_text = f"❌ Ваша бронь отменена администратором.\n\nСтол: {booking_info['table_id']}\nДата: {booking_date}\nВремя: {booking_info['time_slot']}"
-            try:
-                bot.send_message(user_id, message_text)
-                print(f"[{datetime.now()}] (Обработчик) Уведомление пользователю {user_id} об отмене брони #{booking_id} отправлено.")
-            except Exception as e:
-                print(f"[{datetime.now()}] (Обработчик) Не удалось уведомить пользователя {user_id} об отмене брони: {e}")
 
-        bot.edit_message_text(f"Бронь #{booking_id} успешно отменена.", chat_id=call.message.chat.id, message_id=call.message.id)
-        bot.answer_callback_query(call.id, "Бронь отменена.", show_alert=True)
-        print(f"[{datetime.now()}] (Обработчик) Бронь #{booking_id} отменена админом {call.from_user.id}")
+def _edit_admin_page(call, direction, anchor):
+    """Перерисовывает страницу админ-панели в том же сообщении."""
+    text, kb = render_admin_page(direction, anchor)
+    if text is None:
+        edit_message_text("Активных бронирований нет.", chat_id=call.message.chat.id, message_id=call.message.id)
+        return
+    # "message is not modified" (повторное нажатие 🔄) очередь отправки не считает ошибкой
+    edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.id, parse_mode="HTML", reply_markup=kb)
+
+
+@router.callback("admp_")
+def on_admin_page(call: types.CallbackQuery):
+    """Навигация по страницам админ-панели."""
+    if not ADMIN_ID or str(call.from_user.id) != str(ADMIN_ID):
+        bot.answer_callback_query(call.id, "У вас нет прав для этого действия.", show_alert=True)
+        return
+    try:
+        _, code, *key = call.data.split("_", 2)
+        direction = ADMIN_PAGE_DIRECTIONS[code]
+        anchor = decode_keyset(key[0]) if key else None
+        _edit_admin_page(call, direction, anchor)
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        log.exception("Ошибка навигации админ-панели: %s", e, extra={"data": call.data})
+        bot.answer_callback_query(call.id, f"Ошибка: {e}", show_alert=True)
+
+
+@router.callback("admc_")
+def on_cancel_admin_page(call: types.CallbackQuery):
+    """Отмена брони из страницы админ-панели с перерисовкой страницы на месте."""
+    log.debug("Callback отмены брони админом", extra={"user_id": call.from_user.id, "data": call.data})
+    if not ADMIN_ID or str(call.from_user.id) != str(ADMIN_ID):
+        bot.answer_callback_query(call.id, "У вас нет прав для этого действия.", show_alert=True)
+        return
+    try:
+        _, booking_id, key = call.data.split("_", 2)
+        booking_id = int(booking_id)
+        booking_info = admin_cancel_booking(booking_id)
+        _edit_admin_page(call, "at", decode_keyset(key))
+        if booking_info:
+            bot.answer_callback_query(call.id, f"Бронь #{booking_id} отменена.")
+            log.info("Бронь #%s отменена админом", booking_id, extra={"user_id": call.from_user.id, "booking_id": booking_id})
+        else:
+            bot.answer_callback_query(call.id, "Бронь уже была отменена или не найдена.", show_alert=True)
     except Exception as e:
-        print(f"[{datetime.now()}] (Обработчик) Ошибка при отмене брони админом {call.from_user.id} брони #{booking_id}: {e}")
+        log.exception("Ошибка при отмене брони админом: %s", e, extra={"user_id": call.from_user.id, "data": call.data})
         bot.answer_callback_query(call.id, f"Ошибка: {e}", show_alert=True)
 
 
+def book(req):
+    """Бронь по проверенному запросу (общий путь WebApp и /book): транзакция, уведомления, сброс кэшей.
+
+    BookingConflict — стол занят (транзакция откатывается пулом). Без стола (table="auto") — см. book_auto.
+    """
+    if req.table_id is None:
+        return book_auto(req)
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            booking_id = create_booking(cur, BOOKING_CONFLICT_MODE, req, now_local(), ADMIN_ID)
+            booking_changed(cur, "insert", req.table_id, req.booking_start, booking_id, req.user_id)
+    invalidate_availability(req.table_id, req.booking_start)
+    invalidate_user_booking(req.user_id)
+    schedule_reminder(booking_id, req.booking_start)
+    outbox_committed()
+    return booking_id
+
+def get_day_index(day, fresh=False):
+    """Занятость всех столов за день для автоподбора (один запрос); лежит в кэше занятости до изменения броней дня."""
+    cache = get_availability_cache()
+    key = ("day_index", day)
+    index = MISSING if fresh else cache.get(key)
+    if index is MISSING:
+        token = cache.token()
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                index = allocator.build(day, fetch_tables_day(cursor, day))
+        cache.set(key, index, token=token)
+    return index
+
+def book_auto(req):
+    """Бронь с автоподбором стола по числу гостей; BookingConflict — подходящего свободного стола нет."""
+    day = local_day(req.booking_start)
+    for attempt in range(ALLOCATION_RETRIES):
+        # Повтор — по свежему индексу: стол могли занять между чтением индекса и вставкой
+        table = allocator.allocate(get_day_index(day, fresh=attempt > 0), req.booking_start, req.duration_hours, req.guests)
+        if table is None:
+            break
+        try:
+            return book(req._replace(table_id=table.table_id))
+        except BookingConflict:
+            log.info("Автоподбор: стол %s заняли, пробуем другой", table.table_id, extra={"user_id": req.user_id})
+    raise BookingConflict(f"Нет свободного стола на {req.guests} гостей на {req.date_str} {req.time_slot}.")
+
+def suggest_tables(req, zone=None, limit=SUGGEST_LIMIT):
+    """Ближайшие к времени запроса свободные варианты (время и лучший стол), см. TableAllocator.suggest."""
+    index = get_day_index(local_day(req.booking_start))
+    return allocator.suggest(index, req.booking_start, req.duration_hours, req.guests, zone=zone, limit=limit,
+                             max_shift_minutes=SUGGEST_MAX_SHIFT_MIN)
+
+def book_many(reqs):
+    """Пакет броней одной транзакцией (групповые и банкетные брони): все или ни одной."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            booking_ids = create_bookings(cur, BOOKING_CONFLICT_MODE, reqs, now_local(), ADMIN_ID)
+            for req, booking_id in zip(reqs, booking_ids):
+                booking_changed(cur, "insert", req.table_id, req.booking_start, booking_id, req.user_id)
+    for req, booking_id in zip(reqs, booking_ids):
+        invalidate_availability(req.table_id, req.booking_start)
+        invalidate_user_booking(req.user_id)
+        schedule_reminder(booking_id, req.booking_start)
+    outbox_committed()
+    return booking_ids
+
+
 @bot.message_handler(content_types=['web_app_data'])
 def on_webapp_data(message: types.Message):
     """Обработка данных, пришедших из WebApp с учётом duration_hours."""
-    print(f"[{datetime.now()}] (Обработчик) ПРИШЛИ ДАННЫЕ ОТ WEBAPP: {message.web_app_data.data}") 
+    log.debug("Данные от WebApp", extra={"user_id": message.from_user.id, "data": message.web_app_data.data})
+    user_id = message.from_user.id
     try:
         data = json.loads(message.web_app_data.data)
-        user_id = message.from_user.id
-        user_name = message.from_user.full_name or "Неизвестный"
-        phone = data.get('phone')
-        guests = data.get('guests')
-        table_id = data.get('table')
-        time_slot = data.get('time')
-        date_str = data.get('date')
-        duration_hours = int(data.get('duration_hours', 1))  # новая длительность
-
-        if not all([phone, guests, table_id, time_slot, date_str]):
-            bot.send_message(user_id, "Ошибка: Не хватает данных для бронирования через WebApp.")
-            return
-
-        # ===== ВАЛИДАЦИЯ (Теперь внутри try!) =====
-        phone_pattern = r'^\+375(25|29|33|44)\d{7}$'
-        if not re.match(phone_pattern, phone):
-            bot.send_message(user_id, "Неверный формат телефона. Укажите в формате +375 (ХХ) ХХХХХХХ.")
+        try:
+            req = parse_booking_request(data, user_id=user_id, user_name=message.from_user.full_name, require_phone=True)
+        except BookingError as e:
+            send_message(user_id, f"Ошибка: {e.message}")
             return
-
         try:
-            guests = int(guests)
-            if guests < 1 or guests > 20:
-                bot.send_message(user_id, "Количество гостей должно быть от 1 до 20.")
+            book(req)
+        except BookingConflict as e:
+            if req.table_id is not None:
+                send_message(user_id, f"Стол {req.table_id} уже забронирован на {req.date_str} {req.time_slot}. Пожалуйста, выберите другое время.")
                 return
-        except ValueError:
-            bot.send_message(user_id, "Некорректное значение количества гостей.")
-            return
-
-        if duration_hours < 1 or duration_hours > 3:
-            bot.send_message(user_id, "Длительность брони должна быть от 1 до 3 часов.")
-            return
-        # =======================================
-
-        booking_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        booking_start_naive = datetime.combine(booking_date, datetime.strptime(time_slot, '%H:%M').time())
-        local_tz = timezone("Europe/Moscow")
-        booking_start = local_tz.localize(booking_start_naive)
-        booking_end = booking_start + timedelta(hours=duration_hours)
-
-        # ===== Уведомление для 10+ гостей =====
-        if guests >= 10:
-            notice_text = (
-                "⚠️ При количестве гостей 10 и более необходимо согласовать предварительный заказ. "
-                "Администратор свяжется с Вами в ближайшее время!"
-            )
-            bot.send_message(user_id, notice_text)
-            admin_note = "⚠️ ВНИМАНИЕ: гостей больше 10 — согласовать заказ."
-        else:
-            admin_note = ""
-        # =======================================
-
-        with db_connect() as conn:
-            with conn.cursor() as cursor:
-                # Включаем явную транзакцию
-                conn.autocommit = False
-
-                # Блокируем все брони на этот стол на выбранную дату
-                cursor.execute("""
-                    SELECT booking_id, booking_for, duration_hours
-                    FROM bookings
-                    WHERE table_id = %s AND booking_for::date = %s
-                    FOR UPDATE;
-                """, (table_id, booking_date))
-
-                existing_bookings = cursor.fetchall()
-
-                # Проверка пересечения интервалов
-                conflict = False
-                for b in existing_bookings:
-                    b_start = b['booking_for'].astimezone(local_tz) if b['booking_for'].tzinfo else b['booking_for'].replace(tzinfo=local_tz)
-                    b_end = b_start + timedelta(hours=b.get('duration_hours', 1))
-                    if booking_start < b_end and booking_end > b_start:
-                        conflict = True
-                        break
-
-                if conflict:
-                    conn.rollback()  # отменяем транзакцию
-                    bot.send_message(user_id, f"Стол {table_id} уже забронирован на {date_str} {time_slot}. Пожалуйста, выберите другое время.")
-                    return
-
-                # Вставка брони
-                duration_hours = int(duration_hours or 1)  # если вдруг None
-                cursor.execute(
-                    """
-                    INSERT INTO bookings (user_id, user_name, phone, table_id, time_slot, guests, booked_at, booking_for, duration_hours)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
-                    """,
-                    (user_id, user_name, phone, table_id, time_slot, guests, datetime.now(tz=local_tz), booking_start, duration_hours)
-                )
-
-                conn.commit()
-
-
-        formatted_date = booking_date.strftime("%d.%m.%Y")
-        bot.send_message(user_id, f"✅ Ваша бронь успешно оформлена!\n\nСтол: {table_id}\nДата: {formatted_date}\nВремя: {time_slot}\nДлительность: {duration_hours} ч.")
-
-        # ===== Уведомление админа =====
-        if ADMIN_ID:
-            user_link = f'<a href="tg://user?id={user_id}">{user_name}</a>' if user_id else user_name
-            admin_message_text = (
-                f"Новая бронь:\n"
-                f"Пользователь: {user_link}\n"
-                f"Стол: {table_id}\n"
-                f"Дата: {formatted_date}\n"
-                f"Время: {time_slot}\n"
-                f"Длительность: {duration_hours} ч.\n"
-                f"Гостей: {guests}\n"
-                f"Телефон: {phone}\n"
-                f"{admin_note}"
-            )
-            bot.send_message(ADMIN_ID, admin_message_text, parse_mode="HTML")
+            text = f"{e} Пожалуйста, выберите другое время."
+            alternatives = suggest_tables(req, limit=3)
+            if alternatives:
+                text += "\n\nСвободно: " + ", ".join(f"{a['time']} (стол {a['table_id']})" for a in alternatives)
+            send_message(user_id, text)
 
     except json.JSONDecodeError as e:
-        print(f"[{datetime.now()}] Ошибка парсинга JSON из WebApp: {e}")
-        bot.send_message(message.from_user.id, "Ошибка в данных от WebApp. Попробуйте снова.")
+        log.warning("Ошибка парсинга JSON из WebApp: %s", e, extra={"user_id": user_id})
+        send_message(user_id, "Ошибка в данных от WebApp. Попробуйте снова.")
     except Exception as e:
-        print(f"[{datetime.now()}] Ошибка обработки WebApp данных: {e}")
-        bot.send_message(message.from_user.id, "Произошла ошибка при бронировании. Пожалуйста, попробуйте позже.")
+        log.exception("Ошибка обработки данных WebApp: %s", e, extra={"user_id": user_id})
+        send_message(user_id, "Произошла ошибка при бронировании. Пожалуйста, попробуйте позже.")
+
+# Кнопки и callback-запросы — одним обработчиком на вид обновления, после команд
+router.install(bot)
 # =========================
 # =========================
 # BOOKING API (обновлённый)
@@ -637,101 +1296,41 @@ def on_webapp_data(message: types.Message):
 def book_api():
     """API для бронирования с выбором длительности (1–3 часа)."""
     try:
-        data = request.json or {}
-        user_id = data.get('user_id') or 0
-        user_name = data.get('user_name') or 'Неизвестный'
-        phone = data.get('phone')
-        guests = data.get('guests')
-        table_id = data.get('table')
-        time_slot = data.get('time')
-        date_str = data.get('date')
-        duration_hours = int(data.get('duration_hours', 1))  # Длительность брони
-
-        # 1. Валидация длительности
-        if duration_hours < 1 or duration_hours > 3:
-            return {"status": "error", "message": "Длительность брони должна быть от 1 до 3 часов."}, 400
-
-        # 2. Валидация полей
-        if not all([guests, table_id, time_slot, date_str]):
-            return {"status": "error", "message": "Не хватает данных для бронирования"}, 400
-
+        # Проверка полей, телефона, длительности и времени (общая с WebApp и asgi.py, см. booking.py)
         try:
-            guests = int(guests)
-            if guests < 1 or guests > 20:
-                return {"status": "error", "message": "Количество гостей должно быть от 1 до 20."}, 400
-        except ValueError:
-             return {"status": "error", "message": "Некорректное значение количества гостей."}, 400
-
-
-        # 3. Обработка времени и часового пояса
-        booking_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        booking_start_naive = datetime.combine(booking_date, datetime.strptime(time_slot, '%H:%M').time())
-        local_tz = tz.gettz("Europe/Moscow")
-        booking_start = booking_start_naive.replace(tzinfo=local_tz)
-        booking_end = booking_start + timedelta(hours=duration_hours)
-        formatted_date = booking_date.strftime("%d.%m.%Y")
+            req = parse_booking_request(request.json)
+        except BookingError as e:
+            return {"status": "error", "message": e.message}, e.status
+        try:
+            book(req)
+        except BookingConflict as e:
+            if req.table_id is None:
+                return {"status": "error", "message": str(e), "alternatives": suggest_tables(req)}, 409
+            return {"status": "error", "message": "Стол уже занят на выбранное время."}, 409
 
-        # 4. Работа с БД (Транзакция для безопасности)
-        with db_connect() as conn:
-            conn.autocommit = False # Отключаем автокоммит для транзакции
-            with conn.cursor() as cursor:
-                
-                # Проверка пересечения с существующими бронями
-                cursor.execute(
-                    """
-                    SELECT booking_for, duration_hours 
-                    FROM bookings 
-                    WHERE table_id = %s AND booking_for::date = %s
-                    FOR UPDATE; -- Используем FOR UPDATE для блокировки
-                    """,
-                    (table_id, booking_date)
-                )
-                existing = cursor.fetchall()
-                conflict = False
-                
-                for b in existing:
-                    # Приводим существующую бронь к локальному времени для сравнения
-                    exist_start = b['booking_for'].astimezone(local_tz) if b['booking_for'].tzinfo else b['booking_for'].replace(tzinfo=local_tz)
-                    exist_end = exist_start + timedelta(hours=b.get('duration_hours', 1))
-                    
-                    # Проверка на конфликт
-                    if booking_start < exist_end and booking_end > exist_start:
-                        conflict = True
-                        break
-                
-                if conflict:
-                    conn.rollback() # Откат транзакции
-                    return {"status": "error", "message": "Стол уже занят на выбранное время."}, 409
-
-                # Вставка брони (если нет конфликта)
-                cursor.execute(
-                    """
-                    INSERT INTO bookings (user_id, user_name, phone, table_id, time_slot, guests, booked_at, booking_for, duration_hours)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
-                    """,
-                    (user_id, user_name, phone, table_id, time_slot, guests, datetime.now(tz=local_tz), booking_start, duration_hours)
-                )
-                
-                conn.commit() # Подтверждение транзакции
+        return {"status": "ok", "message": "Бронь успешно создана"}, 200
 
-        # 5. Уведомление пользователя
-        bot.send_message(user_id,
-                         f"✅ Ваша бронь успешно оформлена!\nСтол: {table_id}\nДата: {formatted_date}\nВремя: {time_slot}\nДлительность: {duration_hours} ч.")
+    except Exception as e:
+        log.exception("Ошибка /book: %s", e)
+        return {"status": "error", "message": str(e)}, 500
 
-        # 6. Уведомление администратора
-        if ADMIN_ID:
-            user_link = f'<a href="tg://user?id={user_id}">{user_name}</a>'
-            bot.send_message(
-                ADMIN_ID,
-                f"Новая бронь:\nПользователь: {user_link}\nСтол: {table_id}\nДата: {formatted_date}\nВремя: {time_slot}\nДлительность: {duration_hours} ч.\nГостей: {guests}\nТелефон: {phone or 'Не указан'}",
-                parse_mode="HTML"
-            )
+@app.route("/book_batch", methods=["POST"])
+def book_batch_api():
+    """Пакетное бронирование (группы, мероприятия): {"bookings": [...]} — все брони одной транзакцией."""
+    try:
+        try:
+            reqs = parse_batch_request(request.json, BOOK_BATCH_MAX)
+        except BookingError as e:
+            return {"status": "error", "message": e.message, "errors": e.details or []}, e.status
+        try:
+            booking_ids = book_many(reqs)
+        except BookingConflict as e:
+            return {"status": "error", "message": f"Пакет не оформлен: {e}"}, 409
 
-        return {"status": "ok", "message": "Бронь успешно создана"}, 200
+        return {"status": "ok", "message": f"Оформлено броней: {len(booking_ids)}", "booking_ids": booking_ids}, 200
 
     except Exception as e:
-        # Убедитесь, что logging импортирован (import logging)
-        logging.error(f"[{datetime.now()}] Ошибка /book: {e}", exc_info=True)
+        log.exception("Ошибка /book_batch: %s", e)
         return {"status": "error", "message": str(e)}, 500
 
 # =========================
@@ -742,71 +1341,251 @@ def get_booked_times():
     try:
         table_id = request.args.get('table')
         date_str = request.args.get('date')
-        duration_hours = int(request.args.get('duration_hours', 1))
+        try:
+            duration_hours = parse_duration_hours(request.args.get('duration_hours', 1))
+        except BookingError as e:
+            return {"status": "error", "message": e.message}, e.status
 
         if not all([table_id, date_str]):
             return {"status": "error", "message": "Не хватает данных (стол или дата)"}, 400
 
-        from pytz import timezone
-        local_tz = timezone("Europe/Moscow")
         query_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        table_id = int(table_id)
 
-        start_time = local_tz.localize(datetime.combine(query_date, datetime.strptime("12:00", "%H:%M").time()))
-        end_time = local_tz.localize(datetime.combine(query_date, datetime.strptime("23:00", "%H:%M").time()))
-        now_ts = datetime.now(local_tz).timestamp() + 1800  # 30 минут буфер
-
-        with db_connect() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT booking_for, duration_hours FROM bookings WHERE table_id=%s AND booking_for::date=%s;",
-                    (table_id, query_date)
-                )
-                bookings = cursor.fetchall()
+        cache = get_availability_cache()
+        key = (table_id, query_date)
+        bookings = cache.get(key)
+        if bookings is MISSING:
+            token = cache.token()
+            with read_connection(table_day_read_key(table_id, query_date)) as conn:
+                with conn.cursor() as cursor:
+                    bookings = fetch_table_day_bookings(cursor, table_id, query_date)
+            cache.set(key, bookings, token=token)
 
-        busy_intervals = []
-        for b in bookings:
-            b_start = b['booking_for'].astimezone(local_tz).timestamp() if b['booking_for'].tzinfo else local_tz.localize(b['booking_for']).timestamp()
-            b_end = b_start + (b.get('duration_hours') or 1) * 3600
-            busy_intervals.append((b_start, b_end))
+        return {"status": "ok", "free_times": availability.free_times(query_date, bookings, duration_hours)}, 200
 
-        all_slots = []
-        slot_time = start_time
-        slot_duration_sec = duration_hours * 3600
+    except Exception as e:
+        log.exception("Ошибка /get_booked_times: %s", e)
+        return {"status": "error", "message": str(e)}, 500
 
-        while slot_time + timedelta(hours=duration_hours) <= end_time:
-            slot_start_ts = slot_time.timestamp()
-            slot_end_ts = slot_start_ts + slot_duration_sec
+# =========================
+# ПОДБОР СТОЛА
+# =========================
+@app.route("/suggest_tables", methods=["GET"])
+def suggest_tables_api():
+    """Лучший свободный стол и ближайшие по времени варианты для компании.
 
-            if slot_start_ts < now_ts:
-                slot_time += timedelta(minutes=30)
-                continue
+    Параметры: date, time, guests, duration_hours, zone (необязательно), limit.
+    Первый вариант со shift_minutes=0 — стол на запрошенное время.
+    """
+    try:
+        try:
+            req = parse_booking_request({**request.args.to_dict(), "table": AUTO_TABLE})
+        except BookingError as e:
+            return {"status": "error", "message": e.message}, e.status
+        try:
+            limit = max(1, min(int(request.args.get('limit', SUGGEST_LIMIT)), 20))
+        except ValueError:
+            return {"status": "error", "message": "Некорректный limit."}, 400
+        alternatives = suggest_tables(req, zone=request.args.get('zone') or None, limit=limit)
+        exact = alternatives[0] if alternatives and alternatives[0]["shift_minutes"] == 0 else None
+        return {"status": "ok", "table": exact, "alternatives": alternatives}, 200
 
-            is_free = all(slot_end_ts <= b_start or slot_start_ts >= b_end for b_start, b_end in busy_intervals)
-            if is_free:
-                all_slots.append(slot_time.strftime("%H:%M"))
+    except Exception as e:
+        log.exception("Ошибка /suggest_tables: %s", e)
+        return {"status": "error", "message": str(e)}, 500
 
-            slot_time += timedelta(minutes=30)
+# =========================
+# СВОДНАЯ ДОСТУПНОСТЬ (все столы за один запрос)
+# =========================
+@app.route("/get_free_times_bulk", methods=["GET"])
+def get_free_times_bulk():
+    """Свободные времена для всех (или перечисленных) столов за диапазон дат — одним запросом к БД.
 
-        return {"status": "ok", "free_times": all_slots}, 200
+    Параметры: date_from, date_to (включительно; вместо пары можно передать date),
+    tables=1,2,3 (необязательно), duration_hours.
+    """
+    try:
+        date_from_str = request.args.get('date_from') or request.args.get('date')
+        date_to_str = request.args.get('date_to') or date_from_str
+        tables_str = request.args.get('tables')
+        try:
+            duration_hours = parse_duration_hours(request.args.get('duration_hours', 1))
+        except BookingError as e:
+            return {"status": "error", "message": e.message}, e.status
+
+        if not date_from_str:
+            return {"status": "error", "message": "Не хватает данных (дата)"}, 400
+
+        date_from = datetime.strptime(date_from_str, '%Y-%m-%d').date()
+        date_to = datetime.strptime(date_to_str, '%Y-%m-%d').date()
+        if date_to < date_from:
+            return {"status": "error", "message": "date_to раньше date_from"}, 400
+        days_count = (date_to - date_from).days + 1
+        if days_count > BULK_MAX_DAYS:
+            return {"status": "error", "message": f"Диапазон не должен превышать {BULK_MAX_DAYS} дн."}, 400
+
+        table_ids = None
+        if tables_str:
+            try:
+                table_ids = sorted({int(t) for t in tables_str.split(",") if t.strip()})
+            except ValueError:
+                return {"status": "error", "message": "Некорректный список столов."}, 400
+
+        days = [date_from + timedelta(days=i) for i in range(days_count)]
+        cache = get_availability_cache()
+
+        # Если все (стол, день) уже в кэше — в БД не идём; иначе один сводный запрос и заполнение кэша
+        bookings_by_table = None
+        known_tables = table_ids if table_ids is not None else cache.get(("tables",))
+        if known_tables is not MISSING:
+            bookings_by_table = {}
+            for table_id in known_tables:
+                per_day = {}
+                for day in days:
+                    day_bookings = cache.get((table_id, day))
+                    if day_bookings is MISSING:
+                        bookings_by_table = None
+                        break
+                    per_day[day] = day_bookings
+                if bookings_by_table is None:
+                    break
+                bookings_by_table[table_id] = per_day
+
+        if bookings_by_table is None:
+            token = cache.token()
+            with db_connection() as conn:
+                with conn.cursor() as cursor:
+                    bookings_by_table = fetch_bookings_by_table_day(cursor, date_from, date_to, table_ids)
+            if table_ids is None:
+                cache.set(("tables",), sorted(bookings_by_table), token=token)
+            for table_id, per_day in bookings_by_table.items():
+                for day in days:
+                    cache.set((table_id, day), per_day.get(day, []), token=token)
+
+        now_ts = time.time()
+        free_times = {}
+        for day in days:
+            per_table = {str(table_id): per_day.get(day, ()) for table_id, per_day in bookings_by_table.items()}
+            free_times[day.isoformat()] = availability.free_times_many(day, per_table, duration_hours, now_ts)
+
+        return {"status": "ok", "free_times": free_times}, 200
 
     except Exception as e:
-        logging.error(f"[{datetime.now()}] Ошибка /get_booked_times: {e}", exc_info=True)
+        log.exception("Ошибка /get_free_times_bulk: %s", e)
         return {"status": "error", "message": str(e)}, 500
 
 
+# =========================
+# ВЫГРУЗКА БРОНЕЙ (CSV / NDJSON)
+# =========================
+@app.route("/export/bookings", methods=["GET"])
+def export_bookings():
+    """Потоковая выгрузка броней. Доступ — по EXPORT_TOKEN (заголовок Authorization: Bearer ... или ?token=).
+
+    Параметры: format=csv|ndjson, date_from, date_to (ГГГГ-ММ-ДД, включительно), tables=1,2,3.
+    """
+    if not EXPORT_TOKEN:
+        return {"status": "error", "message": "Выгрузка выключена (EXPORT_TOKEN не задан)."}, 404
+    auth = request.headers.get("Authorization", "")
+    supplied = auth[7:].strip() if auth.startswith("Bearer ") else request.args.get("token", "")
+    if not hmac.compare_digest(supplied.encode(), EXPORT_TOKEN.encode()):
+        return {"status": "error", "message": "Неверный токен."}, 403
+
+    fmt = (request.args.get("format") or "csv").strip().lower()
+    fmt = "ndjson" if fmt == "json" else fmt
+    if fmt not in EXPORT_FORMATS:
+        return {"status": "error", "message": f"format должен быть одним из {EXPORT_FORMATS}."}, 400
+    try:
+        date_from = datetime.strptime(request.args["date_from"], '%Y-%m-%d').date() if request.args.get("date_from") else None
+        date_to = datetime.strptime(request.args["date_to"], '%Y-%m-%d').date() if request.args.get("date_to") else None
+        table_ids = sorted({int(t) for t in request.args.get("tables", "").split(",") if t.strip()}) or None
+    except ValueError:
+        return {"status": "error", "message": "Некорректные даты или список столов."}, 400
+
+    def generate():
+        # Соединение занято, пока клиент читает ответ; при обрыве генератор закрывается и соединение возвращается в пул
+        with db_connection() as conn:
+            yield from export_chunks(fmt, iter_booking_batches(conn, date_from, date_to, table_ids, EXPORT_BATCH_SIZE))
+
+    filename = export_filename(fmt, date_from, date_to, table_ids)
+    return Response(stream_with_context(generate()), content_type=CONTENT_TYPES[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 # =========================
 # Основные маршруты Flask
 # =========================
 @app.route("/")
 def index():
     """Проверка доступности."""
-    print(f"[{datetime.now()}] Получен GET запрос на /")
+    log.debug("GET /")
     return "Bot is running.", 200
 
+@app.route("/stats")
+def stats():
+    """Внутренняя статистика воркера (пул соединений и т.п.)."""
+    data = {
+        "pid": os.getpid(),
+        "db_pool": get_db_pool().stats(),
+        "availability_cache": availability_cache.stats(),
+        "user_booking_cache": user_booking_cache.stats(),
+        "keyboard_cache": _build_main_reply_kb.cache_info()._asdict(),
+        "menu_photo_cache": menu_photo_cache.stats,
+    }
+    if _pg_listener is not None:
+        data["pg_listener"] = _pg_listener.stats()
+    if _dispatcher is not None and _dispatcher.pid == os.getpid():
+        data["webhook"] = _dispatcher.stats()
+    if _batcher is not None and _batcher.pid == os.getpid():
+        data["webhook_batcher"] = _batcher.stats()
+    if _poller is not None and _poller.pid == os.getpid():
+        data["poller"] = _poller.stats()
+    if _sender is not None and _sender.pid == os.getpid():
+        data["outbound"] = _sender.stats()
+    if _outbox_relay is not None and _outbox_relay.pid == os.getpid():
+        data["outbox"] = _outbox_relay.stats()
+    if _partition_manager is not None and _partition_manager.pid == os.getpid():
+        data["partitions"] = _partition_manager.stats()
+    if _reminders is not None and _reminders.pid == os.getpid():
+        data["reminders"] = _reminders.stats()
+    if _replica_router is not None and _replica_router.pid == os.getpid():
+        data["replicas"] = _replica_router.stats()
+    return jsonify(data), 200
+
+@app.route("/metrics")
+def metrics():
+    """Гистограммы задержек и состояние пулов/очередей воркера в формате Prometheus."""
+    return REGISTRY.render(), 200, {"Content-Type": PROMETHEUS_CONTENT_TYPE}
+
+def _collect_if_started(get_instance):
+    """Статистика фонового объекта, только если он уже создан в этом процессе (не создаём ради /metrics)."""
+    def collect():
+        instance = get_instance()
+        if instance is None or getattr(instance, "pid", os.getpid()) != os.getpid():
+            return {}
+        return instance.stats()
+    return collect
+
+REGISTRY.gauges("process", "Процесс воркера", lambda: {"pid": os.getpid()})
+REGISTRY.gauges("db_pool", "Пул соединений", _collect_if_started(lambda: _db_pool))
+REGISTRY.gauges("availability_cache", "Кэш занятости", availability_cache.stats)
+REGISTRY.gauges("user_booking_cache", "Кэш ближайшей брони пользователя", user_booking_cache.stats)
+REGISTRY.gauges("keyboard_cache", "Кэш клавиатур", lambda: _build_main_reply_kb.cache_info()._asdict())
+REGISTRY.gauges("menu_photo_cache", "Кэш file_id фото меню", lambda: menu_photo_cache.stats)
+REGISTRY.gauges("outbound", "Очередь исходящих сообщений", _collect_if_started(lambda: _sender))
+REGISTRY.gauges("outbox", "Ретранслятор outbox", _collect_if_started(lambda: _outbox_relay))
+REGISTRY.gauges("partitions", "Обслуживание партиций bookings", _collect_if_started(lambda: _partition_manager))
+REGISTRY.gauges("reminders", "Планировщик напоминаний", _collect_if_started(lambda: _reminders))
+REGISTRY.gauges("replicas", "Чтение с реплик", _collect_if_started(lambda: _replica_router))
+REGISTRY.gauges("webhook", "Диспетчер обновлений", _collect_if_started(lambda: _dispatcher))
+REGISTRY.gauges("webhook_batcher", "Приём обновлений вебхука пачками", _collect_if_started(lambda: _batcher))
+REGISTRY.gauges("poller", "Long polling getUpdates", _collect_if_started(lambda: _poller))
+
 @app.route("/set_webhook_manual")
 def set_webhook_manual():
     """Ручная установка вебхука (для инициализации)."""
-    print(f"[{datetime.now()}] Получен GET запрос на /set_webhook_manual")
+    log.debug("GET /set_webhook_manual")
     if not RENDER_EXTERNAL_URL:
         return jsonify({"status": "error", "message": "RENDER_EXTERNAL_URL is not set"}), 500
     if not RENDER_EXTERNAL_URL.startswith("https://"):
@@ -816,38 +1595,106 @@ def set_webhook_manual():
     try:
         # УДАЛЕНИЕ + УСТАНОВКА
         bot.remove_webhook()
-        print(f"[{datetime.now()}] Старый Webhook удален.")
+        log.info("Старый webhook удалён.")
         ok = bot.set_webhook(url=webhook_url)
-        print(f"[{datetime.now()}] Попытка установки Webhook на {webhook_url}; Результат: {ok}")
+        log.info("Установка webhook на %s: %s", webhook_url, ok)
         if ok:
             return jsonify({"status": "ok", "message": f"Webhook set to {webhook_url}"}), 200
         else:
             return jsonify({"status": "error", "message": "Failed to set webhook"}), 500
     except Exception as e:
-        print(f"[{datetime.now()}] Ошибка при установке Webhook вручную: {e}")
+        log.exception("Ошибка при установке webhook вручную: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/webhook", methods=["POST"])
 def webhook():
     """КРИТИЧЕСКИЙ ОБРАБОТЧИК: Принимает данные от Telegram и передает их боту."""
-    print(f"[{datetime.now()}] Получен POST запрос на /webhook")
+    log.debug("POST /webhook")
     if request.headers.get("content-type") == "application/json":
         json_string = request.get_data(as_text=True)
         # !!! КРИТИЧЕСКИ ВАЖНО: Преобразование JSON в объект Update и обработка ботом
         try:
+            started = time.monotonic()
             update = types.Update.de_json(json_string)
+            UPDATE_STAGE_SECONDS.observe(time.monotonic() - started, "webhook", "receive")
+            if WEBHOOK_DISPATCH_MODE != "sync":
+                # Подтверждаем, как только диспетчер принял обновление; обработка идёт в фоновом пуле
+                submit_update(update)
+                return "!", 200
             bot.process_new_updates([update])
-            print(f"[{datetime.now()}] Webhook: Обновление успешно обработано.")
+            log.debug("Webhook: обновление обработано.")
             return "!", 200  # Обязательный ответ 200 OK для Telegram
+        except QueueFull as e:
+            # Очередь переполнена: не-200 заставит Telegram повторить доставку позже
+            log.warning("Webhook: очередь переполнена, обновление отклонено: %s", e)
+            return "Busy", 503
         except Exception as e:
             # Логируем ошибку, но возвращаем 200, чтобы Telegram не пытался слать запрос снова.
-            print(f"[{datetime.now()}] Webhook: ОШИБКА ОБРАБОТКИ ОБНОВЛЕНИЯ: {e}")
+            log.exception("Webhook: ошибка обработки обновления: %s", e)
             return "!", 200
     else:
-        print(f"[{datetime.now()}] Webhook: Получены не-JSON данные. Игнорирую.")
+        log.warning("Webhook: получены не-JSON данные, игнорирую.")
         return "Non-JSON data received", 403
 
 # =========================
 # ЗАПУСК
 # =========================
-# В режиме Render/Gunicorn запуск не требуется (это делает Gunicorn)
\ No newline at end of file
+# Импорт модуля ничего не настраивает и не ходит в сеть: логирование, проверка
+# окружения, адрес Bot API, инструментирование и миграции выполняются в create_app().
+# Под gunicorn с --preload это происходит один раз в мастере, воркеры получают
+# готовое приложение через fork; пулы и фоновые потоки создаются уже в воркерах
+# (поток вывода логов logging_setup перезапускает в каждом воркере сам).
+_started = False
+_started_lock = threading.Lock()
+
+def create_app(migrate=None):
+    """Фабрика для gunicorn ('lis:create_app()'): однократная инициализация процесса, возвращает app."""
+    global _started
+    with _started_lock:
+        if _started:
+            return app
+        setup_logging(LOG_LEVEL, LOG_FORMAT)
+        check_env()
+        if TELEGRAM_API_URL:
+            apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+        instrument_telegram_api()
+        # Замер времени обработчиков — все они уже зарегистрированы при импорте
+        instrument_bot_handlers(bot)
+        instrument_router(router)
+        if MIGRATE_ON_START if migrate is None else migrate:
+            init_db()
+        _started = True
+    return app
+
+_poller = None
+
+def run_polling():
+    """Локальный / staging-запуск без вебхука: getUpdates в фоне, HTTP API (/book и т.д.) — встроенный сервер Flask.
+
+    Telegram не отдаёт getUpdates, пока установлен вебхук, поэтому он снимается.
+    """
+    global _poller
+    create_app()
+    bot.remove_webhook()
+    log.info("Webhook снят, приём обновлений через getUpdates.")
+    # Фоновые задачи, которые под gunicorn стартуют с первым HTTP-запросом
+    get_outbox_relay()
+    if BOOKINGS_STORAGE == "partitioned":
+        get_partition_manager()
+    if REMINDER_LEAD_MIN > 0:
+        get_reminder_scheduler()
+    _poller = UpdatePoller(bot, get_dispatcher(), limit=POLL_LIMIT, poll_timeout=POLL_TIMEOUT).start()
+    # Опрос останавливаем до диспетчера: atexit выполняет зарегистрированное позже раньше
+    atexit.register(_poller.shutdown)
+    app.run(host="0.0.0.0", port=PORT, threaded=True)
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        # Отдельный шаг деплоя: только миграции, без запуска сервера
+        setup_logging(LOG_LEVEL, LOG_FORMAT)
+        check_env()
+        init_db(strict=True)
+    elif sys.argv[1:] == ["poll"]:
+        run_polling()
+    else:
+        create_app().run(host="0.0.0.0", port=PORT)
@@ -0,0 +1,103 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+# =========================
+# СТРУКТУРИРОВАННОЕ ЛОГИРОВАНИЕ
+# =========================
+# Обработчики пишут не в stdout, а в очередь (QueueHandler): запись лога в
+# потоке запроса — это только создание LogRecord и put в очередь. Форматирование
+# и вывод делает отдельный поток QueueListener.
+#
+# Уровень задаётся LOG_LEVEL: записи ниже уровня отсекаются до создания LogRecord,
+# поэтому подробные debug-сообщения в обработчиках в проде почти ничего не стоят.
+# Формат — JSON-строка на запись (LOG_FORMAT=json) или обычный текст (LOG_FORMAT=text).
+
+# Атрибуты LogRecord, которые есть всегда: всё остальное пришло через extra={...}
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка: время, уровень, логгер, сообщение и поля из extra."""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+_listener = None
+_settings = None
+
+
+def setup_logging(level="INFO", fmt="json", queue_size=10000):
+    """Настраивает корневой логгер: QueueHandler -> фоновый QueueListener -> stdout.
+
+    Повторный вызов заменяет прежнюю настройку. После fork (gunicorn --preload)
+    настройка повторяется в дочернем процессе автоматически, см. _restart_after_fork.
+    """
+    global _listener, _settings
+    if _listener is not None:
+        _listener.stop()
+    _settings = (level, fmt, queue_size)
+
+    stream = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    # Переполненная очередь не должна блокировать обработчики: лишние записи теряются
+    log_queue = queue.Queue(queue_size)
+    queue_handler = _DroppingQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def _restart_after_fork():
+    """Поток QueueListener не переживает fork: без своего потока воркер писал бы в очередь, которую никто не читает."""
+    global _listener
+    if _listener is not None:
+        # Потока родителя в дочернем процессе нет — останавливать нечего, просто настраиваем заново
+        _listener = None
+        setup_logging(*_settings)
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+@atexit.register
+def _flush_logs():
+    """При выходе дописываем всё, что осталось в очереди."""
+    if _listener is not None:
+        _listener.stop()
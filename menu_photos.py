@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+
+import requests
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+log = logging.getLogger("lis.menu_photos")
+
+# =========================
+# КЭШ file_id ДЛЯ ФОТО МЕНЮ
+# =========================
+# После первой успешной отправки фото по URL Telegram возвращает file_id —
+# повторная отправка по нему не требует скачивания картинки с GitHub.
+# Соответствие URL -> file_id хранится в таблице menu_photo_cache и в памяти.
+# Изменение картинки отслеживается по ETag/Last-Modified (HEAD-запрос в фоне).
+
+MEDIA_GROUP_LIMIT = 10
+
+# Описания ошибок 400, которыми Telegram отвечает на устаревший или чужой file_id
+# ("wrong file identifier/HTTP URL specified", "wrong remote file identifier specified", "invalid file_id")
+BAD_FILE_ID_MARKERS = ("file identifier", "file_id")
+
+
+def is_bad_file_id(exc):
+    """True, если Telegram отклонил запрос из-за неверного file_id (а не по другой причине)."""
+    if not isinstance(exc, ApiTelegramException) or exc.error_code != 400:
+        return False
+    description = (exc.description or "").lower()
+    return any(marker in description for marker in BAD_FILE_ID_MARKERS)
+
+MENU_PHOTO_CACHE_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS menu_photo_cache (
+        url TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        checked_at TIMESTAMP WITH TIME ZONE,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+class MenuPhotoCache:
+    """URL фото -> file_id с сохранением в Postgres.
+
+    db_connection — фабрика контекстных менеджеров соединений (как lis.db_connection),
+    revalidate_after — через сколько секунд проверять, не изменилась ли картинка по URL.
+    """
+
+    def __init__(self, bot, db_connection, revalidate_after=6 * 3600, http_timeout=5.0):
+        self.bot = bot
+        self.db_connection = db_connection
+        self.revalidate_after = revalidate_after
+        self.http_timeout = http_timeout
+        self._entries = None  # url -> {"file_id", "etag", "last_modified", "checked_at"}
+        self._lock = threading.Lock()
+        self._revalidating = set()
+        self.stats = {"hits": 0, "misses": 0, "uploads": 0, "changed": 0, "stale_file_ids": 0}
+
+    # ---------- хранилище ----------
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        with self._lock:
+            if self._entries is None:
+                entries = {}
+                try:
+                    with self.db_connection() as conn:
+                        with conn.cursor() as cur:
+                            cur.execute("SELECT url, file_id, etag, last_modified, checked_at FROM menu_photo_cache;")
+                            for row in cur.fetchall():
+                                entries[row['url']] = {
+                                    "file_id": row['file_id'],
+                                    "etag": row['etag'],
+                                    "last_modified": row['last_modified'],
+                                    "checked_at": row['checked_at'].timestamp() if row['checked_at'] else 0.0,
+                                }
+                except Exception as e:
+                    log.error("Не удалось загрузить кэш фото меню: %s", e)
+                self._entries = entries
+        return self._entries
+
+    def _save(self, url, entry):
+        try:
+            with self.db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO menu_photo_cache (url, file_id, etag, last_modified, checked_at, updated_at)
+                        VALUES (%s, %s, %s, %s, to_timestamp(%s), CURRENT_TIMESTAMP)
+                        ON CONFLICT (url) DO UPDATE SET
+                            file_id = EXCLUDED.file_id,
+                            etag = EXCLUDED.etag,
+                            last_modified = EXCLUDED.last_modified,
+                            checked_at = EXCLUDED.checked_at,
+                            updated_at = CURRENT_TIMESTAMP;
+                    """, (url, entry["file_id"], entry["etag"], entry["last_modified"], entry["checked_at"]))
+        except Exception as e:
+            log.error("Не удалось сохранить file_id для %s: %s", url, e)
+
+    def _delete(self, url):
+        try:
+            with self.db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM menu_photo_cache WHERE url = %s;", (url,))
+        except Exception as e:
+            log.error("Не удалось удалить file_id для %s: %s", url, e)
+
+    def remember(self, url, file_id, etag=None, last_modified=None, checked_at=0.0):
+        entry = {"file_id": file_id, "etag": etag, "last_modified": last_modified, "checked_at": checked_at}
+        self._load()[url] = entry
+        self._save(url, entry)
+
+    def forget(self, url):
+        if self._load().pop(url, None) is not None:
+            self._delete(url)
+
+    # ---------- проверка изменения картинки ----------
+    def revalidate(self, url):
+        """HEAD-запрос к URL: если ETag/Last-Modified изменились — file_id сбрасывается."""
+        entry = self._load().get(url)
+        if entry is None:
+            return
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            resp = requests.head(url, headers=headers, timeout=self.http_timeout, allow_redirects=True)
+        except requests.RequestException as e:
+            log.warning("Не удалось проверить фото меню %s: %s", url, e)
+            return
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        known = entry["etag"] or entry["last_modified"]
+        changed = resp.status_code == 200 and known and (
+            (etag and etag != entry["etag"]) or (not etag and last_modified and last_modified != entry["last_modified"])
+        )
+        if changed:
+            self.stats["changed"] += 1
+            log.info("Фото меню изменилось, file_id сброшен: %s", url)
+            self.forget(url)
+        elif resp.status_code in (200, 304):
+            self.remember(url, entry["file_id"], etag or entry["etag"], last_modified or entry["last_modified"], time.time())
+
+    def _revalidate_in_background(self, url):
+        with self._lock:
+            if url in self._revalidating:
+                return
+            self._revalidating.add(url)
+
+        def run():
+            try:
+                self.revalidate(url)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(url)
+
+        threading.Thread(target=run, name="menu-photo-revalidate", daemon=True).start()
+
+    def media_for(self, url):
+        """file_id, если он известен (и в фоне запускает проверку устаревших), иначе сам URL."""
+        entry = self._load().get(url)
+        if entry is None:
+            self.stats["misses"] += 1
+            return url
+        self.stats["hits"] += 1
+        if self.revalidate_after and time.time() - entry["checked_at"] > self.revalidate_after:
+            self._revalidate_in_background(url)
+        return entry["file_id"]
+
+    # ---------- отправка ----------
+    def _send(self, chat_id, urls, caption=None):
+        messages = []
+        # В одном альбоме Telegram допускает не больше MEDIA_GROUP_LIMIT фото
+        for start in range(0, len(urls), MEDIA_GROUP_LIMIT):
+            chunk = urls[start:start + MEDIA_GROUP_LIMIT]
+            chunk_caption = caption if start == 0 else None
+            media = [self.media_for(url) for url in chunk]
+            if len(chunk) == 1:
+                sent_messages = [self.bot.send_photo(chat_id, media[0], caption=chunk_caption)]
+            else:
+                group = [types.InputMediaPhoto(m, caption=chunk_caption if i == 0 else None) for i, m in enumerate(media)]
+                sent_messages = self.bot.send_media_group(chat_id, group)
+            for url, sent, msg in zip(chunk, media, sent_messages):
+                if sent == url and msg.photo:
+                    self.stats["uploads"] += 1
+                    self.remember(url, msg.photo[-1].file_id)
+            messages.extend(sent_messages)
+        return messages
+
+    def send(self, chat_id, urls, caption=None):
+        """Отправляет фото одним сообщением (send_photo) или альбомом (send_media_group)."""
+        urls = list(urls)
+        try:
+            return self._send(chat_id, urls, caption)
+        except ApiTelegramException as e:
+            # Остальные ошибки (лимит 429, заблокированный чат, сеть) — решает вызывающий
+            if not is_bad_file_id(e):
+                raise
+            # Устаревший/чужой file_id (например, сменили токен бота) — сбрасываем и шлём по URL
+            stale = [url for url in urls if url in self._load()]
+            if not stale:
+                raise
+            self.stats["stale_file_ids"] += len(stale)
+            for url in stale:
+                self.forget(url)
+            return self._send(chat_id, urls, caption)
+
+    def warm_up(self, chat_id, photos_by_category):
+        """Проверяет все URL и загружает в Telegram те, для которых нет file_id. Возвращает число загрузок."""
+        uploads_before = self.stats["uploads"]
+        for category, urls in photos_by_category.items():
+            for url in urls:
+                self.revalidate(url)
+            if urls and any(url not in self._load() for url in urls):
+                self.send(chat_id, urls, caption=category)
+        return self.stats["uploads"] - uploads_before
@@ -0,0 +1,267 @@
+import bisect
+import functools
+import threading
+import time
+
+from flask import g, request
+
+# =========================
+# МЕТРИКИ (ГИСТОГРАММЫ В ПАМЯТИ ПРОЦЕССА)
+# =========================
+# Гистограммы задержек копятся в памяти воркера и отдаются в текстовом формате
+# Prometheus. observe() — это bisect по границам бакетов и несколько сложений
+# под локом, без аллокаций на горячем пути.
+#
+# Каждый воркер gunicorn считает своё: /metrics отдаёт счётчики того воркера,
+# который обработал запрос (gauge process_pid позволяет различать их при сборе).
+
+# Границы бакетов в секундах: от 1 мс до 10 с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Гистограмма Prometheus с фиксированными бакетами и набором меток."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # значения меток -> [counts по бакетам..., +Inf], sum
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labelvalues):
+        """Контекстный менеджер: замеряет длительность блока."""
+        return _Timer(self, labelvalues)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, (('le', le),))} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {total}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labelvalues", "start")
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+
+class GaugeCollector:
+    """Набор gauge-метрик, значения которых снимаются функцией в момент выдачи /metrics.
+
+    collect() возвращает {имя_метрики: значение} (как stats() пула, кэша и очередей).
+    """
+
+    def __init__(self, prefix, documentation, collect):
+        self.prefix = prefix
+        self.documentation = documentation
+        self.collect = collect
+
+    def render(self):
+        try:
+            values = self.collect()
+        except Exception:
+            return []
+        lines = []
+        for key, value in sorted((values or {}).items()):
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{key}"
+            lines.append(f"# HELP {name} {self.documentation}: {key}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauges(self, prefix, documentation, collect):
+        return self.register(GaugeCollector(prefix, documentation, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса Flask", ("route", "method", "status"))
+BOT_HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика telebot", ("handler", "outcome"))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_duration_seconds", "Время выполнения SQL-запроса", ("operation",))
+TELEGRAM_API_SECONDS = REGISTRY.histogram(
+    "telegram_api_duration_seconds", "Время вызова Telegram Bot API", ("method", "status"))
+# Этапы пути обновления: receive/fetch -> batch_wait -> enqueue (источник) -> queue_wait -> handle (диспетчер)
+UPDATE_STAGE_SECONDS = REGISTRY.histogram(
+    "update_stage_duration_seconds", "Время этапа приёма и обработки обновлений Telegram", ("source", "stage"))
+UPDATE_BATCH_SIZE = REGISTRY.histogram(
+    "update_batch_size", "Число обновлений в пачке", ("stage",), buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+
+# ---------- Flask ----------
+def instrument_flask(app, histogram=HTTP_REQUEST_SECONDS):
+    """Замеряет каждый запрос; метка route — шаблон маршрута, а не конкретный URL."""
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            histogram.observe(time.perf_counter() - start, route, request.method, str(response.status_code))
+        return response
+
+    return app
+
+
+# ---------- telebot ----------
+HANDLER_LISTS = ("message_handlers", "callback_query_handlers", "edited_message_handlers", "inline_handlers")
+
+
+def instrument_bot_handlers(bot, histogram=BOT_HANDLER_SECONDS):
+    """Оборачивает уже зарегистрированные обработчики telebot в замер времени.
+
+    Вызывать после объявления всех обработчиков; повторный вызов ничего не меняет.
+    """
+    for attr in HANDLER_LISTS:
+        for handler in getattr(bot, attr, None) or ():
+            function = handler["function"]
+            if getattr(function, "_metrics_wrapped", False):
+                continue
+            handler["function"] = _timed_handler(function, histogram)
+
+
+def instrument_router(router, histogram=BOT_HANDLER_SECONDS):
+    """То же для обработчиков из таблицы routing.Router."""
+    router.wrap(lambda function: function if getattr(function, "_metrics_wrapped", False)
+                else _timed_handler(function, histogram))
+
+
+def _timed_handler(function, histogram):
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = function(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            histogram.observe(time.perf_counter() - start, name, outcome)
+
+    wrapper._metrics_wrapped = True
+    return wrapper
+
+
+# ---------- psycopg2 ----------
+def timed_cursor_factory(base, histogram=DB_QUERY_SECONDS):
+    """Подкласс курсора (например, RealDictCursor), замеряющий execute/executemany.
+
+    Метка operation — первое слово запроса (SELECT, INSERT, ...), чтобы число серий было ограничено.
+    """
+
+    class TimedCursor(base):
+        def execute(self, query, vars=None):
+            start = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                histogram.observe(time.perf_counter() - start, _operation(query))
+
+        def executemany(self, query, vars_list):
+            start = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                histogram.observe(time.perf_counter() - start, _operation(query))
+
+    TimedCursor.__name__ = f"Timed{base.__name__}"
+    return TimedCursor
+
+
+def _operation(query):
+    if isinstance(query, bytes):
+        query = query[:32].decode("ascii", "ignore")
+    elif not isinstance(query, str):
+        return "OTHER"
+    head = query.lstrip()[:16].split(None, 1)
+    return head[0].upper().rstrip(";") if head else "OTHER"
+
+
+# ---------- Telegram Bot API ----------
+def instrument_telegram_api(histogram=TELEGRAM_API_SECONDS):
+    """Замеряет все HTTP-вызовы telebot через штатную точку расширения apihelper.CUSTOM_REQUEST_SENDER."""
+    from telebot import apihelper
+
+    def send(method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = apihelper._get_req_session().request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            histogram.observe(time.perf_counter() - start, api_method, status)
+
+    apihelper.CUSTOM_REQUEST_SENDER = send
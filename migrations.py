@@ -0,0 +1,149 @@
+import logging
+from collections import namedtuple
+
+import psycopg2
+
+from menu_photos import MENU_PHOTO_CACHE_SCHEMA_SQL
+from outbox import OUTBOX_SCHEMA_SQL
+from partitions import BOOKINGS_PARTITION_SQL
+from queries import EXCLUSION_SCHEMA_SQL
+from reminders import REMINDER_SCHEMA_SQL
+
+log = logging.getLogger("lis.migrations")
+
+# =========================
+# МИГРАЦИИ СХЕМЫ
+# =========================
+# Схема меняется пронумерованными миграциями; применённые версии хранятся в
+# schema_version. При старте процесса достаточно одного SELECT: если все нужные
+# версии уже есть, никакого DDL не выполняется. Иначе миграции применяются в
+# одной транзакции под pg_advisory_xact_lock — несколько воркеров или инстансов,
+# стартующих одновременно, применят их ровно один раз.
+#
+# Все операторы написаны идемпотентно (IF NOT EXISTS): базы, созданные прежним
+# init_db(), получают те же версии без ошибок.
+#
+# feature — миграция нужна только в определённом режиме (например, exclusion
+# constraint при BOOKING_CONFLICT_MODE=exclusion); без feature применяется всегда.
+
+Migration = namedtuple("Migration", ("version", "name", "statements", "feature"), defaults=(None,))
+
+# Произвольная константа: ключ advisory lock миграций (общий для всех процессов приложения)
+MIGRATION_LOCK_KEY = 7_305_418_022_114
+
+SCHEMA_VERSION_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+TARGET_TABLE_COUNT = 20
+
+MIGRATIONS = (
+    Migration(1, "bookings", (
+        """
+        CREATE TABLE IF NOT EXISTS tables (
+            id INT PRIMARY KEY
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bookings (
+            booking_id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            user_name VARCHAR(255),
+            phone TEXT,
+            guests INT,
+            table_id INT NOT NULL,
+            time_slot TEXT NOT NULL,
+            booked_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            booking_for TIMESTAMP WITH TIME ZONE
+        );
+        """,
+        # Таблицы, созданные ранними версиями без этих столбцов
+        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS duration_hours INT DEFAULT 1;",
+        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS user_id BIGINT;",
+        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS user_name TEXT;",
+        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS phone TEXT;",
+        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS guests INT;",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_conflict ON bookings (table_id, booking_for);",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_user_active ON bookings (user_id, booking_for DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_future_time ON bookings (booking_for);",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_booked_at ON bookings (booked_at DESC);",
+    )),
+    Migration(2, "tables_seed", (
+        f"INSERT INTO tables (id) SELECT generate_series(1, {TARGET_TABLE_COUNT}) ON CONFLICT (id) DO NOTHING;",
+    )),
+    Migration(3, "menu_photo_cache", (MENU_PHOTO_CACHE_SCHEMA_SQL,)),
+    # Keyset-пагинация админ-панели по (booking_for, booking_id)
+    Migration(4, "bookings_keyset_index", (
+        "CREATE INDEX IF NOT EXISTS idx_bookings_keyset ON bookings (booking_for, booking_id);",
+    )),
+    Migration(5, "outbox", OUTBOX_SCHEMA_SQL),
+    # tstzrange + exclusion constraint: пересекающиеся брони отклоняет сам Postgres
+    Migration(6, "bookings_exclusion", EXCLUSION_SCHEMA_SQL, feature="exclusion"),
+    # Помесячные партиции bookings (BOOKINGS_STORAGE=partitioned), см. partitions.py
+    Migration(7, "bookings_partitioned", BOOKINGS_PARTITION_SQL, feature="partitioned"),
+    # Отметка отправленного напоминания и индекс ещё не напомненных броней, см. reminders.py
+    Migration(8, "booking_reminders", REMINDER_SCHEMA_SQL),
+    # Вместимость и зона стола для автоподбора (allocation.py); реальные значения задаются UPDATE tables
+    Migration(9, "tables_capacity_zone", (
+        "ALTER TABLE tables ADD COLUMN IF NOT EXISTS capacity INTEGER NOT NULL DEFAULT 4 CHECK (capacity > 0);",
+        "ALTER TABLE tables ADD COLUMN IF NOT EXISTS zone TEXT NOT NULL DEFAULT 'hall';",
+    )),
+)
+
+
+def required_migrations(features=(), migrations=MIGRATIONS):
+    """Миграции, нужные при данном наборе включённых feature, по возрастанию версии."""
+    return sorted((m for m in migrations if m.feature is None or m.feature in features), key=lambda m: m.version)
+
+
+def applied_versions(cur):
+    """Множество применённых версий; пустое, если schema_version ещё нет."""
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return set()
+    cur.execute("SELECT version FROM schema_version;")
+    return {row[0] for row in cur.fetchall()}
+
+
+def run_migrations(dsn, features=(), migrations=MIGRATIONS, lock_key=MIGRATION_LOCK_KEY, connect_timeout=10):
+    """Применяет недостающие миграции; возвращает список применённых версий.
+
+    Работает на отдельном коротком соединении (не из пула): его можно вызвать в
+    мастер-процессе gunicorn до fork, не оставляя воркерам открытых сокетов.
+    """
+    required = required_migrations(features, migrations)
+    conn = psycopg2.connect(dsn, connect_timeout=connect_timeout)
+    try:
+        with conn.cursor() as cur:
+            if not {m.version for m in required} - applied_versions(cur):
+                conn.rollback()
+                log.info("Схема БД актуальна", extra={"schema_version": max((m.version for m in required), default=0)})
+                return []
+
+            # Кто-то мог применить миграции, пока мы ждали lock, поэтому версии перечитываем
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (lock_key,))
+            cur.execute(SCHEMA_VERSION_SQL)
+            done = applied_versions(cur)
+            applied = []
+            for migration in required:
+                if migration.version in done:
+                    continue
+                for statement in migration.statements:
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_version (version, name) VALUES (%s, %s);",
+                    (migration.version, migration.name),
+                )
+                applied.append(migration.version)
+                log.info("Миграция применена", extra={"version": migration.version, "migration": migration.name})
+        conn.commit()
+        return applied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
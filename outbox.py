@@ -0,0 +1,255 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger("lis.outbox")
+
+# =========================
+# TRANSACTIONAL OUTBOX ДЛЯ УВЕДОМЛЕНИЙ
+# =========================
+# Уведомления о брони пишутся в таблицу outbox той же транзакцией, что и
+# INSERT/DELETE брони: либо есть и бронь, и уведомление, либо ничего.
+# Запрос отвечает сразу после COMMIT, а фоновый ретранслятор забирает строки
+# пачками и передаёт их в очередь отправки.
+#
+# Доставка "хотя бы один раз": строка арендуется (available_at сдвигается на
+# lease секунд вперёд) и помечается sent_at только после ответа Telegram.
+# Если процесс упал между отправкой и отметкой, после аренды строку заберёт
+# любой воркер и сообщение уйдёт повторно.
+#
+# Пока строка ждёт в очереди отправки (ограничение скорости, повторы на 429),
+# ретранслятор раз в lease / 3 продлевает её аренду и сам не забирает её
+# повторно: аренда истекает, только если процесс, взявший строку, умер.
+
+OUTBOX_SCHEMA_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT NOT NULL,
+        kind TEXT NOT NULL DEFAULT 'message',
+        text TEXT NOT NULL,
+        parse_mode TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP WITH TIME ZONE,
+        failed_at TIMESTAMP WITH TIME ZONE,
+        last_error TEXT
+    );
+    """,
+    # Очередь к отправке — только неотправленные строки, индекс остаётся маленьким
+    """
+    CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (available_at, id)
+    WHERE sent_at IS NULL AND failed_at IS NULL;
+    """,
+)
+
+OUTBOX_KINDS = ("message", "admin")
+ENQUEUE_SQL = "INSERT INTO outbox (chat_id, kind, text, parse_mode) VALUES (%s, %s, %s, %s);"
+PERMANENT_ERROR_CODES = (400, 403)
+
+
+def enqueue_message(cur, chat_id, text, parse_mode=None, kind="message"):
+    """Кладёт уведомление в outbox в рамках текущей транзакции (уйдёт после COMMIT).
+
+    kind="admin" — уведомление админу: при отправке может быть склеено в дайджест.
+    """
+    if kind not in OUTBOX_KINDS:
+        raise ValueError(f"Неизвестный тип уведомления: {kind}")
+    cur.execute(ENQUEUE_SQL, (chat_id, kind, text, parse_mode))
+
+
+class OutboxRelay:
+    """Фоновый поток: outbox -> deliver(row) -> отметка sent_at.
+
+    deliver(row) возвращает Future, который завершается после ответа Telegram.
+    batch_size — сколько строк забирать за раз, lease — на сколько секунд строка
+    скрывается от других воркеров, max_attempts — после скольких неудач строка
+    помечается failed_at и больше не отправляется.
+    """
+
+    def __init__(self, db_connection, deliver, batch_size=50, poll_interval=1.0, lease=60.0,
+                 max_attempts=10, retry_base=5.0, retention_days=7, name="outbox"):
+        self.db_connection = db_connection
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retention_days = retention_days
+        self.name = name
+        self.pid = os.getpid()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._done = deque()   # (id, attempts, exception | None) от callback'ов отправки
+        self._inflight = set()  # id строк, переданных в отправку и ещё не завершённых
+        self._thread = None
+        self._cleaned_at = 0.0
+        self._extended_at = time.monotonic()
+        self._stats = {"claimed": 0, "sent": 0, "retried": 0, "failed": 0, "batches": 0, "errors": 0,
+                       "lease_extended": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-relay", daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """Разбудить ретранслятор после COMMIT, не дожидаясь poll_interval."""
+        self._wake.set()
+
+    # ---------- основной цикл ----------
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self._flush_done()
+                self._extend_leases()
+                claimed = 0
+                if len(self._inflight) < self.batch_size * 4:
+                    claimed = self._claim_and_deliver()
+                self._cleanup()
+            except Exception as e:
+                self._incr("errors")
+                log.error("%s: ошибка ретранслятора: %s", self.name, e, exc_info=True)
+                claimed = 0
+            # Полная пачка — вероятно, есть ещё: забираем следующую без ожидания
+            if claimed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+
+    def _claim(self, limit):
+        with self._lock:
+            own = list(self._inflight)
+        with self.db_connection() as conn:
+            with conn.cursor() as cur:
+                # Свои строки, ещё ждущие отправки, не забираем повторно, даже если аренда истекла
+                cur.execute("""
+                    UPDATE outbox SET available_at = NOW() + make_interval(secs => %s), attempts = attempts + 1
+                    WHERE id IN (
+                        SELECT id FROM outbox
+                        WHERE sent_at IS NULL AND failed_at IS NULL AND available_at <= NOW()
+                          AND NOT (id = ANY(%s::bigint[]))
+                        ORDER BY id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, chat_id, kind, text, parse_mode, attempts;
+                """, (self.lease, own, limit))
+                rows = cur.fetchall()
+        # Порядок id = порядок записи; очередь отправки сохраняет его внутри чата
+        rows.sort(key=lambda r: r['id'])
+        return rows
+
+    def _claim_and_deliver(self):
+        rows = self._claim(self.batch_size)
+        if not rows:
+            return 0
+        self._incr("batches")
+        with self._lock:
+            self._stats["claimed"] += len(rows)
+            self._inflight.update(row['id'] for row in rows)
+        for row in rows:
+            try:
+                future = self.deliver(row)
+            except Exception as e:
+                self._complete(row['id'], row['attempts'], e)
+                continue
+            future.add_done_callback(
+                lambda f, row_id=row['id'], attempts=row['attempts']: self._complete(row_id, attempts, f.exception())
+            )
+        return len(rows)
+
+    def _complete(self, row_id, attempts, exc):
+        with self._lock:
+            self._done.append((row_id, attempts, exc))
+            self._inflight.discard(row_id)
+        self._wake.set()
+
+    def _flush_done(self):
+        with self._lock:
+            done, self._done = list(self._done), deque()
+        if not done:
+            return
+        sent = [row_id for row_id, _, exc in done if exc is None]
+        failed = [(row_id, attempts, exc) for row_id, attempts, exc in done if exc is not None]
+        with self.db_connection() as conn:
+            with conn.cursor() as cur:
+                if sent:
+                    cur.execute("UPDATE outbox SET sent_at = NOW(), last_error = NULL WHERE id = ANY(%s);", (sent,))
+                for row_id, attempts, exc in failed:
+                    give_up = self._give_up(attempts, exc)
+                    cur.execute("""
+                        UPDATE outbox
+                        SET last_error = %s,
+                            available_at = NOW() + make_interval(secs => %s),
+                            failed_at = CASE WHEN %s THEN NOW() END
+                        WHERE id = %s;
+                    """, (str(exc)[:1000], self.retry_base * (2 ** (attempts - 1)), give_up, row_id))
+                    if give_up:
+                        log.error("%s: уведомление #%s не доставлено после %s попыток: %s", self.name, row_id, attempts, exc)
+        with self._lock:
+            self._stats["sent"] += len(sent)
+            for _, attempts, exc in failed:
+                self._stats["failed" if self._give_up(attempts, exc) else "retried"] += 1
+
+    def _extend_leases(self):
+        """Раз в lease / 3 продлевает аренду строк, которые ещё ждут в очереди отправки."""
+        now = time.monotonic()
+        if now - self._extended_at < self.lease / 3:
+            return
+        self._extended_at = now
+        with self._lock:
+            ids = list(self._inflight)
+        if not ids:
+            return
+        with self.db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE outbox SET available_at = NOW() + make_interval(secs => %s)
+                    WHERE id = ANY(%s) AND sent_at IS NULL AND failed_at IS NULL;
+                """, (self.lease, ids))
+        with self._lock:
+            self._stats["lease_extended"] += len(ids)
+
+    def _give_up(self, attempts, exc):
+        # 400/403 (чат не найден, бот заблокирован) повтором не исправить
+        return attempts >= self.max_attempts or getattr(exc, "error_code", None) in PERMANENT_ERROR_CODES
+
+    def _cleanup(self):
+        """Раз в час удаляет давно отправленные строки."""
+        now = time.monotonic()
+        if not self.retention_days or now - self._cleaned_at < 3600:
+            return
+        self._cleaned_at = now
+        with self.db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM outbox WHERE sent_at < NOW() - make_interval(days => %s);", (self.retention_days,))
+
+    # ---------- остановка и статистика ----------
+    def shutdown(self, timeout=10.0):
+        """Перестаёт забирать новые строки и отмечает те, что успели отправиться."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while self._inflight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        try:
+            self._flush_done()
+        except Exception as e:
+            log.error("%s: не удалось отметить отправленные уведомления: %s", self.name, e)
+
+    def _incr(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({"inflight": len(self._inflight), "alive": bool(self._thread and self._thread.is_alive())})
+        return snapshot
@@ -0,0 +1,307 @@
+import logging
+import os
+import re
+import threading
+from datetime import date
+
+from psycopg2 import sql
+
+from clock import RESTAURANT_TZ_NAME, now_local, utc_now
+from reminders import REMINDER_INDEX_SQL
+
+log = logging.getLogger("lis.partitions")
+
+# =========================
+# ПАРТИЦИОНИРОВАНИЕ BOOKINGS ПО МЕСЯЦАМ
+# =========================
+# В режиме BOOKINGS_STORAGE=partitioned таблица bookings разбита по месяцам
+# booking_for (границы — полночь первого числа по времени ресторана). Горячие
+# запросы (booking_for > NOW(), стол за день) отсекают прошлые партиции ещё до
+# выполнения и работают с индексами одного-двух месяцев, а не всей истории.
+#
+# Фоновый PartitionManager раз в interval секунд:
+#   - создаёт партиции на текущий и premake_months следующих месяцев, перенося
+#     в них брони этих месяцев из DEFAULT-партиции bookings_default (туда
+#     попадают брони на месяцы, для которых партиции ещё нет);
+#   - удаляет индекс "моих броней" (user_id, booking_for) у закончившихся
+#     месяцев: запросы по пользователю смотрят только будущие брони, поэтому
+#     этот индекс есть лишь у текущей и будущих партиций — по сути частичный
+#     индекс по будущим броням, который не растёт с историей;
+#   - отсоединяет партиции старше retain_months месяцев и переносит их в схему
+#     bookings_archive (данные остаются в базе, но не в горячей таблице).
+#
+# Несколько воркеров могут вызывать обслуживание одновременно: работает тот,
+# кто взял pg_try_advisory_xact_lock, остальные пропускают цикл.
+
+STORAGE_MODES = ("plain", "partitioned")
+ARCHIVE_SCHEMA = "bookings_archive"
+
+# Произвольная константа: ключ advisory lock обслуживания партиций
+PARTITION_LOCK_KEY = 7_305_418_022_118
+
+# Создаёт (если нет) партицию parent за месяц month; у партиций, где ещё могут
+# быть будущие брони, — индекс (user_id, booking_for). Возвращает имя партиции.
+#
+# Брони на месяцы без своей партиции (дальше premake_months) попадают в
+# DEFAULT-партицию <parent>_default. Партицию месяца, строки которого уже лежат
+# в DEFAULT, нельзя создать через PARTITION OF, поэтому она создаётся отдельной
+# таблицей, строки месяца переносятся в неё из DEFAULT, и она присоединяется.
+PARTITION_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION ensure_month_partition(parent TEXT, month DATE)
+    RETURNS TEXT LANGUAGE plpgsql AS $$
+    DECLARE
+        part TEXT := format('%s_p%s', parent, to_char(month, 'YYYYMM'));
+        deflt TEXT := format('%s_default', parent);
+        cols TEXT;
+        lo TIMESTAMP WITH TIME ZONE := date_trunc('month', month::timestamp) AT TIME ZONE '{RESTAURANT_TZ_NAME}';
+        hi TIMESTAMP WITH TIME ZONE := (date_trunc('month', month::timestamp) + INTERVAL '1 month') AT TIME ZONE '{RESTAURANT_TZ_NAME}';
+    BEGIN
+        IF to_regclass(part) IS NULL THEN
+            IF to_regclass(deflt) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', part, parent, lo, hi);
+            ELSE
+                SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO cols
+                FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = parent AND is_generated = 'NEVER';
+                EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING GENERATED)', part, parent);
+                EXECUTE format('WITH moved AS (DELETE FROM %I WHERE booking_for >= %L AND booking_for < %L RETURNING %s) ' ||
+                               'INSERT INTO %I (%s) SELECT %s FROM moved', deflt, lo, hi, cols, part, cols, cols);
+                -- Индексы родительской таблицы (и первичный ключ) ATTACH создаст сам
+                EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', parent, part, lo, hi);
+            END IF;
+        END IF;
+        IF hi > NOW() THEN
+            EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I (user_id, booking_for)', part || '_user_upcoming', part);
+        END IF;
+        RETURN part;
+    END $$;
+"""
+
+# Миграция: существующая bookings переименовывается, её строки переносятся в
+# новую партиционированную таблицу с тем же набором столбцов и той же
+# последовательностью booking_id. Первичный ключ обязан включать ключ
+# партиционирования, поэтому он (booking_id, booking_for), а booking_for — NOT NULL.
+BOOKINGS_PARTITION_SQL = (
+    f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};",
+    PARTITION_FUNCTION_SQL,
+    f"""
+    DO $$
+    DECLARE
+        seq TEXT;
+        cols TEXT;
+        first_month TIMESTAMP;
+        this_month TIMESTAMP := date_trunc('month', NOW() AT TIME ZONE '{RESTAURANT_TZ_NAME}');
+        m DATE;
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'bookings'::regclass) THEN
+            RETURN;
+        END IF;
+        IF EXISTS (SELECT 1 FROM bookings WHERE booking_for IS NULL) THEN
+            RAISE EXCEPTION 'bookings: есть брони без booking_for, их нельзя разложить по партициям';
+        END IF;
+
+        seq := pg_get_serial_sequence('bookings', 'booking_id');
+        ALTER TABLE bookings RENAME TO bookings_unpartitioned;
+        -- Имена индексов общие на схему: освобождаем bookings_pkey для новой таблицы
+        ALTER INDEX IF EXISTS bookings_pkey RENAME TO bookings_unpartitioned_pkey;
+        IF seq IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', seq);
+        END IF;
+
+        CREATE TABLE bookings (LIKE bookings_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED)
+            PARTITION BY RANGE (booking_for);
+        ALTER TABLE bookings ALTER COLUMN booking_for SET NOT NULL;
+        ALTER TABLE bookings ADD PRIMARY KEY (booking_id, booking_for);
+
+        SELECT date_trunc('month', min(booking_for) AT TIME ZONE '{RESTAURANT_TZ_NAME}') INTO first_month
+        FROM bookings_unpartitioned;
+        FOR m IN
+            SELECT generate_series(LEAST(COALESCE(first_month, this_month), this_month),
+                                   this_month + INTERVAL '3 months', INTERVAL '1 month')::date
+        LOOP
+            PERFORM ensure_month_partition('bookings', m);
+        END LOOP;
+        -- Брони дальше подготовленных месяцев; PartitionManager переносит их в партицию месяца, когда создаёт её
+        CREATE TABLE bookings_default PARTITION OF bookings DEFAULT;
+
+        SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO cols
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'bookings_unpartitioned' AND is_generated = 'NEVER';
+        EXECUTE format('INSERT INTO bookings (%s) SELECT %s FROM bookings_unpartitioned', cols, cols);
+
+        DROP TABLE bookings_unpartitioned;
+        IF seq IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY bookings.booking_id', seq);
+        END IF;
+    END $$;
+    """,
+    # Индексы на родительской таблице создаются и во всех партициях (в том числе будущих);
+    # индекс по пользователю — только у партиций с будущими бронями (см. ensure_month_partition)
+    "CREATE INDEX IF NOT EXISTS idx_bookings_conflict ON bookings (table_id, booking_for);",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_keyset ON bookings (booking_for, booking_id);",
+    "CREATE INDEX IF NOT EXISTS idx_bookings_booked_at ON bookings (booked_at DESC);",
+    # Если миграция напоминаний уже была, колонка reminded_at скопирована LIKE, а индекс — нет
+    f"""
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = 'bookings' AND column_name = 'reminded_at') THEN
+            EXECUTE {REMINDER_INDEX_SQL.rstrip(';')!r};
+        END IF;
+    END $$;
+    """,
+)
+
+_PARTITION_NAME_RE = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def _scalar(row):
+    """Первое значение строки: пул отдаёт словари (RealDictCursor), обычный курсор — кортежи."""
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def add_months(month: date, n: int) -> date:
+    """Первое число месяца, отстоящего от month на n месяцев (n может быть отрицательным)."""
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_month(name):
+    """Месяц партиции по её имени (<parent>_pГГГГММ) или None для чужих таблиц."""
+    match = _PARTITION_NAME_RE.search(name)
+    if not match:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def ensure_partitions(cur, parent, first_month, last_month):
+    """Создаёт недостающие партиции parent с first_month по last_month включительно."""
+    month = first_month.replace(day=1)
+    names = []
+    while month <= last_month:
+        cur.execute("SELECT ensure_month_partition(%s, %s);", (parent, month))
+        names.append(_scalar(cur.fetchone()))
+        month = add_months(month, 1)
+    return names
+
+
+def attached_partitions(cur, parent):
+    """{имя партиции: месяц} для партиций, присоединённых к parent."""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass;
+    """, (parent,))
+    result = {}
+    for row in cur.fetchall():
+        name = _scalar(row)
+        month = partition_month(name)
+        if month is not None:
+            result[name] = month
+    return result
+
+
+def archive_partition(cur, parent, name, schema=ARCHIVE_SCHEMA):
+    """Отсоединяет партицию и переносит её в архивную схему."""
+    cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {};").format(sql.Identifier(parent), sql.Identifier(name)))
+    cur.execute(sql.SQL("ALTER TABLE {} SET SCHEMA {};").format(sql.Identifier(name), sql.Identifier(schema)))
+
+
+class PartitionManager:
+    """Фоновый поток обслуживания партиций parent (см. описание модуля).
+
+    premake_months — на сколько месяцев вперёд держать готовые партиции,
+    retain_months — сколько прошедших месяцев оставлять в горячей таблице
+    (0 — не архивировать), lock_timeout — сколько ждать блокировку родительской
+    таблицы при отсоединении, прежде чем отложить его до следующего цикла.
+    """
+
+    def __init__(self, db_connection, parent="bookings", premake_months=3, retain_months=12,
+                 interval=3600.0, lock_timeout=2.0, archive_schema=ARCHIVE_SCHEMA, lock_key=PARTITION_LOCK_KEY):
+        self.db_connection = db_connection
+        self.parent = parent
+        self.premake_months = premake_months
+        self.retain_months = retain_months
+        self.interval = interval
+        self.lock_timeout = lock_timeout
+        self.archive_schema = archive_schema
+        self.lock_key = lock_key
+        self.pid = os.getpid()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"runs": 0, "skipped": 0, "archived": 0, "errors": 0, "partitions": 0, "last_run_ts": 0.0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"{self.parent}-partitions", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                self._incr("errors")
+                log.error("Ошибка обслуживания партиций %s: %s", self.parent, e, exc_info=True)
+            self._stop.wait(self.interval)
+
+    def _try_lock(self, cur):
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (self.lock_key,))
+        return _scalar(cur.fetchone())
+
+    def maintain(self):
+        """Один цикл обслуживания; возвращает список архивированных партиций."""
+        this_month = now_local().date().replace(day=1)
+        # Создание партиций — отдельной транзакцией: неудачное отсоединение его не откатит
+        with self.db_connection() as conn:
+            with conn.cursor() as cur:
+                if not self._try_lock(cur):
+                    self._incr("skipped")
+                    return []
+                ensure_partitions(cur, self.parent, this_month, add_months(this_month, self.premake_months))
+
+        archived = []
+        with self.db_connection() as conn:
+            with conn.cursor() as cur:
+                if not self._try_lock(cur):
+                    self._incr("skipped")
+                    return []
+                cur.execute("SELECT set_config('lock_timeout', %s, true);", (f"{int(self.lock_timeout * 1000)}ms",))
+                partitions = attached_partitions(cur, self.parent)
+                oldest_kept = add_months(this_month, -self.retain_months)
+                for name, month in sorted(partitions.items(), key=lambda item: item[1]):
+                    if month >= this_month:
+                        continue
+                    if self.retain_months and month < oldest_kept:
+                        archive_partition(cur, self.parent, name, self.archive_schema)
+                        archived.append(name)
+                    else:
+                        # Месяц закончился — будущих броней в партиции нет, индекс по пользователю не нужен
+                        cur.execute(sql.SQL("DROP INDEX IF EXISTS {};").format(sql.Identifier(f"{name}_user_upcoming")))
+
+        if archived:
+            log.info("Партиции перенесены в архив", extra={"partitions": archived, "schema": self.archive_schema})
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["archived"] += len(archived)
+            self._stats["partitions"] = len(partitions) - len(archived)
+            self._stats["last_run_ts"] = utc_now().timestamp()
+        return archived
+
+    # ---------- остановка и статистика ----------
+    def shutdown(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _incr(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["alive"] = bool(self._thread and self._thread.is_alive())
+        return snapshot
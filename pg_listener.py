@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+import select
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+log = logging.getLogger("lis.pg_listener")
+
+# =========================
+# LISTEN/NOTIFY МЕЖДУ ВОРКЕРАМИ
+# =========================
+# Каждый воркер держит одно выделенное соединение с LISTEN на канал и вызывает
+# подписчиков на каждое уведомление. Писатели шлют pg_notify в той же транзакции,
+# что и запись, поэтому уведомление уходит только после COMMIT.
+
+BOOKINGS_CHANNEL = "bookings_changed"
+
+
+NOTIFY_SQL = "SELECT pg_notify(%s, %s);"
+
+
+def booking_change_payload(op, table_id, booking_for, booking_id=None, user_id=None):
+    """JSON уведомления об изменении брони (его разбирают подписчики PgListener)."""
+    return json.dumps({
+        "op": op,
+        "table_id": int(table_id) if table_id is not None else None,
+        "booking_for": booking_for.isoformat() if booking_for is not None else None,
+        "booking_id": booking_id,
+        "user_id": user_id,
+        "pid": os.getpid(),
+    })
+
+
+def notify_booking_change(cur, op, table_id, booking_for, booking_id=None, user_id=None):
+    """Ставит уведомление об изменении брони в текущую транзакцию (уйдёт при COMMIT)."""
+    cur.execute(NOTIFY_SQL, (BOOKINGS_CHANNEL, booking_change_payload(op, table_id, booking_for, booking_id, user_id)))
+
+
+class PgListener:
+    """Фоновый поток: LISTEN на канал, раздача уведомлений подписчикам.
+
+    После переподключения вызываются on_reconnect-подписчики: уведомления,
+    пришедшие во время разрыва, потеряны, и кэши нужно сбросить целиком.
+    """
+
+    def __init__(self, dsn, channel=BOOKINGS_CHANNEL, reconnect_delay=5.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.pid = os.getpid()
+        self._subscribers = []
+        self._reconnect_subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+        self.received = 0
+        self.reconnects = 0
+
+    def subscribe(self, callback, on_reconnect=None):
+        self._subscribers.append(callback)
+        if on_reconnect is not None:
+            self._reconnect_subscribers.append(on_reconnect)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"pg-listen-{self.channel}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel};")
+                if not first:
+                    self.reconnects += 1
+                    for callback in self._reconnect_subscribers:
+                        callback()
+                first = False
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.received += 1
+                        try:
+                            payload = json.loads(notify.payload)
+                        except ValueError:
+                            continue
+                        for callback in self._subscribers:
+                            try:
+                                callback(payload)
+                            except Exception as e:
+                                log.error("Ошибка обработчика уведомления %s: %s", self.channel, e, exc_info=True)
+            except Exception as e:
+                log.warning("LISTEN %s: соединение потеряно (%s), переподключение через %s с", self.channel, e, self.reconnect_delay)
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def stats(self) -> dict:
+        return {"channel": self.channel, "received": self.received, "reconnects": self.reconnects,
+                "alive": bool(self._thread and self._thread.is_alive())}
@@ -0,0 +1,262 @@
+import itertools
+import re
+from datetime import datetime, time, timedelta, timezone
+
+from psycopg2 import errors as pg_errors
+from psycopg2.extras import execute_values
+
+from clock import local_day, localize, to_local
+
+# =========================
+# ОБЩИЕ ЗАПРОСЫ К БРОНЯМ
+# =========================
+# Границы "дня" считаются в часовом поясе ресторана и передаются как
+# полуинтервал [начало дня, начало следующего дня) по timestamptz.
+# Такой предикат использует индекс idx_bookings_conflict (table_id, booking_for),
+# в отличие от booking_for::date = %s, который заставлял сканировать всю историю стола.
+
+# Режимы проверки пересечений при вставке брони:
+#   "lock"      — SELECT ... FOR UPDATE по броням стола за день и проверка в Python;
+#   "exclusion" — GiST exclusion constraint на tstzrange, пересечение отклоняет сам Postgres.
+CONFLICT_MODES = ("lock", "exclusion")
+
+# Схема для режима "exclusion". Сложение timestamptz с интервалом в часах не зависит
+# от часового пояса, поэтому функцию можно объявить IMMUTABLE и использовать
+# в генерируемом столбце.
+EXCLUSION_SCHEMA_SQL = (
+    "CREATE EXTENSION IF NOT EXISTS btree_gist;",
+    """
+    CREATE OR REPLACE FUNCTION booking_range(ts TIMESTAMP WITH TIME ZONE, hours INT)
+    RETURNS tstzrange LANGUAGE sql IMMUTABLE STRICT
+    AS $$ SELECT tstzrange($1, $1 + $2 * INTERVAL '1 hour', '[)') $$;
+    """,
+    """
+    ALTER TABLE bookings ADD COLUMN IF NOT EXISTS booked_range tstzrange
+        GENERATED ALWAYS AS (booking_range(booking_for, COALESCE(duration_hours, 1))) STORED;
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'bookings_no_overlap') THEN
+            ALTER TABLE bookings ADD CONSTRAINT bookings_no_overlap
+                EXCLUDE USING gist (table_id WITH =, booked_range WITH &&);
+        END IF;
+    END $$;
+    """,
+)
+
+
+# Ключ курсора админ-панели (booking_for, booking_id) кодируется в callback_data
+# как микросекунды от эпохи — так он короткий и точный.
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_keyset(booking_for, booking_id):
+    return f"{(booking_for - _EPOCH) // timedelta(microseconds=1)}_{booking_id}"
+
+
+def decode_keyset(value):
+    us, booking_id = value.split("_")
+    return _EPOCH + timedelta(microseconds=int(us)), int(booking_id)
+
+
+class BookingConflict(Exception):
+    """Стол уже занят на выбранное время."""
+
+
+def day_bounds(day):
+    """Возвращает (начало дня, начало следующего дня) в часовом поясе ресторана."""
+    return localize(day, time.min), localize(day + timedelta(days=1), time.min)
+
+
+BOOKING_COLUMNS = "user_id, user_name, phone, table_id, time_slot, guests, booked_at, booking_for, duration_hours"
+
+INSERT_BOOKING_SQL = f"""
+    INSERT INTO bookings ({BOOKING_COLUMNS})
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING booking_id;
+"""
+
+# Пакетная вставка (execute_values): один INSERT на все брони пакета
+INSERT_BOOKINGS_VALUES_SQL = f"INSERT INTO bookings ({BOOKING_COLUMNS}) VALUES %s RETURNING booking_id;"
+
+
+TABLE_DAY_BOOKINGS_SQL = """
+    SELECT booking_id, booking_for, duration_hours
+    FROM bookings
+    WHERE table_id = %s AND booking_for >= %s AND booking_for < %s
+"""
+
+
+def pg_params(sql):
+    """SQL с плейсхолдерами psycopg2 (%s) -> нумерованные плейсхолдеры Postgres ($1, $2, ...)."""
+    counter = itertools.count(1)
+    return re.sub(r"%s", lambda _: f"${next(counter)}", sql)
+
+
+# Запросы пути брони готовятся (PREPARE) один раз на соединение — см. prepare_statements,
+# который пул вызывает для каждого нового соединения. Дальше EXECUTE передаёт только
+# параметры, без повторного разбора и планирования.
+PREPARED_STATEMENTS = {
+    "booking_insert": pg_params(INSERT_BOOKING_SQL),
+    "booking_lock_table_day": pg_params(TABLE_DAY_BOOKINGS_SQL + " FOR UPDATE;"),
+}
+_EXECUTE_SQL = {
+    name: f"EXECUTE {name} ({', '.join(['%s'] * sql.count('$'))});" for name, sql in PREPARED_STATEMENTS.items()
+}
+
+
+def prepare_statements(conn):
+    """PREPARE всех запросов PREPARED_STATEMENTS на соединении (ConnectionPool(configure=...))."""
+    with conn.cursor() as cur:
+        for name, sql in PREPARED_STATEMENTS.items():
+            cur.execute(f"PREPARE {name} AS {sql}")
+
+
+def execute_prepared(cur, name, params):
+    cur.execute(_EXECUTE_SQL[name], params)
+
+
+def fetch_table_day_bookings(cur, table_id, day, for_update=False):
+    """Брони стола за день (по времени ресторана). for_update=True блокирует найденные строки."""
+    start, end = day_bounds(day)
+    sql = TABLE_DAY_BOOKINGS_SQL
+    if for_update:
+        sql += " FOR UPDATE"
+    cur.execute(sql + ";", (table_id, start, end))
+    return cur.fetchall()
+
+
+def fetch_bookings_by_table_day(cur, date_from, date_to, table_ids=None):
+    """Брони всех (или перечисленных) столов за даты [date_from, date_to] одним запросом.
+
+    Возвращает {table_id: {date: [бронь, ...]}}; столы без броней тоже попадают в ответ.
+    """
+    start, _ = day_bounds(date_from)
+    _, end = day_bounds(date_to)
+    cur.execute("""
+        SELECT t.id AS table_id, b.booking_for, b.duration_hours
+        FROM tables t
+        LEFT JOIN bookings b
+          ON b.table_id = t.id AND b.booking_for >= %s AND b.booking_for < %s
+        WHERE %s::int[] IS NULL OR t.id = ANY(%s::int[])
+        ORDER BY t.id, b.booking_for;
+    """, (start, end, table_ids, table_ids))
+
+    result = {}
+    for row in cur:
+        per_day = result.setdefault(row['table_id'], {})
+        if row['booking_for'] is not None:
+            day = local_day(row['booking_for'])
+            per_day.setdefault(day, []).append(row)
+    return result
+
+
+def fetch_tables_day(cur, day):
+    """Все столы (вместимость, зона) и их брони за день одним запросом — строки для TableAllocator.build."""
+    start, end = day_bounds(day)
+    cur.execute("""
+        SELECT t.id AS table_id, t.capacity, t.zone, b.booking_for, b.duration_hours
+        FROM tables t
+        LEFT JOIN bookings b
+          ON b.table_id = t.id AND b.booking_for >= %s AND b.booking_for < %s
+        ORDER BY t.id, b.booking_for;
+    """, (start, end))
+    return cur.fetchall()
+
+
+def has_overlap(existing_bookings, booking_start, booking_end):
+    """Проверяет пересечение интервала [booking_start, booking_end) с существующими бронями."""
+    for b in existing_bookings:
+        b_start = to_local(b['booking_for'])
+        b_end = b_start + timedelta(hours=b.get('duration_hours') or 1)
+        if booking_start < b_end and booking_end > b_start:
+            return True
+    return False
+
+
+def insert_booking(cur, conflict_mode, user_id, user_name, phone, table_id, time_slot, guests,
+                   booked_at, booking_start, duration_hours):
+    """Вставляет бронь в текущей транзакции и возвращает booking_id.
+
+    При пересечении с существующей бронью бросает BookingConflict; транзакцию
+    после этого нужно откатить. Соединение должно быть из пула (с prepare_statements).
+    """
+    params = (user_id, user_name, phone, table_id, time_slot, guests, booked_at, booking_start, duration_hours)
+    if conflict_mode == "exclusion":
+        try:
+            execute_prepared(cur, "booking_insert", params)
+        except pg_errors.ExclusionViolation as e:
+            raise BookingConflict(f"Стол {table_id} уже занят на {booking_start}.") from e
+    else:
+        booking_end = booking_start + timedelta(hours=duration_hours)
+        execute_prepared(cur, "booking_lock_table_day", (table_id, *day_bounds(local_day(booking_start))))
+        if has_overlap(cur.fetchall(), booking_start, booking_end):
+            raise BookingConflict(f"Стол {table_id} уже занят на {booking_start}.")
+        execute_prepared(cur, "booking_insert", params)
+    return cur.fetchone()['booking_id']
+
+
+def insert_bookings(cur, conflict_mode, rows):
+    """Вставляет пакет броней одной транзакцией; rows — кортежи в порядке BOOKING_COLUMNS.
+
+    Возвращает booking_id в порядке rows. Если хоть одна бронь пересекается с
+    существующей или с другой бронью пакета — BookingConflict, не вставляется ничего.
+    """
+    if conflict_mode == "lock":
+        # Брони каждого (стол, день) блокируются один раз и всегда в одном порядке,
+        # поэтому два пакета с общими столами не получат взаимной блокировки
+        taken = {}
+        for row in sorted(rows, key=lambda r: (r[3], r[7])):
+            table_id, booking_start, duration_hours = row[3], row[7], row[8]
+            key = (table_id, local_day(booking_start))
+            if key not in taken:
+                execute_prepared(cur, "booking_lock_table_day", (table_id, *day_bounds(key[1])))
+                taken[key] = list(cur.fetchall())
+            if has_overlap(taken[key], booking_start, booking_start + timedelta(hours=duration_hours)):
+                raise BookingConflict(f"Стол {table_id} уже занят на {booking_start}.")
+            taken[key].append({"booking_for": booking_start, "duration_hours": duration_hours})
+    try:
+        result = execute_values(cur, INSERT_BOOKINGS_VALUES_SQL, rows, page_size=max(1, len(rows)), fetch=True)
+    except pg_errors.ExclusionViolation as e:
+        raise BookingConflict("Одна из броней пакета пересекается с уже существующей.") from e
+    return [r['booking_id'] for r in result]
+
+
+def fetch_active_bookings_page(cur, limit, direction="first", anchor=None):
+    """Страница будущих броней для админ-панели (keyset-пагинация по (booking_for, booking_id)).
+
+    direction: "first" — с начала; "next" — после anchor; "prev" — до anchor; "at" — начиная с anchor.
+    Возвращает (rows, has_more): has_more — есть ли ещё строки в направлении движения.
+    """
+    columns = "booking_id, user_name, table_id, time_slot, booking_for, phone"
+    if direction == "first":
+        cur.execute(f"""
+            SELECT {columns} FROM bookings
+            WHERE booking_for > NOW()
+            ORDER BY booking_for, booking_id
+            LIMIT %s;
+        """, (limit + 1,))
+    elif direction in ("next", "at"):
+        op = ">" if direction == "next" else ">="
+        cur.execute(f"""
+            SELECT {columns} FROM bookings
+            WHERE booking_for > NOW() AND (booking_for, booking_id) {op} (%s, %s)
+            ORDER BY booking_for, booking_id
+            LIMIT %s;
+        """, (*anchor, limit + 1))
+    elif direction == "prev":
+        cur.execute(f"""
+            SELECT {columns} FROM bookings
+            WHERE booking_for > NOW() AND (booking_for, booking_id) < (%s, %s)
+            ORDER BY booking_for DESC, booking_id DESC
+            LIMIT %s;
+        """, (*anchor, limit + 1))
+    else:
+        raise ValueError(f"Неизвестное направление: {direction}")
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "prev":
+        rows.reverse()
+    return rows, has_more
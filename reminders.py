@@ -0,0 +1,317 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+from psycopg2 import extensions
+
+from clock import local_date_str, utc_now
+from outbox import enqueue_message
+
+log = logging.getLogger("lis.reminders")
+
+# =========================
+# НАПОМИНАНИЯ О БРОНЯХ
+# =========================
+# Гостю приходит напоминание за lead секунд до брони. Отправленное отмечается
+# в bookings.reminded_at той же транзакцией, что кладёт сообщение в outbox,
+# поэтому напоминание уходит не больше одного раза, даже если владельцев
+# планировщика на время стало два или процесс упал посреди отправки.
+#
+# Из БД читается только ближайшее окно: брони, чьё напоминание наступает в
+# ближайшие window секунд (диапазон по частичному индексу idx_bookings_reminder_due,
+# в который входят только ещё не напомненные брони). Окно перечитывается раз в
+# reload_interval, найденное лежит в куче по времени напоминания. Новые брони и
+# отмены этого процесса (и других воркеров — через LISTEN при BOOKINGS_NOTIFY=1)
+# попадают в кучу сразу; отменённые просто не найдутся при отправке.
+#
+# Планировщик запущен в каждом воркере, но работает только тот, кто держит
+# сессионный pg_try_advisory_lock на отдельном соединении. Если владелец умер,
+# Postgres снимает блокировку вместе с соединением, и её берёт другой воркер.
+# Остальные воркеры раз в elect_interval повторяют попытку на своём постоянном
+# соединении, не подключаясь заново.
+
+# Произвольная константа: ключ advisory lock владельца планировщика
+REMINDER_LOCK_KEY = 7_305_418_022_119
+
+REMINDER_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_bookings_reminder_due ON bookings (booking_for) WHERE reminded_at IS NULL;"
+)
+REMINDER_SCHEMA_SQL = (
+    "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS reminded_at TIMESTAMP WITH TIME ZONE;",
+    REMINDER_INDEX_SQL,
+)
+
+# Брони без напоминания в окне [start, end) по booking_for. Бронь, оформленная
+# позже момента напоминания, его не получает (гость и так только что её сделал).
+DUE_REMINDERS_SQL = """
+    SELECT booking_id, booking_for
+    FROM bookings
+    WHERE reminded_at IS NULL
+      AND booking_for >= %(start)s AND booking_for < %(end)s
+      AND user_id IS NOT NULL
+      AND booked_at <= booking_for - make_interval(secs => %(lead)s)
+    ORDER BY booking_for
+    LIMIT %(limit)s;
+"""
+
+# Диапазон booking_for отсекает лишние партиции при BOOKINGS_STORAGE=partitioned
+CLAIM_REMINDERS_SQL = """
+    UPDATE bookings SET reminded_at = NOW()
+    WHERE booking_id = ANY(%(ids)s)
+      AND booking_for >= %(first)s AND booking_for <= %(last)s
+      AND reminded_at IS NULL AND booking_for > NOW() AND user_id IS NOT NULL
+    RETURNING booking_id, user_id, table_id, time_slot, booking_for, guests;
+"""
+
+
+def reminder_text(row):
+    return (
+        "⏰ Напоминаем о вашей брони!\n\n"
+        f"Стол: {row['table_id']}\nДата: {local_date_str(row['booking_for'])}\nВремя: {row['time_slot']}\n"
+        f"Гостей: {row['guests'] or 'не указано'}\n\n"
+        "Если планы изменились, отмените бронь кнопкой «📋 Моя бронь»."
+    )
+
+
+class ReminderScheduler:
+    """Фоновый поток напоминаний (см. описание модуля).
+
+    lead — за сколько секунд до брони напоминать, window — на сколько секунд
+    вперёд загружать напоминания, reload_interval — как часто перечитывать окно,
+    grace — насколько можно опоздать с напоминанием (простой, смена владельца),
+    max_loaded — сколько напоминаний держать в памяти за раз.
+    on_enqueued() вызывается после COMMIT отправленной пачки (будит ретранслятор outbox).
+    """
+
+    def __init__(self, dsn, db_connection, lead=7200.0, window=3600.0, reload_interval=60.0, grace=900.0,
+                 batch_size=100, max_loaded=10000, elect_interval=15.0, lock_key=REMINDER_LOCK_KEY,
+                 on_enqueued=None):
+        self.dsn = dsn
+        self.db_connection = db_connection
+        self.lead = lead
+        self.window = window
+        self.reload_interval = reload_interval
+        self.grace = grace
+        self.batch_size = batch_size
+        self.max_loaded = max_loaded
+        self.elect_interval = elect_interval
+        self.lock_key = lock_key
+        self.on_enqueued = on_enqueued
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_conn = None
+        self._owner = False
+        self._heap = []          # (время напоминания, booking_id); устаревшие записи пропускаются
+        self._due = {}           # booking_id -> время напоминания (epoch)
+        self._loaded_until = 0.0  # напоминания до этого момента уже в куче
+        self._next_reload = 0.0
+        self._stats = {"elections": 0, "loads": 0, "loaded": 0, "fired": 0, "skipped": 0, "errors": 0,
+                       "added": 0, "removed": 0, "lateness_max_sec": 0.0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+        self._thread.start()
+        return self
+
+    # ---------- владение ----------
+    def _elect(self):
+        """Пытается стать владельцем.
+
+        Соединение для блокировки открывается один раз и держится всё время жизни
+        процесса: не-владелец повторяет pg_try_advisory_lock на нём же и
+        переподключается, только если соединение оборвалось.
+        """
+        if self._lock_conn is None or self._lock_conn.closed:
+            self._lock_conn = psycopg2.connect(self.dsn, connect_timeout=10)
+            self._lock_conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        try:
+            with self._lock_conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s);", (self.lock_key,))
+                acquired = cur.fetchone()[0]
+        except Exception:
+            self._close_lock_conn()
+            raise
+        if not acquired:
+            return False
+        with self._lock:
+            self._owner = True
+            self._stats["elections"] += 1
+        self._next_reload = 0.0
+        log.info("Планировщик напоминаний: этот процесс — владелец", extra={"pid": self.pid})
+        return True
+
+    def _check_lock(self):
+        """Соединение с блокировкой живо? Иначе блокировку мог взять другой воркер."""
+        try:
+            with self._lock_conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except Exception as e:
+            log.warning("Планировщик напоминаний: соединение с блокировкой потеряно: %s", e)
+            self._step_down()
+            return False
+
+    def _step_down(self):
+        with self._lock:
+            self._owner = False
+            self._heap.clear()
+            self._due.clear()
+            self._loaded_until = 0.0
+        self._close_lock_conn()
+
+    def _close_lock_conn(self):
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.close()
+            except Exception:
+                pass
+            self._lock_conn = None
+
+    # ---------- основной цикл ----------
+    def _run(self):
+        next_check = 0.0
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                now = time.time()
+                if not self._owner:
+                    if not self._elect():
+                        self._stop.wait(self.elect_interval)
+                        continue
+                    next_check = now + self.elect_interval
+                elif now >= next_check:
+                    if not self._check_lock():
+                        continue
+                    next_check = now + self.elect_interval
+                if now >= self._next_reload:
+                    self.reload()
+                self._fire_due()
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                log.error("Ошибка планировщика напоминаний: %s", e, exc_info=True)
+                self._stop.wait(self.elect_interval)
+                continue
+            with self._lock:
+                next_due = self._heap[0][0] if self._heap else float("inf")
+            self._wake.wait(max(0.0, min(next_due, self._next_reload, next_check) - time.time()))
+
+    def reload(self):
+        """Загружает напоминания следующего окна из БД (диапазонный запрос по индексу)."""
+        now = utc_now()
+        start = now + timedelta(seconds=max(0.0, self.lead - self.grace))
+        end = now + timedelta(seconds=self.lead + self.window)
+        with self.db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(DUE_REMINDERS_SQL, {"start": start, "end": end, "lead": self.lead, "limit": self.max_loaded})
+                rows = cur.fetchall()
+        loaded_until = end.timestamp() - self.lead
+        if len(rows) >= self.max_loaded:
+            # Окно не поместилось: остаток догрузится, когда подойдёт его время
+            loaded_until = rows[-1]['booking_for'].timestamp() - self.lead
+        with self._lock:
+            for row in rows:
+                self._push(row['booking_id'], row['booking_for'].timestamp() - self.lead)
+            self._loaded_until = loaded_until
+            self._stats["loads"] += 1
+            self._stats["loaded"] = len(self._due)
+        self._next_reload = time.time() + min(self.reload_interval, max(1.0, loaded_until - time.time()))
+        return len(rows)
+
+    def _push(self, booking_id, due):
+        if self._due.get(booking_id) == due:
+            return
+        self._due[booking_id] = due
+        heapq.heappush(self._heap, (due, booking_id))
+
+    def _pop_due(self, now):
+        batch = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                due, booking_id = heapq.heappop(self._heap)
+                if self._due.get(booking_id) != due:
+                    continue  # отменена или перенесена
+                del self._due[booking_id]
+                batch.append((booking_id, due))
+        return batch
+
+    def _fire_due(self):
+        while not self._stop.is_set():
+            now = time.time()
+            batch = self._pop_due(now)
+            if not batch:
+                return
+            self._fire(batch, now)
+
+    def _fire(self, batch, now):
+        """Отмечает reminded_at и кладёт напоминания в outbox одной транзакцией."""
+        ids = [booking_id for booking_id, _ in batch]
+        dues = [due for _, due in batch]
+        params = {"ids": ids,
+                  "first": datetime.fromtimestamp(min(dues) + self.lead, timezone.utc),
+                  "last": datetime.fromtimestamp(max(dues) + self.lead, timezone.utc)}
+        with self.db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(CLAIM_REMINDERS_SQL, params)
+                rows = cur.fetchall()
+                for row in rows:
+                    enqueue_message(cur, row['user_id'], reminder_text(row))
+        if rows and self.on_enqueued is not None:
+            self.on_enqueued()
+        with self._lock:
+            self._stats["fired"] += len(rows)
+            # Отменённые, уже напомненные (другим владельцем) или уже начавшиеся
+            self._stats["skipped"] += len(ids) - len(rows)
+            self._stats["lateness_max_sec"] = max(self._stats["lateness_max_sec"], now - min(dues))
+            self._stats["loaded"] = len(self._due)
+
+    # ---------- изменения броней ----------
+    def add(self, booking_id, booking_for, booked_at=None):
+        """Новая бронь (после COMMIT): попадает в кучу, если её напоминание в уже загруженном окне."""
+        due = booking_for.timestamp() - self.lead
+        if booked_at is not None and booked_at.timestamp() > due:
+            return
+        with self._lock:
+            if not self._owner or due > self._loaded_until or due < time.time() - self.grace:
+                return
+            self._push(booking_id, due)
+            self._stats["added"] += 1
+            self._stats["loaded"] = len(self._due)
+        self._wake.set()
+
+    def remove(self, booking_id):
+        """Отменённая бронь: запись в куче становится устаревшей."""
+        with self._lock:
+            if self._due.pop(booking_id, None) is not None:
+                self._stats["removed"] += 1
+                self._stats["loaded"] = len(self._due)
+
+    def invalidate(self):
+        """Перечитать окно при следующем проходе (например, после потери LISTEN)."""
+        self._next_reload = 0.0
+        self._wake.set()
+
+    def shutdown(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._step_down()
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                "owner": self._owner,
+                "heap": len(self._heap),
+                "loaded_until_ts": self._loaded_until,
+                "lead_sec": self.lead,
+            })
+        return snapshot
@@ -0,0 +1,185 @@
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+log = logging.getLogger("lis.replicas")
+
+# =========================
+# ЧТЕНИЕ С РЕПЛИК
+# =========================
+# Запросы, которые только читают (свободные слоты стола, "Моя бронь", история и
+# админ-панель), можно отправлять на реплики и не занимать ими основную БД, где
+# брони держат FOR UPDATE. Реплика выбирается по кругу среди тех, что не отстают.
+#
+# Отставание проверяет фоновый поток раз в check_interval: реплика догнала
+# основную БД, если её pg_last_wal_replay_lsn() не меньше pg_current_wal_lsn()
+# основной на момент проверки; иначе отставание — возраст последней применённой
+# транзакции. Реплика, отстающая больше max_lag или давно не отвечавшая,
+# не используется, пока следующая проверка не покажет, что она догнала.
+#
+# Read-your-writes: после записи её ключи (например, ("user", user_id) или
+# ("table_day", стол, день)) помечаются на sticky секунд, и чтения с этими
+# ключами идут в основную БД. sticky должен быть больше max_lag + check_interval:
+# тогда к его концу запись гарантированно есть на любой используемой реплике.
+
+PRIMARY_LSN_SQL = "SELECT pg_current_wal_lsn()::text AS lsn;"
+REPLICA_LAG_SQL = """
+    SELECT pg_is_in_recovery() AS in_recovery,
+           COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, FALSE) AS caught_up,
+           EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8 AS replay_age;
+"""
+
+
+class Replica:
+    """Реплика: пул соединений и результат последней проверки отставания."""
+
+    __slots__ = ("name", "pool", "lag", "checked_at", "error")
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.lag = None         # секунды; None — не проверялась или недоступна
+        self.checked_at = 0.0   # time.monotonic() последней успешной проверки
+        self.error = None
+
+
+class ReplicaRouter:
+    """Выбор соединения для чтения: реплика или основная БД (см. описание модуля).
+
+    pools — {имя: ConnectionPool реплики}, primary() — контекстный менеджер
+    соединения с основной БД (lis.db_connection).
+    """
+
+    def __init__(self, pools, primary, max_lag=5.0, sticky=10.0, check_interval=1.0):
+        self.replicas = [Replica(name, pool) for name, pool in pools.items()]
+        self.primary = primary
+        self.max_lag = max_lag
+        self.sticky = sticky
+        self.check_interval = check_interval
+        # Реплика, не проверенная дольше этого, считается недоступной
+        self.stale_after = max(3 * check_interval, max_lag)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._recent = {}  # ключ -> time.monotonic(), до которого читать из основной БД
+        self._turn = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"reads_replica": 0, "reads_primary_sticky": 0, "reads_primary_lag": 0,
+                       "reads_primary_error": 0, "checks": 0, "check_errors": 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="replica-lag", daemon=True)
+        self._thread.start()
+        return self
+
+    def _incr(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    # ---------- отставание ----------
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                log.warning("Проверка отставания реплик: %s", e)
+            self._stop.wait(self.check_interval)
+
+    def check(self):
+        """Одна проверка отставания всех реплик; заодно чистит истёкшие пометки записей."""
+        with self.primary() as conn:
+            with conn.cursor() as cur:
+                cur.execute(PRIMARY_LSN_SQL)
+                primary_lsn = cur.fetchone()['lsn']
+        for replica in self.replicas:
+            try:
+                with replica.pool.connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(REPLICA_LAG_SQL, (primary_lsn,))
+                        row = cur.fetchone()
+            except Exception as e:
+                self.mark_down(replica, e)
+                self._incr("check_errors")
+                continue
+            if not row['in_recovery'] or row['caught_up']:
+                lag = 0.0
+            else:
+                lag = row['replay_age'] if row['replay_age'] is not None else math.inf
+            if lag > self.max_lag and (replica.lag is None or replica.lag <= self.max_lag):
+                log.warning("Реплика %s отстаёт на %.1f с — чтения идут в основную БД", replica.name, lag)
+            replica.lag, replica.error, replica.checked_at = lag, None, time.monotonic()
+        now = time.monotonic()
+        with self._lock:
+            self._stats["checks"] += 1
+            for key in [k for k, until in self._recent.items() if until <= now]:
+                del self._recent[key]
+
+    def mark_down(self, replica, error):
+        """Реплика недоступна: не используется до следующей успешной проверки."""
+        if replica.error is None:
+            log.warning("Реплика %s недоступна: %s", replica.name, error)
+        replica.lag, replica.error = None, str(error)
+
+    def _usable(self, replica, now):
+        return replica.lag is not None and replica.lag <= self.max_lag and now - replica.checked_at <= self.stale_after
+
+    # ---------- маршрутизация ----------
+    def note_write(self, *keys):
+        """Записи по ключам закоммичены: sticky секунд чтения с этими ключами идут в основную БД."""
+        until = time.monotonic() + self.sticky
+        with self._lock:
+            for key in keys:
+                self._recent[key] = until
+
+    def choose(self, *keys):
+        """Реплика для чтения с ключами keys или None — читать из основной БД."""
+        now = time.monotonic()
+        with self._lock:
+            if any(self._recent.get(key, 0.0) > now for key in keys):
+                self._stats["reads_primary_sticky"] += 1
+                return None
+        usable = [r for r in self.replicas if self._usable(r, now)]
+        if not usable:
+            self._incr("reads_primary_lag")
+            return None
+        self._incr("reads_replica")
+        return usable[next(self._turn) % len(usable)]
+
+    @contextmanager
+    def connection(self, *keys):
+        """Соединение для чтения (commit/rollback и возврат в пул — как у ConnectionPool.connection)."""
+        replica = self.choose(*keys)
+        with ExitStack() as stack:
+            conn = None
+            if replica is not None:
+                try:
+                    conn = stack.enter_context(replica.pool.connection())
+                except Exception as e:
+                    self.mark_down(replica, e)
+                    self._incr("reads_primary_error")
+            if conn is None:
+                conn = stack.enter_context(self.primary())
+            yield conn
+
+    def shutdown(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        for replica in self.replicas:
+            replica.pool.closeall()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["sticky_keys"] = len(self._recent)
+        snapshot["replicas_usable"] = sum(self._usable(r, now) for r in self.replicas)
+        for replica in self.replicas:
+            # -1 — недоступна или отставание неизвестно
+            lag = replica.lag if replica.lag is not None and math.isfinite(replica.lag) else -1.0
+            snapshot[f"{replica.name}_lag_sec"] = lag
+        return snapshot
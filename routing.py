@@ -0,0 +1,96 @@
+# =========================
+# МАРШРУТИЗАЦИЯ КНОПОК И CALLBACK-ЗАПРОСОВ
+# =========================
+# telebot перебирает обработчики по порядку регистрации и для каждого вызывает
+# func-предикат, поэтому обновление, которое не подошло ни к одному, проходит
+# весь список. Router вместо этого держит словари: точный текст кнопки ->
+# обработчик и префикс callback_data -> обработчик. В telebot регистрируется
+# по одному обработчику на вид обновления, и его фильтр — поиск в словаре.
+#
+# Префиксы ищутся по длине: для каждой различной длины префикса (их единицы)
+# — один срез строки и одно обращение к словарю, от самой длинной к короткой,
+# так что "admin_cancel_" выигрывает у "cancel_" независимо от порядка регистрации.
+
+
+class Router:
+    """Таблица маршрутов: text(...) — для кнопок, callback(prefix) — для callback_data."""
+
+    def __init__(self):
+        self.texts = {}      # текст сообщения -> обработчик
+        self.prefixes = {}   # префикс callback_data -> обработчик
+        self._lengths = ()   # длины префиксов по убыванию
+
+    def text(self, *texts):
+        """Декоратор: обработчик сообщений с одним из точных текстов (пробелы по краям не учитываются)."""
+        def register(handler):
+            for text in texts:
+                key = text.strip()
+                if key in self.texts:
+                    raise ValueError(f"Текст '{key}' уже обрабатывает {self.texts[key].__name__}")
+                self.texts[key] = handler
+            return handler
+        return register
+
+    def callback(self, prefix):
+        """Декоратор: обработчик callback-запросов, чей data начинается с prefix."""
+        def register(handler):
+            if prefix in self.prefixes:
+                raise ValueError(f"Префикс '{prefix}' уже обрабатывает {self.prefixes[prefix].__name__}")
+            self.prefixes[prefix] = handler
+            self._lengths = tuple(sorted({len(p) for p in self.prefixes}, reverse=True))
+            return handler
+        return register
+
+    # ---------- поиск ----------
+    def match_text(self, message):
+        """Обработчик для сообщения или None (в т.ч. если текста нет)."""
+        text = message.text
+        if not text:
+            return None
+        return self.texts.get(text.strip())
+
+    def match_callback(self, call):
+        data = call.data
+        if not data:
+            return None
+        for length in self._lengths:
+            if length <= len(data):
+                handler = self.prefixes.get(data[:length])
+                if handler is not None:
+                    return handler
+        return None
+
+    def dispatch_message(self, message):
+        handler = self.match_text(message)
+        if handler is not None:
+            return handler(message)
+
+    def dispatch_callback(self, call):
+        handler = self.match_callback(call)
+        if handler is not None:
+            return handler(call)
+
+    def wrap(self, wrapper):
+        """Заменяет каждый обработчик на wrapper(handler) (например, замер времени)."""
+        wrapped = {}
+        for table in (self.texts, self.prefixes):
+            for key, handler in table.items():
+                if handler not in wrapped:
+                    wrapped[handler] = wrapper(handler)
+                table[key] = wrapped[handler]
+
+    def install(self, bot):
+        """Регистрирует в bot по одному обработчику на сообщения с текстом и на callback-запросы.
+
+        Вызывать после обработчиков команд: telebot проверяет их раньше.
+        """
+        def route_message(message):
+            return self.dispatch_message(message)
+
+        def route_callback(call):
+            return self.dispatch_callback(call)
+
+        # Время замеряется по конкретным обработчикам (metrics.instrument_router), а не по этим обёрткам
+        route_message._metrics_wrapped = route_callback._metrics_wrapped = True
+        bot.register_message_handler(route_message, content_types=["text"], func=self.match_text)
+        bot.register_callback_query_handler(route_callback, func=self.match_callback)
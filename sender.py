@@ -0,0 +1,381 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from dispatch import QueueFull
+
+log = logging.getLogger("lis.sender")
+
+# =========================
+# ИСХОДЯЩИЕ СООБЩЕНИЯ TELEGRAM С ОГРАНИЧЕНИЕМ СКОРОСТИ
+# =========================
+# Обработчики не ходят в Bot API сами, а ставят отправку в очередь.
+# Очередь у каждого чата своя (порядок сообщений в чате сохраняется),
+# скорость ограничена двумя token bucket'ами: на чат (~1 сообщение/с)
+# и общим на бота (~30 сообщений/с).
+#
+# Ответ 429 откладывает чат на retry_after секунд, сетевые ошибки и 5xx
+# повторяются с экспоненциальной задержкой. Уведомления админу, пришедшие
+# в пределах digest_window секунд, склеиваются в одно сообщение-дайджест.
+
+TELEGRAM_TEXT_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n— — —\n\n"
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity в запасе."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now, cost=1):
+        """Через сколько секунд можно будет списать cost токенов (0 — уже можно)."""
+        self._refill(now)
+        # Отправка дороже ёмкости ведра ждёт только полного ведра, а остаток уходит в долг
+        need = min(cost, self.capacity)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self, now, cost=1):
+        self._refill(now)
+        self.tokens -= cost
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("func", "args", "kwargs", "cost", "future", "attempts", "not_before", "digest")
+
+    def __init__(self, func, args=(), kwargs=None, cost=1, not_before=0.0, digest=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.cost = cost
+        self.future = Future()
+        self.attempts = 0
+        self.not_before = not_before
+        self.digest = digest  # ключ дайджеста для маркера склейки, иначе None
+
+
+def _propagate(done, futures):
+    """Переносит результат отправки дайджеста на Future вошедших в него уведомлений."""
+    exc = done.exception()
+    for future in futures:
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(done.result())
+
+
+def _retry_after(exc):
+    params = (exc.result_json or {}).get("parameters") or {}
+    return float(params.get("retry_after") or 1)
+
+
+class OutboundSender:
+    """Очередь исходящих вызовов Bot API с лимитами на чат и на бота.
+
+    global_rate — сообщений в секунду на бота, chat_rate / chat_burst — скорость
+    и допустимая пачка для одного чата, workers — потоков, выполняющих HTTP-вызовы.
+    """
+
+    def __init__(self, bot, global_rate=30.0, chat_rate=1.0, chat_burst=1, workers=4, max_retries=5,
+                 backoff_base=0.5, backoff_max=30.0, digest_window=2.0, queue_size=10000, name="outbound"):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.digest_window = digest_window
+        self.queue_size = queue_size
+        self.name = name
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._queues = {}      # chat_id -> deque[_Job]
+        self._buckets = {}     # chat_id -> TokenBucket
+        self._heap = []        # (ready_at, seq, chat_id): чаты, у которых есть что отправить
+        self._scheduled = set()
+        self._inflight = set()
+        self._digests = {}     # (chat_id, parse_mode) -> [текст, ...]
+        self._global = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._seq = itertools.count()
+        self._pending = 0
+        self._stopping = False
+        self._threads = []
+        self._pruned_at = time.monotonic()
+        self._stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "throttled": 0,
+            "digests": 0,
+            "digest_items": 0,
+        }
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    # ---------- постановка в очередь ----------
+    def submit(self, chat_id, func, args=(), kwargs=None, cost=1) -> Future:
+        """Ставит вызов func(*args, **kwargs) в очередь чата; cost — сколько сообщений он отправит."""
+        return self._enqueue(chat_id, _Job(func, args, kwargs, cost))
+
+    def send_message(self, chat_id, text, **kwargs) -> Future:
+        return self.submit(chat_id, self.bot.send_message, (chat_id, text), kwargs)
+
+    def send_photo(self, chat_id, photo, **kwargs) -> Future:
+        return self.submit(chat_id, self.bot.send_photo, (chat_id, photo), kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs) -> Future:
+        kwargs.update(chat_id=chat_id, message_id=message_id)
+        return self.submit(chat_id, self.bot.edit_message_text, (text,), kwargs)
+
+    def notify(self, chat_id, text, parse_mode=None) -> Future:
+        """Уведомление, которое можно склеить с соседними в дайджест (для чата админа).
+
+        Future завершается, когда отправлено сообщение-дайджест, содержащее этот текст.
+        """
+        if self.digest_window <= 0:
+            return self.send_message(chat_id, text, parse_mode=parse_mode)
+        key = (chat_id, parse_mode)
+        future = Future()
+        with self._cond:
+            items = self._digests.get(key)
+            if items is not None:
+                items.append((text, future))
+                return future
+            self._digests[key] = [(text, future)]
+            try:
+                self._enqueue(chat_id, _Job(None, not_before=time.monotonic() + self.digest_window, digest=key))
+            except Exception:
+                del self._digests[key]
+                raise
+        return future
+
+    def _enqueue(self, chat_id, job):
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError(f"Очередь {self.name} остановлена")
+            if self._pending >= self.queue_size:
+                raise QueueFull(f"Очередь {self.name} переполнена ({self._pending})")
+            self._queues.setdefault(chat_id, deque()).append(job)
+            self._pending += 1
+            self._stats["enqueued"] += 1
+            if chat_id not in self._scheduled and chat_id not in self._inflight:
+                self._schedule(chat_id, time.monotonic())
+            self._cond.notify()
+        return job.future
+
+    def _schedule(self, chat_id, ready_at):
+        self._scheduled.add(chat_id)
+        heapq.heappush(self._heap, (ready_at, next(self._seq), chat_id))
+
+    # ---------- дайджесты ----------
+    def _expand_digest(self, chat_id, queue):
+        """Заменяет маркер дайджеста в голове очереди на обычные отправки склеенного текста."""
+        marker = queue.popleft()
+        self._pending -= 1
+        chat_id, parse_mode = marker.digest
+        items = self._digests.pop(marker.digest, [])
+        marker.future.set_result(None)
+        # Склеиваем целыми уведомлениями, чтобы не разрезать HTML-разметку
+        messages, current, futures = [], "", []
+        for text, future in items:
+            candidate = current + DIGEST_SEPARATOR + text if current else text
+            if current and len(candidate) > TELEGRAM_TEXT_LIMIT - 64:
+                messages.append((current, futures))
+                current, futures = text, []
+            else:
+                current = candidate
+            futures.append(future)
+        if current:
+            messages.append((current, futures))
+        if len(items) > 1:
+            self._stats["digests"] += 1
+            self._stats["digest_items"] += len(items)
+            text, futures = messages[0]
+            messages[0] = (f"📬 Уведомления ({len(items)}):\n\n" + text, futures)
+        for text, futures in reversed(messages):
+            job = _Job(self.bot.send_message, (chat_id, text), {"parse_mode": parse_mode})
+            job.future.add_done_callback(lambda done, futures=futures: _propagate(done, futures))
+            queue.appendleft(job)
+            self._pending += 1
+
+    # ---------- рабочие потоки ----------
+    def _next_job(self):
+        """Ждёт чат, которому можно отправлять, и забирает его головное задание (под self._cond)."""
+        while True:
+            if self._stopping and self._pending == 0:
+                return None, None
+            now = time.monotonic()
+            if now - self._pruned_at > 60:
+                self._prune_buckets(now)
+            if not self._heap:
+                self._cond.wait(1.0)
+                continue
+            ready_at, _, chat_id = self._heap[0]
+            if ready_at > now:
+                self._cond.wait(ready_at - now)
+                continue
+            queue = self._queues[chat_id]
+            job = queue[0]
+            if job.not_before > now and not self._stopping:
+                heapq.heapreplace(self._heap, (job.not_before, next(self._seq), chat_id))
+                continue
+            if job.digest is not None:
+                self._expand_digest(chat_id, queue)
+                if not queue:
+                    heapq.heappop(self._heap)
+                    self._scheduled.discard(chat_id)
+                    del self._queues[chat_id]
+                continue
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            chat_wait = bucket.delay(now, job.cost)
+            if chat_wait > 0:
+                self._stats["throttled"] += 1
+                heapq.heapreplace(self._heap, (now + chat_wait, next(self._seq), chat_id))
+                continue
+            global_wait = self._global.delay(now, job.cost)
+            if global_wait > 0:
+                self._cond.wait(global_wait)
+                continue
+            heapq.heappop(self._heap)
+            self._scheduled.discard(chat_id)
+            self._inflight.add(chat_id)
+            bucket.take(now, job.cost)
+            self._global.take(now, job.cost)
+            return chat_id, job
+
+    def _prune_buckets(self, now):
+        self._pruned_at = now
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._queues and b.full(now)]:
+            del self._buckets[chat_id]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                chat_id, job = self._next_job()
+            if job is None:
+                return
+            retry_in = None
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    self._incr("rate_limited")
+                    retry_in = _retry_after(e)
+                    log.warning("Telegram 429 для чата %s: повтор через %s с", chat_id, retry_in)
+                elif e.error_code >= 500:
+                    retry_in = self._backoff(job)
+                elif "message is not modified" in str(e):
+                    # Повторное редактирование тем же текстом — результат уже на экране
+                    job.future.set_result(None)
+                else:
+                    self._fail(chat_id, job, e)
+            except (requests.RequestException, OSError) as e:
+                # Текст исключения requests содержит URL с токеном бота — в лог пишем только тип
+                log.warning("Сетевая ошибка при отправке в чат %s: %s", chat_id, type(e).__name__)
+                retry_in = self._backoff(job)
+            except Exception as e:
+                self._fail(chat_id, job, e)
+            else:
+                self._incr("sent")
+                job.future.set_result(result)
+
+            if retry_in is not None:
+                job.attempts += 1
+                if job.attempts > self.max_retries:
+                    self._fail(chat_id, job, RuntimeError(f"не отправлено после {self.max_retries} повторов"))
+                    retry_in = None
+                else:
+                    self._incr("retries")
+            self._finish(chat_id, retry_in)
+
+    def _backoff(self, job):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** job.attempts))
+        return delay * (0.5 + random.random() / 2)
+
+    def _incr(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    def _fail(self, chat_id, job, exc):
+        self._incr("failed")
+        log.error("Не удалось выполнить отправку в чат %s: %s", chat_id, exc)
+        if not job.future.done():
+            job.future.set_exception(exc)
+
+    def _finish(self, chat_id, retry_in):
+        with self._cond:
+            self._inflight.discard(chat_id)
+            queue = self._queues[chat_id]
+            now = time.monotonic()
+            if retry_in is not None:
+                # Задание остаётся в голове очереди — порядок сообщений в чате не меняется
+                self._schedule(chat_id, now + retry_in)
+            else:
+                queue.popleft()
+                self._pending -= 1
+                if queue:
+                    self._schedule(chat_id, now)
+                else:
+                    del self._queues[chat_id]
+            self._cond.notify_all()
+
+    # ---------- остановка и статистика ----------
+    def shutdown(self, timeout=10.0):
+        """Отправляет накопленное (дайджесты — без ожидания окна) и останавливает потоки."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        if self._pending:
+            log.warning("%s: при остановке не отправлено %s сообщений", self.name, self._pending)
+
+    def stats(self) -> dict:
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                "pending": self._pending,
+                "chats_waiting": len(self._queues),
+                "inflight": len(self._inflight),
+                "buckets": len(self._buckets),
+                "workers": self.workers,
+                "global_rate": self.global_rate,
+                "chat_rate": self.chat_rate,
+            })
+        return snapshot
@@ -0,0 +1,168 @@
+import asyncio
+import random
+import time
+
+import httpx
+
+from metrics import TELEGRAM_API_SECONDS
+from sender import TokenBucket
+
+# =========================
+# АСИНХРОННЫЙ КЛИЕНТ BOT API
+# =========================
+# Для asgi.py: вызовы Bot API идут через один httpx.AsyncClient (keep-alive,
+# общий пул соединений) и не занимают потоков, пока ждут ответа Telegram.
+# Лимиты те же, что у OutboundSender: token bucket на бота и на чат; вызовы
+# одного чата выполняются по очереди (asyncio.Lock на чат), поэтому порядок
+# сообщений в чате сохраняется. 429 ждёт retry_after, сеть и 5xx повторяются
+# с экспоненциальной задержкой.
+
+
+class TelegramError(Exception):
+    """Ошибка Bot API; error_code — HTTP-код ответа (как у telebot.ApiTelegramException)."""
+
+    def __init__(self, method, error_code, description, retry_after=None):
+        super().__init__(f"{method}: {error_code} {description}")
+        self.error_code = error_code
+        self.description = description
+        self.retry_after = retry_after
+
+
+class AsyncTelegramClient:
+    """Вызовы Bot API из корутин с ограничением скорости и повторами.
+
+    global_rate — сообщений в секунду на бота, chat_rate / chat_burst — скорость
+    и допустимая пачка для одного чата.
+    """
+
+    def __init__(self, token, api_url="https://api.telegram.org", global_rate=30.0, chat_rate=1.0, chat_burst=3,
+                 max_retries=5, backoff_base=0.5, backoff_max=30.0, timeout=10.0, max_connections=100):
+        self.base_url = f"{api_url.rstrip('/')}/bot{token}"
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._http = None
+        self._global = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._buckets = {}      # chat_id -> TokenBucket
+        self._chat_locks = {}   # chat_id -> [asyncio.Lock, число ожидающих вызовов]
+        self._inflight = 0
+        self._stats = {"sent": 0, "failed": 0, "retries": 0, "rate_limited": 0, "throttled": 0}
+
+    async def start(self):
+        self._http = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+        )
+        return self
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    # ---------- вызовы ----------
+    async def send_message(self, chat_id, text, parse_mode=None, **params):
+        if parse_mode:
+            params["parse_mode"] = parse_mode
+        return await self.call("sendMessage", chat_id, chat_id=chat_id, text=text, **params)
+
+    async def call(self, method, chat_id=None, **params):
+        """Вызов метода Bot API; chat_id (если задан) — для лимита и порядка внутри чата."""
+        if chat_id is None:
+            return await self._call_with_retries(method, None, params)
+        entry = self._chat_locks.get(chat_id)
+        if entry is None:
+            entry = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self._inflight += 1
+        try:
+            async with entry[0]:
+                return await self._call_with_retries(method, chat_id, params)
+        finally:
+            self._inflight -= 1
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
+
+    async def _call_with_retries(self, method, chat_id, params):
+        attempt = 0
+        while True:
+            await self._throttle(chat_id)
+            try:
+                result = await self._request(method, params)
+                self._stats["sent"] += 1
+                return result
+            except TelegramError as e:
+                if e.error_code == 429:
+                    self._stats["rate_limited"] += 1
+                    delay = e.retry_after or 1.0
+                elif e.error_code >= 500:
+                    delay = self._backoff(attempt)
+                else:
+                    self._stats["failed"] += 1
+                    raise
+                error = e
+            except httpx.TransportError as e:
+                delay = self._backoff(attempt)
+                error = e
+            if attempt >= self.max_retries:
+                self._stats["failed"] += 1
+                raise error
+            attempt += 1
+            self._stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def _request(self, method, params):
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await self._http.post(f"{self.base_url}/{method}", json=params)
+            status = str(response.status_code)
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - start, method, status)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.status_code == 200 and body.get("ok"):
+            return body.get("result")
+        retry_after = (body.get("parameters") or {}).get("retry_after")
+        raise TelegramError(method, response.status_code, body.get("description") or response.text[:200],
+                            float(retry_after) if retry_after else None)
+
+    # ---------- лимиты ----------
+    async def _throttle(self, chat_id):
+        while True:
+            now = time.monotonic()
+            bucket = None
+            if chat_id is not None:
+                bucket = self._buckets.get(chat_id)
+                if bucket is None:
+                    if len(self._buckets) > 10000:
+                        self._prune_buckets(now)
+                    bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            delay = max(self._global.delay(now), bucket.delay(now) if bucket is not None else 0.0)
+            if delay <= 0:
+                self._global.take(now)
+                if bucket is not None:
+                    bucket.take(now)
+                return
+            self._stats["throttled"] += 1
+            await asyncio.sleep(delay)
+
+    def _prune_buckets(self, now):
+        """Полные вёдра ничего не ограничивают — их можно забыть."""
+        for chat_id in [c for c, b in self._buckets.items() if b.full(now)]:
+            del self._buckets[chat_id]
+
+    def _backoff(self, attempt):
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+    def stats(self) -> dict:
+        snapshot = dict(self._stats)
+        snapshot.update({"inflight": self._inflight, "chats": len(self._buckets)})
+        return snapshot
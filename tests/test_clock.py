@@ -0,0 +1,69 @@
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from availability import AvailabilityEngine
+from clock import RESTAURANT_TZ, local_date_time_str, localize, parse_local
+
+# Москва жила по летнему времени до 2011 года: 28.03.2010 02:00 -> 03:00,
+# 31.10.2010 03:00 -> 02:00. Актуальные переходы — на зоне Europe/Berlin.
+SPRING_FORWARD = date(2010, 3, 28)
+FALL_BACK = date(2010, 10, 31)
+BERLIN = ZoneInfo("Europe/Berlin")
+
+
+def test_parse_local_regular_day():
+    value = parse_local("2026-06-01", "19:30")
+    assert value.utcoffset() == timedelta(hours=3)
+    assert (value.hour, value.minute) == (19, 30)
+
+
+def test_parse_local_spring_forward_shifts_missing_time():
+    value = parse_local(SPRING_FORWARD.isoformat(), "02:30")
+    assert (value.hour, value.minute) == (3, 30)
+    assert value.utcoffset() == timedelta(hours=4)
+
+
+def test_parse_local_fall_back_takes_first_occurrence():
+    value = parse_local(FALL_BACK.isoformat(), "02:30")
+    assert (value.hour, value.minute) == (2, 30)
+    assert value.utcoffset() == timedelta(hours=4)
+    assert value.fold == 0
+
+
+def test_localize_other_zone():
+    spring = localize(date(2026, 3, 29), time(2, 30), BERLIN)
+    assert (spring.hour, spring.utcoffset()) == (3, timedelta(hours=2))
+    fall = localize(date(2026, 10, 25), time(2, 30), BERLIN)
+    assert (fall.hour, fall.utcoffset()) == (2, timedelta(hours=2))
+
+
+def test_local_strings_around_fall_back():
+    first = localize(FALL_BACK, time(2, 30))
+    second = datetime.fromtimestamp(first.timestamp() + 3600, RESTAURANT_TZ)
+    # Один и тот же час повторяется: подписи совпадают, моменты — нет
+    assert local_date_time_str(first) == local_date_time_str(second) == ("31.10.2010", "02:30")
+    assert second.fold == 1
+
+
+def _night_engine():
+    return AvailabilityEngine(RESTAURANT_TZ, open_time=time(0, 0), close_time=time(6, 0), step_minutes=60)
+
+
+def test_slots_spring_forward_skip_missing_hour():
+    grid = _night_engine().day_grid(SPRING_FORWARD)
+    assert grid.minutes == 5 * 60
+    assert [label for _, label in grid.slots] == ["00:00", "01:00", "03:00", "04:00", "05:00"]
+
+
+def test_slots_fall_back_repeat_hour():
+    grid = _night_engine().day_grid(FALL_BACK)
+    assert grid.minutes == 7 * 60
+    assert [label for _, label in grid.slots] == ["00:00", "01:00", "02:00", "02:00", "03:00", "04:00", "05:00"]
+
+
+def test_free_times_fall_back_booking_covers_real_minutes():
+    engine = _night_engine()
+    # Бронь на 2 часа с первого 02:00 занимает оба 02:00, следующий свободный старт — 03:00
+    bookings = [{"booking_for": localize(FALL_BACK, time(2, 0)), "duration_hours": 2}]
+    free = engine.free_times(FALL_BACK, bookings, 1, now_ts=0)
+    assert free == ["00:00", "01:00", "03:00", "04:00", "05:00"]